@@ -71,7 +71,8 @@ export default function ProfilePage() {
         // Preserve other fields
         role: user!.role,
         adminId: user!.adminId,
-        profile_picture: updatedUser.profile_picture
+        profile_picture: updatedUser.profile_picture,
+        avatar_urls: updatedUser.avatar_urls
       }, token!)
 
       setMessage({ type: 'success', content: 'Profile updated successfully' })
@@ -138,7 +139,8 @@ export default function ProfilePage() {
       
       login({
         ...user!,
-        profile_picture: updatedUser.profile_picture
+        profile_picture: updatedUser.profile_picture,
+        avatar_urls: updatedUser.avatar_urls
       }, token!)
 
       setMessage({ type: 'success', content: 'Profile picture updated successfully' })
@@ -167,7 +169,7 @@ export default function ProfilePage() {
               </CardHeader>
               <CardContent className="flex flex-col items-center gap-4">
                 <Avatar className="w-32 h-32">
-                  <AvatarImage src={user.profile_picture ? `http://localhost:8001${user.profile_picture}` : undefined} />
+                  <AvatarImage src={user.profile_picture ? `http://localhost:8001${user.avatar_urls?.lg ?? user.profile_picture}` : undefined} />
                   <AvatarFallback className="text-4xl">{user.name?.charAt(0).toUpperCase()}</AvatarFallback>
                 </Avatar>
                 <Button variant="outline" className="w-full" onClick={() => fileInputRef.current?.click()}>
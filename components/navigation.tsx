@@ -89,7 +89,7 @@ export default function Navigation() {
       <div className="p-4 border-t border-border">
         <Link href="/profile" className="flex items-center space-x-3 mb-4">
           <Avatar className="w-8 h-8">
-            <AvatarImage src={user?.profile_picture ? `http://localhost:8001${user.profile_picture}` : undefined} />
+            <AvatarImage src={user?.profile_picture ? `http://localhost:8001${user.avatar_urls?.sm ?? user.profile_picture}` : undefined} />
             <AvatarFallback className="bg-primary/10 text-primary">
               {user?.name?.charAt(0).toUpperCase()}
             </AvatarFallback>
@@ -152,7 +152,7 @@ export default function Navigation() {
         <div className="hidden md:flex items-center space-x-4">
            <Link href="/profile" className="flex items-center space-x-2">
               <Avatar className="w-8 h-8">
-                <AvatarImage src={user?.profile_picture ? `http://localhost:8001${user.profile_picture}` : undefined} />
+                <AvatarImage src={user?.profile_picture ? `http://localhost:8001${user.avatar_urls?.sm ?? user.profile_picture}` : undefined} />
                 <AvatarFallback className="bg-primary/10 text-primary">
                   {user?.name?.charAt(0).toUpperCase()}
                 </AvatarFallback>
@@ -9,6 +9,7 @@ interface User {
   phone?: string
   adminId?: string
   profile_picture?: string
+  avatar_urls?: Record<string, string> | null
 }
 
 interface AuthContextType {
@@ -0,0 +1,58 @@
+import json
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from app.models.analysis import AnalysisEstimate, AnalysisResult
+from app.schemas.analysis import AnalysisEstimate as AnalysisEstimateSchema
+from app.schemas.analysis import AnalysisResult as AnalysisResultSchema
+
+# Fast path for list endpoints: select only the columns the response schema needs as
+# plain rows, build dicts directly and serialize them with orjson (datetimes and floats
+# come out as pydantic would write them), skipping ORM objects and per-row validation.
+
+try:
+    import orjson
+except ImportError: # optional; falls back to the stdlib encoder
+    orjson = None
+
+def dumps(content) -> bytes:
+    """
+    Compact JSON bytes; orjson when installed, else jsonable_encoder + json.dumps.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse for plain dicts/lists, encoded with dumps().
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+ANALYSIS_FIELDS = [name for name in AnalysisResultSchema.model_fields if name in AnalysisResult.__table__.columns]
+ESTIMATE_FIELDS = list(AnalysisEstimateSchema.model_fields)
+
+def analysis_list_query() -> Select:
+    """
+    AnalysisResultSchema columns plus the quick-look estimate (outer join), one row per analysis.
+    """
+    columns = [AnalysisResult.__table__.c[name] for name in ANALYSIS_FIELDS]
+    columns += [AnalysisEstimate.__table__.c[name].label(f"estimate_{name}") for name in ESTIMATE_FIELDS]
+    return select(*columns).outerjoin(AnalysisEstimate, AnalysisEstimate.analysis_id == AnalysisResult.id)
+
+def analysis_rows(db: Session, query: Select) -> List[dict]:
+    """
+    Rows of analysis_list_query() as response dicts (same keys as AnalysisResultSchema).
+    """
+    n = len(ANALYSIS_FIELDS)
+    rows = []
+    for row in db.execute(query):
+        item = dict(zip(ANALYSIS_FIELDS, row[:n]))
+        estimate = row[n:]
+        item["estimate"] = dict(zip(ESTIMATE_FIELDS, estimate)) if estimate[0] is not None else None
+        rows.append(item)
+    return rows
@@ -1,8 +1,11 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import auth, admin, analysis, dashboard
+from app.api.v1.endpoints import auth, admin, analysis, catalog, dashboard, export, tiles
 
 api_router = APIRouter()
 api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
 api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
 api_router.include_router(analysis.router, prefix="/analysis", tags=["analysis"])
+api_router.include_router(catalog.router, prefix="/catalog", tags=["catalog"])
 api_router.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
+api_router.include_router(export.router, prefix="/export", tags=["export"])
+api_router.include_router(tiles.router, prefix="/tiles", tags=["tiles"])
@@ -1,10 +1,12 @@
 import shutil
 import os
 from typing import List
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException
 from sqlalchemy.orm import Session
 from app.api import deps
+from app.core.config import settings
 from app.models.user import User
+from app.db.session import SessionLocal
 from app.models.analysis import ImageMetadata
 from datetime import datetime
 
@@ -13,6 +15,26 @@ router = APIRouter()
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+def register_footprints(image_ids: List[int]):
+    """
+    Add new rasters (DEMs included) to the imagery catalog (runs after the response is sent).
+    """
+    from app.services import scene_catalog # reads raster headers
+    db = SessionLocal()
+    try:
+        for image in db.query(ImageMetadata).filter(ImageMetadata.id.in_(image_ids)):
+            scene_catalog.register(db, image)
+    finally:
+        db.close()
+
+def queue_ingest(image_ids: List[int]):
+    """
+    Hand new scenes to the worker pipeline (runs after the response is sent).
+    """
+    from app.worker import ingest_scene_task # worker modules pull in the raster stack
+    for image_id in image_ids:
+        ingest_scene_task.delay(image_id)
+
 @router.post("/upload")
 def upload_files(
     *,
@@ -20,12 +42,16 @@ def upload_files(
     current_user: User = Depends(deps.get_current_active_superuser),
     files: List[UploadFile] = File(...),
     capture_date: str = Form(...), # ISO format
-    image_type: str = Form(...) # satellite, drone, dem
+    image_type: str = Form(...), # satellite, drone, dem
+    background_tasks: BackgroundTasks
 ):
     """
     Admin upload for satellite/drone/dem files.
+    New satellite/drone scenes are compared automatically with the previous scene
+    of the same area (AUTO_ANALYZE_ON_UPLOAD).
     """
     saved_files = []
+    new_images = []
     
     try:
         dt_capture = datetime.fromisoformat(capture_date)
@@ -45,7 +71,43 @@ def upload_files(
         )
         db.add(db_image)
         saved_files.append(file.filename)
+        new_images.append(db_image)
     
     db.commit()
+    background_tasks.add_task(register_footprints, [image.id for image in new_images])
+
+    queued = []
+    if settings.AUTO_ANALYZE_ON_UPLOAD and image_type != "dem":
+        queued = [image.id for image in new_images]
+        background_tasks.add_task(queue_ingest, queued)
     
-    return {"message": "Files uploaded successfully", "files": saved_files}
+    return {"message": "Files uploaded successfully", "files": saved_files, "queued_for_analysis": queued}
+
+@router.get("/admission")
+def read_admission(
+    current_user: User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Memory admission state of this node: budget, reserved bytes, running and waiting
+    raster jobs (see also the admission_* metrics for decisions and wait times).
+    """
+    from app.services import admission # worker module, pulls in the raster stack
+    return admission.snapshot()
+
+@router.get("/images/{image_id}/statistics")
+def read_image_statistics(
+    image_id: int,
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Per-band statistics and histograms of an uploaded raster, stored at ingest.
+    """
+    image = db.query(ImageMetadata).filter(ImageMetadata.id == image_id).first()
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    from app.services import raster_stats # worker module, pulls in the raster stack
+    stats = raster_stats.load(image.file_path)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Statistics not computed yet")
+    return stats
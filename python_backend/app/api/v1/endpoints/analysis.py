@@ -1,16 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from app.api import deps
+from app.api import deps, serialization
 from app.models.user import User
-from app.models.analysis import AnalysisResult, ImageMetadata
-from app.schemas.analysis import AnalysisResult as AnalysisResultSchema
-from app.services import image_processing, gis_analysis, risk_assessment
+from app.models.analysis import AnalysisEstimate, AnalysisResult, ImageMetadata
+from app.schemas.analysis import AnalysisResult as AnalysisResultSchema, AnalysisEstimate as AnalysisEstimateSchema
 from datetime import datetime
+from typing import Optional
 import os
 
 router = APIRouter()
 
 def process_analysis(analysis_id: int, img1_path: str, img2_path: str, dem_path: str, db: Session):
+    # GIS services pull in rasterio/pysheds/numba; import them on first use, not at API startup
+    from app.services import image_processing, gis_analysis, risk_assessment
+
     # This should ideally be a Celery task
     # For now, running as background task
     
@@ -41,14 +45,21 @@ def process_analysis(analysis_id: int, img1_path: str, img2_path: str, dem_path:
 
 from typing import List
 
+def queue_refinement(analysis_id: int, img1_path: str, img2_path: str, dem_path: str):
+    """
+    Full-resolution run behind a quick look (runs after the response is sent).
+    """
+    from app.worker import process_analysis_task # worker modules pull in the raster stack
+    process_analysis_task.delay(analysis_id, img1_path, img2_path, dem_path)
+
 @router.get("/", response_model=List[AnalysisResultSchema])
 def read_analyses(
     db: Session = Depends(deps.get_db),
     skip: int = 0,
     limit: int = 100,
 ):
-    analyses = db.query(AnalysisResult).order_by(AnalysisResult.created_at.desc()).offset(skip).limit(limit).all()
-    return analyses
+    query = serialization.analysis_list_query().order_by(AnalysisResult.created_at.desc()).offset(skip).limit(limit)
+    return serialization.FastJSONResponse(serialization.analysis_rows(db, query))
 
 @router.post("/run", response_model=AnalysisResultSchema)
 def run_analysis(
@@ -57,12 +68,20 @@ def run_analysis(
     current_user: User = Depends(deps.get_current_active_user),
     date1: datetime,
     date2: datetime,
+    quick_look: bool = False,
+    overview_level: Optional[int] = None,
     background_tasks: BackgroundTasks
 ):
     """
     Trigger analysis for two dates.
     Finds images close to these dates.
+    With quick_look, returns an estimate from overview level `overview_level`
+    (decimation 2**level) with error bounds, and queues the full-resolution run,
+    which replaces the estimate when it finishes.
     """
+    if overview_level is not None and not 0 <= overview_level <= 8:
+        raise HTTPException(status_code=400, detail="overview_level must be between 0 and 8")
+
     # Find images (Simplification: find exact or closest match)
     # In reality, we'd query for images within a range.
     img1 = db.query(ImageMetadata).filter(ImageMetadata.capture_date == date1).first()
@@ -71,8 +90,9 @@ def run_analysis(
     if not img1 or not img2:
         raise HTTPException(status_code=404, detail="Images not found for given dates")
         
-    # Find DEM (assuming one DEM for now)
-    dem = db.query(ImageMetadata).filter(ImageMetadata.image_type == "dem").first()
+    # DEM from the catalog (the best one covering the later scene), else any DEM
+    from app.services import scene_catalog # reads raster headers
+    dem = scene_catalog.covering_dem(db, img2) or db.query(ImageMetadata).filter(ImageMetadata.image_type == "dem").first()
     if not dem:
         raise HTTPException(status_code=404, detail="DEM data not found")
         
@@ -85,6 +105,22 @@ def run_analysis(
     db.add(analysis)
     db.commit()
     db.refresh(analysis)
+
+    if quick_look:
+        from app.services import quick_look as quick_look_service # rasterio loads on first quick look
+        estimate = AnalysisEstimate(
+            analysis_id=analysis.id,
+            **quick_look_service.estimate(img1.file_path, img2.file_path, dem.file_path, overview_level)
+        )
+        analysis.lake_area_1 = estimate.lake_area_1
+        analysis.lake_area_2 = estimate.lake_area_2
+        analysis.volume_change = estimate.volume_change
+        db.add(estimate)
+        db.commit()
+        background_tasks.add_task(queue_refinement, analysis.id, img1.file_path, img2.file_path, dem.file_path)
+        result = AnalysisResultSchema.model_validate(analysis)
+        result.estimate = AnalysisEstimateSchema.model_validate(estimate)
+        return result
     
     # Trigger processing
     # background_tasks.add_task(process_analysis, analysis.id, img1.file_path, img2.file_path, dem.file_path, db)
@@ -95,3 +131,61 @@ def run_analysis(
     db.commit()
     
     return analysis
+
+@router.get("/{analysis_id}/change.tif")
+def export_change_mask(
+    analysis_id: int,
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    Change mask of an analysis as a dense GeoTIFF. Sparse masks are expanded
+    on first request and the export is kept in the artifact store.
+    """
+    analysis = db.query(AnalysisResult).filter(AnalysisResult.id == analysis_id).first()
+    if not analysis or not analysis.change_detection_path or not os.path.exists(analysis.change_detection_path):
+        raise HTTPException(status_code=404, detail="Change mask not found")
+    from app.services import artifact_store, sparse_mask # rasterio loads on first export
+
+    path = analysis.change_detection_path
+    if sparse_mask.is_sparse(path):
+        export_path = artifact_store.analysis_path(analysis_id, "change_export")
+        if not artifact_store.is_fresh(export_path, path):
+            sparse_mask.SparseMask.load(path).to_geotiff(export_path)
+        path = export_path
+    return FileResponse(path, media_type="image/tiff", filename=f"analysis_{analysis_id}_change.tif")
+
+@router.get("/{analysis_id}/water-area")
+def read_water_area(
+    analysis_id: int,
+    threshold: Optional[float] = None,
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    What-if lake areas of both epochs at an NDWI `threshold` (default: each scene's
+    automatic threshold), from the NDWI histograms stored with the analysis' NDWI
+    rasters; no raster is read.
+    """
+    if threshold is not None and not -1.0 <= threshold <= 1.0:
+        raise HTTPException(status_code=400, detail="threshold must be between -1 and 1")
+    analysis = db.query(AnalysisResult).filter(AnalysisResult.id == analysis_id).first()
+    if not analysis or not analysis.ndwi_path_1 or not analysis.ndwi_path_2:
+        raise HTTPException(status_code=404, detail="NDWI of the analysis not found")
+    from app.services import raster_stats # numpy/rasterio load on first query
+
+    epochs = []
+    for epoch, path in ((1, analysis.ndwi_path_1), (2, analysis.ndwi_path_2)):
+        stats = raster_stats.load(path)
+        if stats is None:
+            raise HTTPException(status_code=404, detail=f"NDWI statistics of epoch {epoch} not found")
+        automatic = raster_stats.water_threshold(stats)
+        used = automatic if threshold is None else threshold
+        epochs.append({
+            "epoch": epoch,
+            "automatic_threshold": automatic,
+            "threshold": used,
+            "lake_area": raster_stats.water_area(stats, used),
+            "nodata_fraction": stats["bands"][0]["nodata_fraction"],
+        })
+    return {"analysis_id": analysis_id, "epochs": epochs}
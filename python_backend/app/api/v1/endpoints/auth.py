@@ -1,6 +1,6 @@
 from datetime import timedelta
 from typing import Any
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, UploadFile, File
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from app.api import deps
@@ -9,12 +9,28 @@ from app.core.config import settings
 from app.models.user import User
 from app.schemas.user import UserCreate, User as UserSchema, UserUpdatePartial
 from app.schemas.token import Token
-import shutil
+import logging
 import os
 # from geoalchemy2.elements import WKTElement
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+def check_user_location(db: Session, user: User, background_tasks: BackgroundTasks):
+    """
+    Test a newly saved location against the active risk zones and send the SOS
+    alert right after the response when it lies inside one. Never fails the request.
+    """
+    from app.services import alert_service, geofence # pull in shapely on first use only
+    try:
+        zones = geofence.check_location(db, user.longitude, user.latitude)
+    except Exception:
+        logger.exception("Geofence check failed for user %s", user.id)
+        return
+    if zones:
+        background_tasks.add_task(alert_service.alert_user_at_location, user.email, zones)
+
 @router.post("/login/access-token", response_model=Token)
 def login_access_token(
     db: Session = Depends(deps.get_db), form_data: OAuth2PasswordRequestForm = Depends()
@@ -40,9 +56,10 @@ def register_user(
     *,
     db: Session = Depends(deps.get_db),
     user_in: UserCreate,
+    background_tasks: BackgroundTasks,
 ) -> Any:
     """
-    Create new user.
+    Create new user. Residents registering inside an active risk zone are alerted at once.
     """
     user = db.query(User).filter(User.email == user_in.email).first()
     if user:
@@ -69,6 +86,7 @@ def register_user(
     db.add(user)
     db.commit()
     db.refresh(user)
+    check_user_location(db, user, background_tasks)
     return user
 
 @router.get("/me", response_model=UserSchema)
@@ -86,9 +104,10 @@ def update_user_me(
     db: Session = Depends(deps.get_db),
     user_in: UserUpdatePartial,
     current_user: User = Depends(deps.get_current_active_user),
+    background_tasks: BackgroundTasks,
 ) -> Any:
     """
-    Update current user.
+    Update current user. A changed location is checked against the active risk zones.
     """
     if user_in.password:
         current_user.hashed_password = security.get_password_hash(user_in.password)
@@ -105,35 +124,43 @@ def update_user_me(
         current_user.email = user_in.email
     if user_in.phone is not None:
         current_user.phone = user_in.phone
+    moved = False
+    if user_in.latitude is not None and user_in.latitude != current_user.latitude:
+        current_user.latitude = user_in.latitude
+        moved = True
+    if user_in.longitude is not None and user_in.longitude != current_user.longitude:
+        current_user.longitude = user_in.longitude
+        moved = True
     
     db.add(current_user)
     db.commit()
     db.refresh(current_user)
+    if moved:
+        check_user_location(db, current_user, background_tasks)
     return current_user
 
 @router.post("/me/image", response_model=UserSchema)
-async def upload_profile_image(
+def upload_profile_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: User = Depends(deps.get_current_active_user),
     db: Session = Depends(deps.get_db)
 ):
     """
-    Upload profile image
+    Upload profile image. The original is stored under its content hash; the resized
+    variants (avatar_urls) are generated after the response.
     """
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_extension = file.filename.split(".")[-1]
-    file_name = f"user_{current_user.id}.{file_extension}"
-    file_path = os.path.join(upload_dir, file_name)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    relative_path = f"/static/{file_name}"
-    current_user.profile_picture = relative_path
+    from app.services import avatars # Pillow is only needed here
+
+    try:
+        original_path = avatars.save_original(file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    current_user.profile_picture = avatars.original_url(original_path)
     db.add(current_user)
     db.commit()
     db.refresh(current_user)
+    background_tasks.add_task(avatars.process_upload, current_user.id, original_path)
     
     return current_user
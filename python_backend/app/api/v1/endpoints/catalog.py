@@ -0,0 +1,100 @@
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.api import deps
+from app.core.config import settings
+from app.models.user import User
+
+router = APIRouter()
+
+def _area(lon: Optional[float], lat: Optional[float], bbox: Optional[str], geometry: Optional[str]):
+    """
+    The lon/lat area of a catalog query: a point, a "west,south,east,north" box or a GeoJSON geometry.
+    """
+    import shapely
+    import shapely.geometry
+
+    given = [lon is not None or lat is not None, bbox is not None, geometry is not None]
+    if sum(given) != 1:
+        raise HTTPException(status_code=400, detail="Give exactly one of lon/lat, bbox or geometry")
+    try:
+        if given[0]:
+            if lon is None or lat is None:
+                raise ValueError("lon and lat go together")
+            return shapely.Point(lon, lat)
+        if given[1]:
+            west, south, east, north = (float(v) for v in bbox.split(","))
+            if west > east or south > north:
+                raise ValueError("bbox is west,south,east,north")
+            return shapely.box(west, south, east, north)
+        shape = shapely.geometry.shape(json.loads(geometry))
+        if shape.is_empty:
+            raise ValueError("empty geometry")
+        return shape
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid area: {e}")
+
+@router.get("/scenes")
+def search_scenes(
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    bbox: Optional[str] = None,
+    geometry: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    image_type: Optional[str] = None,
+    limit: int = 100,
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    Scenes covering a point (lon, lat), a bbox or a GeoJSON geometry, captured between
+    start and end (inclusive), newest first.
+    """
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    area = _area(lon, lat, bbox, geometry)
+    from app.services import scene_catalog # numpy/shapely/rasterio load on the first catalog query
+    return scene_catalog.search(db, area, start, end, image_type, min(limit, settings.CATALOG_MAX_RESULTS))
+
+@router.get("/dem")
+def read_best_dem(
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    bbox: Optional[str] = None,
+    geometry: Optional[str] = None,
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    The DEM covering most of the area, then the finest, then the newest (with its coverage fraction).
+    """
+    area = _area(lon, lat, bbox, geometry)
+    from app.services import scene_catalog # numpy/shapely/rasterio load on the first catalog query
+    dem = scene_catalog.best_dem(db, area)
+    if dem is None:
+        raise HTTPException(status_code=404, detail="No DEM covers this area")
+    return dem
+
+@router.get("/newest")
+def read_newest_per_tile(
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    bbox: Optional[str] = None,
+    geometry: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    image_type: Optional[str] = None,
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    Newest scene of each CATALOG_TILE_DEGREES grid cell (by footprint centre) in the area.
+    """
+    area = _area(lon, lat, bbox, geometry)
+    from app.services import scene_catalog # numpy/shapely/rasterio load on the first catalog query
+    return scene_catalog.newest_per_tile(db, area, start, end, image_type)[:settings.CATALOG_MAX_RESULTS]
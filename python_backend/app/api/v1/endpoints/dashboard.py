@@ -1,9 +1,8 @@
 from typing import List
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from app.api import deps
+from app.api import deps, serialization
 from app.models.user import User
-from app.models.analysis import AnalysisResult
 from app.schemas.analysis import AnalysisResult as AnalysisResultSchema
 
 router = APIRouter()
@@ -17,5 +16,4 @@ def get_dashboard_stats(
     Get all analysis results for dashboard.
     In real app, filter by user location context if needed.
     """
-    results = db.query(AnalysisResult).all()
-    return results
+    return serialization.FastJSONResponse(serialization.analysis_rows(db, serialization.analysis_list_query()))
@@ -0,0 +1,146 @@
+import csv
+import io
+from datetime import datetime
+from typing import Iterator, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Text, cast, select
+from app.api import deps, serialization
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.analysis import AnalysisResult, RiskZone
+from app.models.user import User
+
+router = APIRouter()
+
+# Bulk exports stream straight from the database: rows are fetched in batches of
+# EXPORT_BATCH_SIZE (a server-side cursor on PostgreSQL) and encoded batch by batch,
+# so memory stays flat and the first bytes go out before the query has finished.
+ANALYSIS_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+ZONE_FORMATS = {"geojson": "application/geo+json", "ndjson": "application/x-ndjson", "csv": "text/csv"}
+ZONE_FIELDS = ["id", "analysis_id", "risk_level", "description", "date_1", "date_2"]
+
+def _filtered(query, date_from: Optional[datetime], date_to: Optional[datetime], risk_levels: Optional[List[str]],
+              risk_column):
+    """
+    Date range (on the analysis' second epoch, when the change was observed) and risk levels, as SQL.
+    """
+    if date_from is not None:
+        query = query.where(AnalysisResult.date_2 >= date_from)
+    if date_to is not None:
+        query = query.where(AnalysisResult.date_2 <= date_to)
+    if risk_levels:
+        query = query.where(risk_column.in_(risk_levels))
+    return query
+
+def _stream_rows(query) -> Iterator[list]:
+    """
+    Batches of result rows. Uses its own session: the request's session is closed
+    before a streaming body has been sent.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        for batch in result.partitions():
+            yield batch
+    finally:
+        db.close()
+
+def _csv_chunks(header: List[str], batches: Iterator[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            ["" if v is None else v.isoformat() if isinstance(v, datetime) else v for v in row]
+            for row in batch
+        )
+        yield buffer.getvalue()
+
+def _ndjson_chunks(fields: List[str], batches: Iterator[list]) -> Iterator[bytes]:
+    for batch in batches:
+        yield b"".join(serialization.dumps(dict(zip(fields, row))) + b"\n" for row in batch)
+
+def _feature_chunks(batches: Iterator[list], collection: bool) -> Iterator[bytes]:
+    """
+    GeoJSON Features: comma-separated inside a FeatureCollection, or one per line.
+    """
+    separator = b"," if collection else b"\n"
+    if collection:
+        yield b'{"type":"FeatureCollection","features":['
+    first = True
+    for batch in batches:
+        features = []
+        for row in batch:
+            properties = serialization.dumps(dict(zip(ZONE_FIELDS, row[:-1])))
+            geometry = (row[-1] or "null").encode("utf-8")
+            features.append(b'{"type":"Feature","properties":' + properties + b',"geometry":' + geometry + b"}")
+        if not features:
+            continue
+        yield (b"" if first or not collection else separator) + separator.join(features) + (b"" if collection else b"\n")
+        first = False
+    if collection:
+        yield b"]}"
+
+def _attachment(name: str, fmt: str) -> dict:
+    return {"Content-Disposition": f'attachment; filename="{name}.{fmt}"'}
+
+@router.get("/analyses")
+def export_analyses(
+    format: str = "ndjson",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    risk_level: Optional[List[str]] = Query(None),
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    Every analysis matching the filters as NDJSON (one object per line) or CSV.
+    """
+    if format not in ANALYSIS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(ANALYSIS_FORMATS)}")
+    fields = serialization.ANALYSIS_FIELDS
+    query = select(*[AnalysisResult.__table__.c[name] for name in fields]).order_by(AnalysisResult.id)
+    query = _filtered(query, date_from, date_to, risk_level, AnalysisResult.risk_level)
+
+    batches = _stream_rows(query)
+    chunks = _ndjson_chunks(fields, batches) if format == "ndjson" else _csv_chunks(fields, batches)
+    return StreamingResponse(chunks, media_type=ANALYSIS_FORMATS[format], headers=_attachment("analyses", format))
+
+@router.get("/risk-zones")
+def export_risk_zones(
+    format: str = "geojson",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    risk_level: Optional[List[str]] = Query(None),
+    analysis_id: Optional[int] = None,
+    current_user: User = Depends(deps.get_current_active_user),
+):
+    """
+    Risk zones matching the filters as a GeoJSON FeatureCollection, NDJSON (one
+    Feature per line) or CSV (geometry as a GeoJSON column).
+    """
+    if format not in ZONE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(ZONE_FORMATS)}")
+    # Geometry is stored as GeoJSON; cast to text in SQL (PostgreSQL would otherwise
+    # return the JSON column decoded) and pass it through without parsing it
+    query = (
+        select(
+            RiskZone.id, RiskZone.analysis_id, RiskZone.risk_level, RiskZone.description,
+            AnalysisResult.date_1, AnalysisResult.date_2, cast(RiskZone.geometry_geojson, Text).label("geometry_geojson")
+        )
+        .join(AnalysisResult, AnalysisResult.id == RiskZone.analysis_id)
+        .order_by(RiskZone.id)
+    )
+    query = _filtered(query, date_from, date_to, risk_level, RiskZone.risk_level)
+    if analysis_id is not None:
+        query = query.where(RiskZone.analysis_id == analysis_id)
+
+    batches = _stream_rows(query)
+    if format == "csv":
+        chunks = _csv_chunks(ZONE_FIELDS + ["geometry_geojson"], batches)
+    else:
+        chunks = _feature_chunks(batches, collection=format == "geojson")
+    return StreamingResponse(chunks, media_type=ZONE_FORMATS[format], headers=_attachment("risk_zones", format))
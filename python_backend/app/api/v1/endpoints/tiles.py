@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.orm import Session
+from app.api import deps
+
+router = APIRouter()
+
+@router.get("/vector/{z}/{x}/{y}.mvt")
+def read_vector_tile(
+    z: int,
+    x: int,
+    y: int,
+    db: Session = Depends(deps.get_db),
+):
+    """
+    Mapbox Vector Tile with `risk_zones` polygons and `flow_paths` lines.
+    Geometry comes from the level of detail precomputed for this zoom.
+    """
+    if z < 0 or z > 24 or not (0 <= x < (1 << z)) or not (0 <= y < (1 << z)):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    from app.services import vector_tiles # numpy/shapely load on the first tile request
+    tile = vector_tiles.render_tile(db, z, x, y)
+    return Response(
+        content=tile,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": "public, max-age=300"}
+    )
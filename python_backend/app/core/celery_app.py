@@ -1,10 +1,73 @@
+import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 from app.core.config import settings
 
-celery_app = Celery("worker", broker=settings.CELERY_BROKER_URL)
+celery_app = Celery(
+    "worker",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND,
+    include=["app.worker"]
+)
+
+# Separate queues so SOS alerts never wait behind long raster jobs
+RASTER_QUEUE = "raster"
+FLOW_QUEUE = "flow"
+ALERT_QUEUE = "alerts"
+
+# queue -> (processes, prefetch multiplier) used by run_workers.py
+WORKER_POOLS = {
+    RASTER_QUEUE: (settings.RASTER_QUEUE_CONCURRENCY, settings.RASTER_QUEUE_PREFETCH),
+    FLOW_QUEUE: (settings.FLOW_QUEUE_CONCURRENCY, settings.FLOW_QUEUE_PREFETCH),
+    ALERT_QUEUE: (settings.ALERT_QUEUE_CONCURRENCY, settings.ALERT_QUEUE_PREFETCH),
+}
 
-celery_app.conf.task_routes = {"app.worker.test_celery": "main-queue"}
+celery_app.conf.task_routes = {
+    "app.worker.test_celery": "main-queue",
+    "app.worker.ingest_scene_task": RASTER_QUEUE,
+    "app.worker.process_analysis_task": RASTER_QUEUE,
+    "app.worker.process_analysis_mapreduce_task": RASTER_QUEUE,
+    "app.worker.process_tile_task": RASTER_QUEUE,
+    "app.worker.reduce_analysis_task": RASTER_QUEUE,
+    "app.worker.mapreduce_failed_task": RASTER_QUEUE,
+    "app.worker.route_flow_task": FLOW_QUEUE,
+    "app.worker.send_alerts_task": ALERT_QUEUE,
+}
 celery_app.conf.update(
     task_track_started=True,
-    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER
+    task_always_eager=settings.CELERY_TASK_ALWAYS_EAGER,
+    task_default_queue=RASTER_QUEUE
 )
+
+# Filesystem broker: lets several local worker processes share one queue without Redis
+if settings.CELERY_BROKER_URL.startswith("filesystem://"):
+    broker_dir = os.path.abspath(settings.CELERY_BROKER_DIR)
+    for sub in ("queue", "processed"):
+        os.makedirs(os.path.join(broker_dir, sub), exist_ok=True)
+    celery_app.conf.broker_transport_options = {
+        "data_folder_in": os.path.join(broker_dir, "queue"),
+        "data_folder_out": os.path.join(broker_dir, "queue"),
+        "processed_folder": os.path.join(broker_dir, "processed"),
+        "store_processed": False,
+        "polling_interval": 0.1, # default 1 s would add a second to every alert
+    }
+
+@worker_init.connect
+def prepare_worker(**kwargs):
+    """
+    Runs once in the worker's main process (before prefork children are forked, so
+    they share the pre-imported modules). With --pool=solo this is the process that runs tasks.
+    """
+    from app.services import raster_io
+    raster_io.configure_process()
+    if settings.WORKER_PREWARM:
+        raster_io.prewarm()
+
+@worker_process_init.connect
+def prepare_worker_process(**kwargs):
+    """
+    Runs in every prefork child: dataset handles must not be inherited across fork.
+    """
+    from app.services import raster_io
+    raster_io.dataset_pool.reset_after_fork()
+    raster_io.configure_process()
@@ -4,6 +4,7 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     PROJECT_NAME: str = "GlacierWatch API"
     API_V1_STR: str = "/api/v1"
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-super-secret-key-change-this-prod")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
@@ -14,11 +15,92 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", "password")
     POSTGRES_DB: str = os.getenv("POSTGRES_DB", "glacierwatch")
     SQLALCHEMY_DATABASE_URI: str | None = "sqlite:///./glacierwatch.db"
+    CREATE_SCHEMA_ON_STARTUP: bool = True # otherwise run `python -m app.db.init_db` before starting
+    EXPORT_BATCH_SIZE: int = 2000 # rows fetched per batch by the streaming /export endpoints
+    GZIP_MINIMUM_SIZE: int = 1024 # responses larger than this (bytes) are gzip-compressed when the client accepts it
 
     # Celery
     CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "memory://")
     CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "db+sqlite:///./celery_results.sqlite")
     CELERY_TASK_ALWAYS_EAGER: bool = True
+    CELERY_BROKER_DIR: str = "./celery_broker" # used by the filesystem:// broker
+    # Worker pools per queue (run_workers.py): processes and prefetch multiplier
+    RASTER_QUEUE_CONCURRENCY: int = 2
+    RASTER_QUEUE_PREFETCH: int = 1 # long tasks: never hold more than the one being worked on
+    FLOW_QUEUE_CONCURRENCY: int = 1
+    FLOW_QUEUE_PREFETCH: int = 1
+    ALERT_QUEUE_CONCURRENCY: int = 2
+    ALERT_QUEUE_PREFETCH: int = 4 # short tasks: prefetch to keep latency low
+
+    # Worker raster I/O
+    GDAL_CACHEMAX_MB: int = 512 # GDAL block cache per worker process
+    GDAL_NUM_THREADS: str = "ALL_CPUS" # threads for (de)compression
+    RASTER_POOL_SIZE: int = 16 # open read-only datasets kept per process (0 disables)
+    WORKER_PREWARM: bool = True # pre-import heavy libraries when a worker starts
+
+    # Artifact store (per-analysis / per-scene derived products)
+    ARTIFACT_DIR: str = "./artifacts"
+    ARTIFACT_DISK_BUDGET_MB: int = 20480 # regenerable artifacts are evicted above this (0 = no limit)
+    ARTIFACT_LEASE_SECONDS: int = 21600 # leases older than this (left by a crashed worker) stop protecting artifacts
+    ARTIFACT_ZSTD_LEVEL: int = 1 # ZSTD level for float rasters; higher is smaller but slower
+
+    # Upload-triggered analysis: a new scene is compared with the previous scene of the same area and type
+    AUTO_ANALYZE_ON_UPLOAD: bool = True
+    SCENE_MATCH_MIN_OVERLAP: float = 0.5 # fraction of the new scene the previous one must cover
+    SCENE_MATCH_MAX_CANDIDATES: int = 50 # older scenes of the same type examined, newest first
+
+    # Imagery catalog: scene footprints in an in-memory STRtree, kept in capture-date order
+    CATALOG_TILE_DEGREES: float = 1.0 # grid cell (lon/lat) a scene belongs to by its centre, for newest-per-tile queries
+    CATALOG_REFRESH_SECONDS: int = 3600 # reload the index at least this often (new footprints reload it anyway)
+    CATALOG_MAX_RESULTS: int = 1000 # scenes returned by one /catalog search at most
+
+    # Quick-look analyses (/analysis/run?quick_look=true) read overviews instead of full resolution
+    QUICK_LOOK_OVERVIEW_LEVEL: int = 3 # decimation factor 2**level per axis
+    BUILD_OVERVIEWS_ON_INGEST: bool = True # write external .ovr overviews for uploaded scenes so quick looks stay fast
+
+    # Memory admission control: raster jobs wait until their estimated footprint fits the node's budget
+    ADMISSION_CONTROL: bool = True
+    ADMISSION_MEMORY_BUDGET_MB: int = 0 # per node; 0 = 75% of physical memory
+    ADMISSION_PIPELINE_MULTIPLIER: float = 6.0 # peak RSS / input raster bytes (measured ~5.2-5.6 on 1-4 Mpx scenes)
+    ADMISSION_LEDGER_PATH: str = "./admission/ledger.json" # node-local; shared by the workers of one host
+    ADMISSION_POLL_SECONDS: float = 0.5 # how often a queued job re-checks the budget
+    ADMISSION_LEASE_SECONDS: int = 6 * 3600 # reservations older than this are dropped (crashed jobs)
+
+    # Map-reduce mode for very large scenes
+    MAPREDUCE_TILE_SIZE: int = 4096 # pixels per tile side
+    MAPREDUCE_WORK_DIR: str = "./mapreduce" # must be shared by all workers
+
+    # Raster statistics (min, max, mean, nodata fraction, histogram) stored at ingest and when NDWI is written
+    STATS_HISTOGRAM_BINS: int = 2000 # bins over NDWI [-1, 1] (0.001 wide); integer bands are merged down to at most this many
+    WATER_THRESHOLD_METHOD: str = "otsu" # otsu (per scene, from its stored NDWI histogram) or fixed
+    WATER_THRESHOLD_DEFAULT: float = 0.2 # NDWI threshold of the fixed method, and the fallback without statistics
+    WATER_THRESHOLD_BOUNDS: list[float] = [-0.1, 0.5] # Otsu ignores NDWI below the first and splits within this range
+
+    # Vector tiles
+    VECTOR_TILE_CACHE_SIZE: int = 4096 # encoded tiles kept in the in-process LRU
+    VECTOR_TILE_MAX_LOD: int = 14 # deepest precomputed level of detail
+
+    # DEM conditioning (numba Priority-Flood): depression filling, D8 directions, accumulation
+    HYDROLOGY_IN_MEMORY_MAX_PIXELS: int = 100_000_000 # ~10 bytes per pixel; larger DEMs are conditioned in tiles
+    HYDROLOGY_TILE_SIZE: int = 4096 # pixels per tile side in tiled mode
+
+    # GLOF inundation (HAND): flood extent of the most severe lake, used as the alert area
+    INUNDATION_ENABLED: bool = True # otherwise alerts use the buffered D8 flow path
+    INUNDATION_CHANNEL_AREA_KM2: float = 1.0 # upstream area that makes a cell part of the drainage network
+    INUNDATION_MAX_DISTANCE_KM: float = 50.0 # flood routing stops this far downstream of the lake
+
+    # Alerts
+    ALERT_FLOW_BUFFER_KM: float = 2.0 # half-width of the flow-path corridor users are alerted in
+    GEOFENCE_RISK_LEVELS: list[str] = ["High", "Critical"] # zones that alert on registration / location change
+    GEOFENCE_ACTIVE_DAYS: int = 30 # analyses older than this no longer count as active risks
+    GEOFENCE_REFRESH_SECONDS: int = 3600 # rebuild the in-memory index at least this often
+
+    # Profile images: square variants generated after upload, served with immutable cache headers
+    AVATAR_SIZES: dict[str, int] = {"sm": 64, "md": 256, "lg": 512} # variant name -> pixels per side; "md" is the default
+    AVATAR_FORMAT: str = "webp" # webp or jpeg
+    AVATAR_QUALITY: int = 80
+    AVATAR_MAX_BYTES: int = 10 * 2**20 # larger uploads are rejected while streaming
+    STATIC_MAX_AGE: int = 31536000 # Cache-Control max-age (s) for content-hashed files under /static/avatars
 
     # Email
     SMTP_TLS: bool = True
@@ -0,0 +1,238 @@
+# In-process metrics with Prometheus text exposition. An observation is a dict
+# lookup plus a bisect under one lock, cheap enough to leave on in production.
+# Each process (API, every Celery worker) keeps its own registry; pipeline stages
+# also emit a structured JSON log line so worker timings can be collected from logs.
+import bisect
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger("glacierwatch.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+_lock = threading.Lock()
+
+def _label_key(labels: dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', bound),))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+_registry: List = []
+_collectors: List[Callable[[], None]] = []
+
+def counter(name: str, documentation: str) -> Counter:
+    metric = Counter(name, documentation)
+    _registry.append(metric)
+    return metric
+
+def gauge(name: str, documentation: str) -> Gauge:
+    metric = Gauge(name, documentation)
+    _registry.append(metric)
+    return metric
+
+def histogram(name: str, documentation: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    metric = Histogram(name, documentation, buckets)
+    _registry.append(metric)
+    return metric
+
+def register_collector(collect: Callable[[], None]):
+    """
+    Register a callback that refreshes gauges right before /metrics is rendered.
+    """
+    _collectors.append(collect)
+
+def render() -> str:
+    """
+    Prometheus text exposition format (version 0.0.4) of every registered metric.
+    """
+    for collect in _collectors:
+        collect()
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def log_event(event: str, **fields):
+    """
+    Emit one structured (JSON) log line.
+    """
+    logger.info(json.dumps({"event": event, **fields}, default=str))
+
+# --- Shared metrics ---------------------------------------------------------------------
+
+http_request_seconds = histogram("http_request_duration_seconds", "HTTP request latency by route")
+pipeline_stage_seconds = histogram("pipeline_stage_duration_seconds", "Wall time of analysis pipeline stages")
+pipeline_stage_bytes_read = counter("pipeline_stage_read_bytes_total", "Bytes read by analysis pipeline stages")
+pipeline_stage_bytes_written = counter("pipeline_stage_written_bytes_total", "Bytes written by analysis pipeline stages")
+process_peak_rss = gauge("process_peak_rss_bytes", "Peak resident set size of this process")
+cache_requests = counter("cache_requests_total", "Cache lookups by cache and result (hit/miss)")
+cache_hit_ratio = gauge("cache_hit_ratio", "Cache hits / lookups since process start")
+alerts_sent = counter("alerts_sent_total", "SOS alerts sent")
+alert_users_scanned = counter("alert_users_scanned_total", "Users checked during alert fan-out")
+alert_fanout_seconds = histogram("alert_fanout_duration_seconds", "Wall time of one alert fan-out")
+geofence_checks = counter("geofence_checks_total", "User locations checked against active risk zones, by result")
+geofence_check_seconds = histogram(
+    "geofence_check_duration_seconds", "Spatial-index lookup time of one geofence check",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+)
+catalog_query_seconds = histogram(
+    "catalog_query_duration_seconds", "Footprint-index lookup time of one catalog query, by kind",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+admission_decisions = counter("admission_decisions_total", "Raster job admissions by decision (admitted/queued/downscaled)")
+admission_wait_seconds = histogram("admission_wait_seconds", "Time raster jobs waited for memory before starting")
+admission_reserved_bytes = gauge("admission_reserved_bytes", "Memory reserved by running raster jobs on this node")
+admission_budget_bytes = gauge("admission_budget_bytes", "Memory budget for raster jobs on this node")
+admission_running_jobs = gauge("admission_running_jobs", "Raster jobs holding a memory reservation")
+admission_waiting_jobs = gauge("admission_waiting_jobs", "Raster jobs waiting for memory")
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _io_counters() -> Tuple[int, int]:
+    """
+    Bytes read/written by this process so far (rchar/wchar, includes page-cache hits).
+    """
+    try:
+        with open(f"/proc/{os.getpid()}/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def record_cache(cache: str, hit: bool):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+def _collect_process():
+    process_peak_rss.set(_peak_rss_bytes())
+    with _lock:
+        caches = {dict(key)["cache"] for key in cache_requests.values}
+    for cache in caches:
+        hits = cache_requests.get(cache=cache, result="hit")
+        total = hits + cache_requests.get(cache=cache, result="miss")
+        cache_hit_ratio.set(hits / total if total else 0.0, cache=cache)
+
+register_collector(_collect_process)
+
+@contextmanager
+def stage(name: str, **fields):
+    """
+    Time a pipeline stage and record its I/O volume and the process peak RSS.
+    Emits metrics plus one structured log line per stage.
+    """
+    start = time.perf_counter()
+    read_before, written_before = _io_counters()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        read_after, written_after = _io_counters()
+        peak = _peak_rss_bytes()
+        pipeline_stage_seconds.observe(elapsed, stage=name)
+        pipeline_stage_bytes_read.inc(read_after - read_before, stage=name)
+        pipeline_stage_bytes_written.inc(written_after - written_before, stage=name)
+        process_peak_rss.set(peak)
+        log_event(
+            "pipeline_stage",
+            stage=name,
+            status=status,
+            seconds=round(elapsed, 6),
+            read_bytes=read_after - read_before,
+            written_bytes=written_after - written_before,
+            peak_rss_bytes=peak,
+            **fields
+        )
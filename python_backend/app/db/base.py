@@ -1,3 +1,3 @@
 from app.db.base_class import Base
 from app.models.user import User
-from app.models.analysis import ImageMetadata, AnalysisResult, RiskZone
+from app.models.analysis import ImageMetadata, SceneFootprint, AnalysisResult, AnalysisEstimate, RiskZone, Lake, TileFeature, TileFeatureIndex, DataVersion
@@ -0,0 +1,13 @@
+from app.db.base import Base
+from app.db.session import engine
+
+def create_schema(bind=engine):
+    """
+    Create any missing tables. Called from the API startup hook and seed_users.py,
+    or run directly: `python -m app.db.init_db`.
+    """
+    Base.metadata.create_all(bind=bind)
+
+if __name__ == "__main__":
+    create_schema()
+    print("Schema created.")
@@ -1,18 +1,31 @@
-from fastapi import FastAPI
+import time
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.routing import Mount
 from app.api.v1.api import api_router
+from app.core import metrics
 from app.core.config import settings
-from app.db.session import engine
-from app.db.base import Base
 import os
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+logging.basicConfig(level=settings.LOG_LEVEL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create tables once at startup rather than as a side effect of importing the app
+    if settings.CREATE_SCHEMA_ON_STARTUP:
+        from app.db.init_db import create_schema
+        create_schema()
+    yield
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # Set all CORS enabled origins
@@ -24,13 +37,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Large JSON lists (analyses, dashboard) compress ~7x
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE, compresslevel=5)
+
+def _route_template(request: Request) -> str:
+    """
+    Route template (/api/v1/analysis/{analysis_id}) rather than the raw path, to keep
+    metric cardinality bounded. Mounts (static files) get one label for everything
+    under them.
+    """
+    route = request.scope.get("route")
+    if isinstance(route, Mount):
+        return route.path + "/*"
+    if route is None:
+        # Newer FastAPI does not record the Mount a static file was served from
+        mount = next((r for r in request.app.routes if isinstance(r, Mount)
+                      and request.url.path.startswith(r.path + "/")), None)
+        return mount.path + "/*" if mount else "unmatched"
+    template = route.path
+    if route.path_regex.match(request.url.path):
+        return template # included routes are copied with their prefix (pinned FastAPI)
+    # Newer FastAPI keeps included routes unprefixed: the prefix is the leading segments
+    segments = request.url.path.rstrip("/").split("/")
+    suffix = template.rstrip("/").split("/")
+    return "/".join(segments[:len(segments) - len(suffix) + 1]) + template
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=_route_template(request),
+            status=status
+        )
+
+class CachedStaticFiles(StaticFiles):
+    """
+    Content-hashed avatars never change under the same URL, so browsers and proxies
+    may keep them for STATIC_MAX_AGE; other uploads are revalidated (ETag) on each use.
+    """
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            if path.startswith("avatars/"):
+                response.headers["Cache-Control"] = f"public, max-age={settings.STATIC_MAX_AGE}, immutable"
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return response
+
 # Mount static directory for uploads/outputs
 # Ensure the directory exists
 os.makedirs("uploads", exist_ok=True)
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
+app.mount("/static", CachedStaticFiles(directory="uploads"), name="static")
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/")
 def root():
     return {"message": "Welcome to GlacierWatch API"}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, JSON, LargeBinary
 from sqlalchemy.orm import relationship
-from geoalchemy2 import Geometry
+# from geoalchemy2 import Geometry (pulls in shapely; only needed for PostGIS columns)
 from app.db.base_class import Base
 from datetime import datetime
 
@@ -13,6 +13,26 @@ class ImageMetadata(Base):
     image_type = Column(String, nullable=False) # satellite, drone, dem
     resolution = Column(Float, nullable=True) # meters per pixel
 
+class SceneFootprint(Base):
+    # Bounds of an uploaded raster for the catalog index (scene_catalog). Kept out of
+    # ImageMetadata so existing databases gain it through create_all, without a migration.
+    id = Column(Integer, primary_key=True, index=True) # insertion order: max(id) versions the in-memory index
+    image_id = Column(Integer, ForeignKey('imagemetadata.id', ondelete="CASCADE"), nullable=False, unique=True)
+    image_type = Column(String, nullable=False) # copied from ImageMetadata
+    capture_date = Column(DateTime, nullable=False) # copied from ImageMetadata
+    crs = Column(String, nullable=True) # native CRS; overlap between scenes is measured in it
+    min_x = Column(Float, nullable=False) # native bounds
+    min_y = Column(Float, nullable=False)
+    max_x = Column(Float, nullable=False)
+    max_y = Column(Float, nullable=False)
+    west = Column(Float, nullable=False) # lon/lat (EPSG:4326) bounds, what the index and queries use
+    south = Column(Float, nullable=False)
+    east = Column(Float, nullable=False)
+    north = Column(Float, nullable=False)
+    resolution_m = Column(Float, nullable=True) # approximate pixel size in metres
+
+    __table_args__ = (Index("ix_scenefootprint_type_date", "image_type", "capture_date"),)
+
 class AnalysisResult(Base):
     id = Column(Integer, primary_key=True, index=True)
     date_1 = Column(DateTime, nullable=False)
@@ -33,6 +53,21 @@ class AnalysisResult(Base):
     
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class AnalysisEstimate(Base):
+    # Quick-look estimate from overview-level rasters; deleted when the full-resolution run finishes
+    id = Column(Integer, primary_key=True, index=True)
+    analysis_id = Column(Integer, ForeignKey('analysisresult.id'), index=True)
+    overview_factor = Column(Float, nullable=False) # source pixels per estimate pixel, per axis
+    lake_area_1 = Column(Float, nullable=True) # sq meters
+    lake_area_2 = Column(Float, nullable=True) # sq meters
+    expansion_area = Column(Float, nullable=True) # sq meters
+    expansion_area_error = Column(Float, nullable=True) # +/- sq meters (mixed pixels on the expansion boundary)
+    volume_change = Column(Float, nullable=True) # cubic meters
+    volume_change_error = Column(Float, nullable=True) # +/- cubic meters
+    risk_level = Column(String, nullable=True) # from volume_change + volume_change_error
+    seconds = Column(Float, nullable=True) # time to compute the estimate
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class RiskZone(Base):
     id = Column(Integer, primary_key=True, index=True)
     analysis_id = Column(Integer, ForeignKey('analysisresult.id'))
@@ -43,3 +78,50 @@ class RiskZone(Base):
     description = Column(String, nullable=True)
     
     analysis = relationship("AnalysisResult")
+
+class Lake(Base):
+    id = Column(Integer, primary_key=True, index=True)
+    analysis_id = Column(Integer, ForeignKey('analysisresult.id'), index=True)
+    epoch = Column(Integer, nullable=False) # 1 = date_1 scene, 2 = date_2 scene
+    pixel_count = Column(Integer, nullable=False)
+    area = Column(Float, nullable=False) # sq meters
+    centroid_x = Column(Float, nullable=False)
+    centroid_y = Column(Float, nullable=False)
+    min_x = Column(Float, nullable=False)
+    min_y = Column(Float, nullable=False)
+    max_x = Column(Float, nullable=False)
+    max_y = Column(Float, nullable=False)
+    geometry_geojson = Column(JSON, nullable=True)
+
+    # Filled for the epoch-2 lakes by the risk stage
+    changed_area = Column(Float, nullable=True) # sq meters of expansion inside the lake
+    volume_change = Column(Float, nullable=True) # cubic meters
+    slope = Column(Float, nullable=True) # degrees, local terrain around the lake
+    risk_level = Column(String, nullable=True)
+
+    analysis = relationship("AnalysisResult")
+
+class TileFeature(Base):
+    # Simplified copy of a risk zone / flow path for one vector-tile level of detail.
+    # Geometry is stored as WKB in Web Mercator (EPSG:3857) so tiles need no reprojection.
+    id = Column(Integer, primary_key=True, index=True)
+    layer = Column(String, nullable=False) # risk_zones, flow_paths
+    analysis_id = Column(Integer, ForeignKey('analysisresult.id'), index=True)
+    lod = Column(Integer, nullable=False) # zoom level the geometry was simplified for
+    properties = Column(JSON, nullable=True)
+    geometry_wkb = Column(LargeBinary, nullable=False)
+
+class TileFeatureIndex(Base):
+    # Quadtree index: each LOD copy is bucketed in the (at most 2x2) tiles it touches at the
+    # deepest zoom `level` <= lod where it still fits; a tile query probes its ancestors
+    lod = Column(Integer, primary_key=True)
+    level = Column(Integer, primary_key=True)
+    tile_x = Column(Integer, primary_key=True)
+    tile_y = Column(Integer, primary_key=True)
+    feature_id = Column(Integer, ForeignKey('tilefeature.id', ondelete="CASCADE"), primary_key=True, index=True)
+
+class DataVersion(Base):
+    # Counter bumped by every write of a derived data set (e.g. "tile_features"), so
+    # process-local caches of it can tell they are stale, deletes included
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -30,6 +30,20 @@ class AnalysisResultBase(BaseModel):
 class AnalysisResultCreate(AnalysisResultBase):
     pass
 
+class AnalysisEstimate(BaseModel):
+    overview_factor: float
+    lake_area_1: Optional[float] = None
+    lake_area_2: Optional[float] = None
+    expansion_area: Optional[float] = None
+    expansion_area_error: Optional[float] = None
+    volume_change: Optional[float] = None
+    volume_change_error: Optional[float] = None
+    risk_level: Optional[str] = None
+    seconds: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
 class AnalysisResult(AnalysisResultBase):
     id: int
     ndwi_path_1: Optional[str] = None
@@ -37,6 +51,7 @@ class AnalysisResult(AnalysisResultBase):
     change_detection_path: Optional[str] = None
     risk_map_path: Optional[str] = None
     created_at: datetime
+    estimate: Optional[AnalysisEstimate] = None # quick-look values, until the full-resolution run replaces them
 
     class Config:
         from_attributes = True
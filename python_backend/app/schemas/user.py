@@ -1,5 +1,6 @@
-from typing import Optional
-from pydantic import BaseModel, EmailStr
+from typing import Dict, Optional
+from pydantic import BaseModel, EmailStr, computed_field
+from app.services.avatars import variant_urls
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -20,6 +21,8 @@ class UserUpdatePartial(BaseModel):
     email: Optional[EmailStr] = None
     phone: Optional[str] = None
     password: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class UserInDBBase(UserBase):
     id: int
@@ -30,7 +33,11 @@ class UserInDBBase(UserBase):
         from_attributes = True
 
 class User(UserInDBBase):
-    pass
+    @computed_field
+    @property
+    def avatar_urls(self) -> Optional[Dict[str, str]]:
+        # Resized profile picture variants by size (sm, md, lg) once they are generated
+        return variant_urls(self.profile_picture)
 
 class UserInDB(UserInDBBase):
     hashed_password: str
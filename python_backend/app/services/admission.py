@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, Optional
+import numpy as np
+from app.core import metrics
+from app.core.config import settings
+from app.services import raster_io
+
+try:
+    import fcntl
+except ImportError: # Windows: the ledger is kept per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Memory admission control for raster jobs. Every job declares an estimate (input
+# pixels x bands x dtype size x ADMISSION_PIPELINE_MULTIPLIER) and is only started
+# while the reservations of all jobs on this node fit ADMISSION_MEMORY_BUDGET_MB.
+# Reservations and waiters live in a JSON ledger under an exclusive file lock, so all
+# worker processes of a node (and threads of an eager API process) share one budget.
+# Waiters are admitted in arrival order; a job too big for the whole budget is not
+# queued but downscaled by the caller (see tile_size_for).
+
+class _Ledger:
+    def __init__(self):
+        self._local = {"running": {}, "waiting": {}}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def edit(self):
+        """
+        The ledger {"running": {job: entry}, "waiting": {job: entry}}, locked; changes are saved on exit.
+        """
+        if fcntl is None:
+            with self._lock:
+                yield self._local
+            return
+        path = os.path.abspath(settings.ADMISSION_LEDGER_PATH)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(path) as f:
+                        ledger = json.load(f)
+                except (OSError, ValueError):
+                    ledger = {"running": {}, "waiting": {}}
+                _drop_stale(ledger)
+                yield ledger
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(ledger, f)
+                os.replace(tmp_path, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+ledger = _Ledger()
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _drop_stale(state: dict):
+    """
+    Forget entries of processes that died (OOM-killed workers never release) and leases
+    older than ADMISSION_LEASE_SECONDS.
+    """
+    now = time.time()
+    for section in ("running", "waiting"):
+        for job, entry in list(state[section].items()):
+            if not _alive(entry["pid"]) or now - entry["since"] > settings.ADMISSION_LEASE_SECONDS:
+                del state[section][job]
+
+def budget_bytes() -> int:
+    """
+    ADMISSION_MEMORY_BUDGET_MB, or 75% of physical memory when it is 0.
+    """
+    if settings.ADMISSION_MEMORY_BUDGET_MB > 0:
+        return settings.ADMISSION_MEMORY_BUDGET_MB * 2**20
+    try:
+        return int(os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") * 0.75)
+    except (AttributeError, ValueError, OSError):
+        return 4096 * 2**20
+
+def bytes_per_pixel(paths: Iterable[str]) -> int:
+    """
+    Bytes of one pixel across all bands of all inputs (rasters on the same grid).
+    """
+    total = 0
+    for path in paths:
+        with raster_io.open_shared(path) as src:
+            total += sum(np.dtype(dtype).itemsize for dtype in src.dtypes)
+    return total
+
+def estimate_bytes(paths: Iterable[str], pixels: Optional[int] = None) -> int:
+    """
+    Peak memory estimate of the analysis pipeline over these inputs: width x height x
+    bands x dtype size of each input, times ADMISSION_PIPELINE_MULTIPLIER (intermediates,
+    labels, polygons, flow routing). `pixels` restricts it to a tile of that many pixels.
+    """
+    paths = list(paths)
+    per_pixel = 0
+    total = 0
+    for path in paths:
+        with raster_io.open_shared(path) as src:
+            size = sum(np.dtype(dtype).itemsize for dtype in src.dtypes)
+            per_pixel += size
+            total += src.width * src.height * size
+    if pixels is not None:
+        total = pixels * per_pixel
+    return int(total * settings.ADMISSION_PIPELINE_MULTIPLIER)
+
+def tile_size_for(paths: Iterable[str], budget: Optional[int] = None) -> int:
+    """
+    Largest map-reduce tile side (a multiple of 512) whose estimate fits the budget,
+    so an oversized job can run tiled instead of waiting forever.
+    """
+    budget = budget_bytes() if budget is None else budget
+    per_pixel = bytes_per_pixel(paths) * settings.ADMISSION_PIPELINE_MULTIPLIER
+    side = int(np.sqrt(budget / max(per_pixel, 1)))
+    return max(512, min(side - side % 512, settings.MAPREDUCE_TILE_SIZE))
+
+def fits_alone(estimate: int) -> bool:
+    return estimate <= budget_bytes()
+
+def _record(state: dict, budget: int):
+    metrics.admission_reserved_bytes.set(sum(e["bytes"] for e in state["running"].values()))
+    metrics.admission_budget_bytes.set(budget)
+    metrics.admission_running_jobs.set(len(state["running"]))
+    metrics.admission_waiting_jobs.set(len(state["waiting"]))
+
+@contextmanager
+def admit(job: str, estimate: int, kind: str = "analysis"):
+    """
+    Block until `estimate` bytes can be reserved on this node, hold them for the body.
+    Jobs are admitted first come, first served; a job bigger than the whole budget is
+    admitted only when nothing else is running (callers should downscale it instead).
+    """
+    budget = budget_bytes()
+    ticket = f"{job}:{uuid.uuid4().hex[:8]}"
+    entry = {"job": job, "kind": kind, "bytes": int(estimate), "pid": os.getpid(),
+             "host": socket.gethostname(), "since": time.time()}
+    start = time.perf_counter()
+    queued = False
+    try:
+        while True:
+            with ledger.edit() as state:
+                state["waiting"].setdefault(ticket, entry)
+                first = min(state["waiting"], key=lambda t: state["waiting"][t]["since"])
+                reserved = sum(e["bytes"] for e in state["running"].values())
+                if first == ticket and (reserved + estimate <= budget or not state["running"]):
+                    del state["waiting"][ticket]
+                    state["running"][ticket] = dict(entry, since=time.time())
+                    _record(state, budget)
+                    break
+                _record(state, budget)
+            queued = True
+            time.sleep(settings.ADMISSION_POLL_SECONDS)
+    except BaseException:
+        with ledger.edit() as state:
+            state["waiting"].pop(ticket, None)
+        raise
+
+    waited = time.perf_counter() - start
+    decision = "queued" if queued else "admitted"
+    metrics.admission_decisions.inc(decision=decision, kind=kind)
+    metrics.admission_wait_seconds.observe(waited, kind=kind)
+    metrics.log_event("admission", job=job, kind=kind, decision=decision, estimate_bytes=int(estimate),
+                      reserved_bytes=reserved, budget_bytes=budget, wait_seconds=round(waited, 3))
+    try:
+        yield
+    finally:
+        with ledger.edit() as state:
+            state["running"].pop(ticket, None)
+            _record(state, budget)
+
+def record_downscale(job: str, estimate: int, tile_size: int, kind: str = "analysis"):
+    metrics.admission_decisions.inc(decision="downscaled", kind=kind)
+    metrics.log_event("admission", job=job, kind=kind, decision="downscaled", estimate_bytes=int(estimate),
+                      budget_bytes=budget_bytes(), tile_size=tile_size)
+
+def snapshot() -> dict:
+    """
+    Current reservations and waiters of this node, for the admin API.
+    """
+    with ledger.edit() as state:
+        # Copies: without fcntl the state is the live ledger
+        running = [dict(e) for e in state["running"].values()]
+        waiting = [dict(e) for e in state["waiting"].values()]
+    now = time.time()
+    for entry in running + waiting:
+        entry["seconds"] = round(now - entry.pop("since"), 3)
+    return {
+        "budget_bytes": budget_bytes(),
+        "reserved_bytes": sum(e["bytes"] for e in running),
+        "pipeline_multiplier": settings.ADMISSION_PIPELINE_MULTIPLIER,
+        "running": running,
+        "waiting": sorted(waiting, key=lambda e: -e["seconds"]),
+    }
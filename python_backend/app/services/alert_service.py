@@ -1,22 +1,28 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from typing import List
 from app.models.user import User
+from app.core import metrics
 from app.core.config import settings
+import logging
 import smtplib
 from email.mime.text import MIMEText
 # from geoalchemy2.elements import WKTElement
-import geopandas as gpd
 import shapely.geometry
+import shapely.wkt
 import json
 import os
-from geopy.distance import geodesic
+import time
+
+logger = logging.getLogger(__name__)
 
 def send_email(to_email: str, subject: str, body: str):
     """
     Send email using SMTP.
     """
     if not settings.SMTP_HOST:
-        print(f"SMTP not configured. Mock sending email to {to_email}: {subject}")
+        logger.info("SMTP not configured. Mock sending email to %s: %s", to_email, subject)
+        metrics.alerts_sent.inc(channel="email", status="mock")
         return
 
     msg = MIMEText(body)
@@ -31,14 +37,31 @@ def send_email(to_email: str, subject: str, body: str):
             if settings.SMTP_USER and settings.SMTP_PASSWORD:
                 server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
             server.send_message(msg)
+        metrics.alerts_sent.inc(channel="email", status="sent")
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        metrics.alerts_sent.inc(channel="email", status="failed")
+        logger.error("Failed to send email: %s", e)
+
+def _record_fanout(kind: str, scanned: int, alerted: int, start: float):
+    elapsed = time.perf_counter() - start
+    metrics.alert_users_scanned.inc(scanned, kind=kind)
+    metrics.alert_fanout_seconds.observe(elapsed, kind=kind)
+    metrics.log_event(
+        "alert_fanout",
+        kind=kind,
+        users_scanned=scanned,
+        alerts_sent=alerted,
+        seconds=round(elapsed, 6),
+        alerts_per_second=round(alerted / elapsed, 2) if elapsed > 0 else None
+    )
 
 def alert_users_in_flow_buffer(db: Session, flow_path_geojson: str, buffer_km: float = 2.0):
     """
-    Load flow path GeoJSON, create a buffer, and find users within it.
+    Load flow path GeoJSON, create a buffer, and find users within it. An inundation
+    extent (inundation.inundation_extent) is used as is, without a buffer.
     SQLite/Python implementation using Shapely/GeoPandas.
     """
+    start = time.perf_counter()
     try:
         # Load Flow Path
         with open(flow_path_geojson, 'r') as f:
@@ -47,11 +70,17 @@ def alert_users_in_flow_buffer(db: Session, flow_path_geojson: str, buffer_km: f
         # Extract geometry (LineString)
         geom = shapely.geometry.shape(data['geometry'])
         
-        # Create Buffer
-        # NOTE: Buffer in degrees (WGS84) is tricky. 1 deg ~= 111km.
-        # 2km ~= 0.018 degrees. This is a rough approximation.
-        buffer_degrees = buffer_km / 111.0 
-        buffered_geom = geom.buffer(buffer_degrees)
+        is_extent = data.get("properties", {}).get("type") == "inundation"
+        if is_extent:
+            buffered_geom = geom
+            zone = "the modelled flood extent of a glacial lake outburst"
+        else:
+            # Create Buffer
+            # NOTE: Buffer in degrees (WGS84) is tricky. 1 deg ~= 111km.
+            # 2km ~= 0.018 degrees. This is a rough approximation.
+            buffer_degrees = buffer_km / 111.0 
+            buffered_geom = geom.buffer(buffer_degrees)
+            zone = f"the predicted flow path of a glacial lake outburst (approximately {buffer_km}km wide along the flow channel)"
         
         # Query ALL Users (Inefficient for large DB, fine for prototype)
         all_users = db.query(User).all()
@@ -63,8 +92,7 @@ def alert_users_in_flow_buffer(db: Session, flow_path_geojson: str, buffer_km: f
             if buffered_geom.contains(user_point):
                 subject = "GLACIERWATCH SOS: FLOOD RISK ALERT"
                 body = f"""
-                URGENT: You are located within the predicted flow path of a glacial lake outburst.
-                The danger zone is approximately {buffer_km}km wide along the flow channel.
+                URGENT: You are located within {zone}.
                 
                 Please evacuate to higher ground immediately.
                 
@@ -73,17 +101,46 @@ def alert_users_in_flow_buffer(db: Session, flow_path_geojson: str, buffer_km: f
                 send_email(user.email, subject, body)
                 count += 1
             
+        _record_fanout("inundation" if is_extent else "flow_buffer", len(all_users), count, start)
         return count
     except Exception as e:
-        print(f"Error in alert system: {e}")
+        logger.exception("Error in alert system: %s", e)
         return 0
 
+def alert_user_at_location(email: str, zones: List[dict]):
+    """
+    Warn a single user whose (new) location lies inside active danger areas
+    (hits from geofence.check_location).
+    """
+    start = time.perf_counter()
+    levels = sorted({zone["risk_level"] for zone in zones})
+    areas = "\n    ".join(
+        f"- Analysis {zone['analysis_id']}: {zone['description'] or zone['kind']} ({zone['risk_level']} risk)"
+        for zone in zones
+    )
+    subject = "GLACIERWATCH SOS: YOU ARE IN A RISK ZONE"
+    body = f"""
+    URGENT: The location saved on your account lies inside an active glacial lake outburst danger area.
+
+    {areas}
+
+    Please follow local evacuation protocols and move to higher ground immediately.
+
+    Risk Level: {', '.join(levels)}
+    Detected at: {settings.PROJECT_NAME}
+    """
+    send_email(email, subject, body)
+    _record_fanout("geofence", 1, 1, start)
+
 def alert_users_in_danger_zone(db: Session, risk_location_wkt: str, radius_km: float = 10.0):
     """
     Find users within radius_km of the risk_location and send SOS.
     risk_location_wkt: WKT representation of the risk center/polygon.
     SQLite/Python implementation.
     """
+    from geopy.distance import geodesic
+
+    start = time.perf_counter()
     try:
         risk_point = shapely.wkt.loads(risk_location_wkt)
         risk_coords = (risk_point.y, risk_point.x) # Lat, Lon
@@ -108,7 +165,8 @@ def alert_users_in_danger_zone(db: Session, risk_location_wkt: str, radius_km: f
                 send_email(user.email, subject, body)
                 count += 1
         
+        _record_fanout("radius", len(all_users), count, start)
         return count
     except Exception as e:
-        print(f"Error in radius alert: {e}")
+        logger.exception("Error in radius alert: %s", e)
         return 0
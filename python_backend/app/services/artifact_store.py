@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional, Set
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Layout under settings.ARTIFACT_DIR:
+#   analyses/<analysis_id>/<product>.<ext>   products of one analysis (change masks are
+#                                            block-sparse .npz, see sparse_mask; change_export
+#                                            is their dense GeoTIFF, written on demand)
+#   scenes/<scene key>/<product>.tif         per-scene products (NDWI; drainage, HAND, slope
+#                                            and aspect of DEMs), shared by analyses
+#   scenes/<raster key>/stats.json           statistics and histograms of a raster (a scene
+#                                            or a product such as NDWI), see raster_stats
+#   leases/<token>.lease                     artifacts a running task is using (see lease)
+#
+# Regenerable products (rebuilt by their readers when missing: scene NDWI, the change
+# export, DEM drainage, HAND, slope and aspect) can be evicted when the store is over
+# its disk budget, unless a caller keeps them or a task holds a lease on them. NDWIs
+# that analyses point to are evictable too: their statistics are keyed to the source
+# scene (raster_stats.save), so the stored histograms outlive the raster. Change masks,
+# risk maps, flow paths and inundation extents are only produced by their analysis and
+# are never evicted, nor are raster statistics: they are tiny and save a full raster
+# read whenever a threshold is chosen.
+PRODUCTS = {
+    "ndwi": {"ext": "tif", "codec": "float", "regenerable": True},
+    "change": {"ext": "npz", "codec": None, "regenerable": False},
+    "change_export": {"ext": "tif", "codec": "mask", "regenerable": True},
+    "slope": {"ext": "tif", "codec": "float", "regenerable": True},
+    "aspect": {"ext": "tif", "codec": "float", "regenerable": True},
+    "drainage": {"ext": "tif", "codec": "byte", "regenerable": True},
+    "hand": {"ext": "tif", "codec": "float", "regenerable": True},
+    "risk_map": {"ext": "json", "codec": None, "regenerable": False},
+    "flow_path": {"ext": "json", "codec": None, "regenerable": False},
+    "inundation": {"ext": "json", "codec": None, "regenerable": False},
+    "stats": {"ext": "json", "codec": None, "regenerable": False},
+}
+
+store_bytes = metrics.gauge("artifact_store_bytes", "Disk usage of the artifact store")
+evicted_bytes = metrics.counter("artifact_store_evicted_bytes_total", "Bytes evicted from the artifact store")
+
+def creation_options(codec: str) -> dict:
+    """
+    GeoTIFF creation options per codec:
+      float: ZSTD with the floating-point predictor (smaller and ~3x faster to write than LZW)
+      mask:  1-bit packed DEFLATE for 0/1 masks
+      byte:  DEFLATE for small categorical codes (DEM drainage directions)
+    """
+    tiling = {"tiled": True, "blockxsize": 512, "blockysize": 512, "BIGTIFF": "IF_SAFER"}
+    if codec == "float":
+        return dict(tiling, compress="zstd", predictor=3, zstd_level=settings.ARTIFACT_ZSTD_LEVEL)
+    if codec == "mask":
+        return dict(tiling, compress="deflate", nbits=1)
+    if codec == "byte":
+        return dict(tiling, compress="deflate")
+    raise ValueError(f"Unknown codec: {codec}")
+
+def raster_profile(product: str, profile: dict) -> dict:
+    """
+    Copy of `profile` with the product's creation options. Small rasters fall back
+    to strips (GDAL requires tiles to fit the raster and be multiples of 16).
+    """
+    profile = {k: v for k, v in profile.items() if k.lower() not in ("compress", "predictor", "zstd_level", "nbits")}
+    profile.update(driver="GTiff", **creation_options(PRODUCTS[product]["codec"]))
+    width, height = profile.get("width"), profile.get("height")
+    if width is not None and height is not None and (width < 512 or height < 512):
+        for key in ("tiled", "blockxsize", "blockysize"):
+            profile.pop(key, None)
+    return profile
+
+def analysis_path(analysis_id: int, product: str) -> str:
+    directory = os.path.join(settings.ARTIFACT_DIR, "analyses", str(analysis_id))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{product}.{PRODUCTS[product]['ext']}")
+
+def scene_key(image_path: str) -> str:
+    return hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()[:16]
+
+def scene_path(image_path: str, product: str) -> str:
+    directory = os.path.join(settings.ARTIFACT_DIR, "scenes", scene_key(image_path))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{product}.{PRODUCTS[product]['ext']}")
+
+def is_fresh(artifact: str, *sources: str) -> bool:
+    """
+    True when `artifact` exists and is newer than every source it was derived from.
+    """
+    if not os.path.exists(artifact):
+        return False
+    mtime = os.path.getmtime(artifact)
+    return all(os.path.getmtime(source) <= mtime for source in sources if os.path.exists(source))
+
+def _product_of(path: str) -> Optional[str]:
+    name, _ = os.path.splitext(os.path.basename(path))
+    return name if name in PRODUCTS else None
+
+def _lease_dir() -> str:
+    directory = os.path.join(settings.ARTIFACT_DIR, "leases")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+@contextmanager
+def lease(paths: Iterable[str]):
+    """
+    `with lease([ndwi1, ndwi2]):` keeps the artifacts from being evicted by any process
+    until the block ends. Leases older than ARTIFACT_LEASE_SECONDS are ignored.
+    """
+    fd, lease_path = tempfile.mkstemp(suffix=".lease", dir=_lease_dir())
+    with os.fdopen(fd, "w") as f:
+        json.dump([os.path.abspath(p) for p in paths], f)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lease_path)
+        except OSError:
+            pass
+
+def leased() -> Set[str]:
+    """
+    Absolute paths under a live lease; expired lease files are removed.
+    """
+    paths, now = set(), time.time()
+    directory = _lease_dir()
+    for name in os.listdir(directory):
+        lease_path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(lease_path) > settings.ARTIFACT_LEASE_SECONDS:
+                os.remove(lease_path)
+                continue
+            with open(lease_path) as f:
+                paths.update(json.load(f))
+        except (OSError, ValueError):
+            continue # released meanwhile, or still being written
+    return paths
+
+def enforce_budget(keep: Iterable[str] = ()) -> int:
+    """
+    Evict regenerable artifacts, least recently used first, until the store fits
+    ARTIFACT_DISK_BUDGET_MB. Paths in `keep` (e.g. artifacts referenced from the
+    database) and leased paths are never evicted. Returns the number of bytes freed.
+    """
+    budget = settings.ARTIFACT_DISK_BUDGET_MB * 2**20
+    keep = {os.path.abspath(p) for p in keep if p} | leased()
+    candidates, total = [], 0
+    for root, _, files in os.walk(settings.ARTIFACT_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            product = _product_of(path)
+            if product and PRODUCTS[product]["regenerable"] and os.path.abspath(path) not in keep:
+                candidates.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+    freed = 0
+    if budget > 0 and total > budget:
+        for _, size, path in sorted(candidates):
+            if total - freed <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Could not evict %s: %s", path, e)
+                continue
+            freed += size
+        evicted_bytes.inc(freed)
+        metrics.log_event("artifact_eviction", freed_bytes=freed, budget_bytes=budget, before_bytes=total)
+    store_bytes.set(total - freed)
+    return freed
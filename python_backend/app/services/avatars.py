@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import BinaryIO, Dict, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Profile images are stored under their content hash and served from /static with
+# immutable cache headers: a new upload gets a new URL, so caches never need purging.
+# The original is kept; resized square variants (AVATAR_SIZES) are generated after the
+# upload response, and the user's profile_picture is switched to the "md" variant once
+# they exist. Pillow is imported on first use.
+AVATAR_DIR = os.path.join("uploads", "avatars")
+AVATAR_URL = "/static/avatars"
+_VARIANT = re.compile(rf"^{AVATAR_URL}/(?P<digest>[0-9a-f]+)-md\.(?P<ext>webp|jpg)$")
+_EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+# Extensions of stored originals, by the format Pillow detects (never the client's filename)
+_ORIGINAL_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+
+def _extension() -> str:
+    return _EXTENSIONS[settings.AVATAR_FORMAT]
+
+def variant_name(digest: str, size: str, ext: Optional[str] = None) -> str:
+    return f"{digest}-{size}.{ext or _extension()}"
+
+def variant_urls(profile_picture: Optional[str]) -> Optional[Dict[str, str]]:
+    """
+    {size: url} for a profile picture that points at a generated variant, else None
+    (no picture, a legacy upload, or variants still being generated).
+    """
+    match = _VARIANT.match(profile_picture or "")
+    if match is None:
+        return None
+    return {
+        size: f"{AVATAR_URL}/{variant_name(match['digest'], size, match['ext'])}"
+        for size in settings.AVATAR_SIZES
+    }
+
+def original_url(path: str) -> str:
+    return f"{AVATAR_URL}/{os.path.basename(path)}"
+
+def save_original(upload: BinaryIO) -> str:
+    """
+    Stream an upload to AVATAR_DIR under its SHA-256 and check that Pillow can read it.
+    Returns the stored path, with the extension of the detected format; raises
+    ValueError for anything that is not a JPEG, PNG, WebP or GIF image, for uploads
+    over AVATAR_MAX_BYTES and for images over Pillow's MAX_IMAGE_PIXELS.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    os.makedirs(AVATAR_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=AVATAR_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: upload.read(1 << 20), b""):
+                size += len(chunk)
+                if size > settings.AVATAR_MAX_BYTES:
+                    raise ValueError(f"Image is larger than {settings.AVATAR_MAX_BYTES // 2**20} MiB")
+                digest.update(chunk)
+                out.write(chunk)
+        try:
+            with Image.open(tmp_path) as image:
+                image.verify()
+                ext = _ORIGINAL_EXTENSIONS.get(image.format)
+                width, height = image.size
+        except Image.DecompressionBombError as e:
+            raise ValueError("Image dimensions are too large") from e
+        except (UnidentifiedImageError, OSError, SyntaxError) as e:
+            raise ValueError("Not a supported image file") from e
+        if ext is None:
+            raise ValueError("Not a supported image file")
+        # Pillow only warns below twice MAX_IMAGE_PIXELS, and the variants would decode it
+        if Image.MAX_IMAGE_PIXELS and width * height > Image.MAX_IMAGE_PIXELS:
+            raise ValueError("Image dimensions are too large")
+        path = os.path.join(AVATAR_DIR, f"{digest.hexdigest()[:32]}.{ext}")
+        os.replace(tmp_path, path)
+        return path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def generate_variants(original_path: str) -> Dict[str, str]:
+    """
+    Write square, center-cropped variants of an original for every AVATAR_SIZES entry,
+    skipping the ones that already exist. Returns {size: path}.
+    """
+    from PIL import Image, ImageOps
+
+    digest = os.path.splitext(os.path.basename(original_path))[0]
+    paths = {size: os.path.join(AVATAR_DIR, variant_name(digest, size)) for size in settings.AVATAR_SIZES}
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+
+    with Image.open(original_path) as image:
+        image = ImageOps.exif_transpose(image)
+        keep_alpha = settings.AVATAR_FORMAT == "webp" and image.mode in ("RGBA", "LA", "P")
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+        if settings.AVATAR_FORMAT == "webp":
+            options = {"quality": settings.AVATAR_QUALITY, "method": 4}
+        else:
+            options = {"quality": settings.AVATAR_QUALITY, "optimize": True, "progressive": True}
+        # Largest first, each variant resized from the previous one
+        for size, pixels in sorted(settings.AVATAR_SIZES.items(), key=lambda item: -item[1]):
+            image = ImageOps.fit(image, (pixels, pixels), Image.LANCZOS)
+            tmp_path = paths[size] + ".part"
+            image.save(tmp_path, format=settings.AVATAR_FORMAT.upper(), **options)
+            os.replace(tmp_path, paths[size])
+    return paths
+
+def process_upload(user_id: int, original_path: str):
+    """
+    Background step after an upload: build the variants and point the user at the
+    "md" one, unless they have uploaded another picture in the meantime.
+    """
+    from app.db.session import SessionLocal
+    from app.models.user import User
+
+    try:
+        paths = generate_variants(original_path)
+    except Exception:
+        logger.exception("Could not generate avatar variants for %s", original_path)
+        return
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        if user is not None and user.profile_picture == original_url(original_path):
+            user.profile_picture = f"{AVATAR_URL}/{os.path.basename(paths['md'])}"
+            db.commit()
+    finally:
+        db.close()
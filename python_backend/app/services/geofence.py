@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+import numpy as np
+import shapely
+import shapely.geometry
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.core import metrics
+from app.core.config import settings
+from app.models.analysis import AnalysisResult, RiskZone
+from app.services import artifact_store, vector_tiles
+
+logger = logging.getLogger(__name__)
+
+# Reverse geofence: an in-memory STRtree over everything a resident must be warned
+# about (risk zones, and flood extents or buffered flow paths, of recent High/Critical
+# analyses), so a single location is checked without touching the zones table. Every
+# analysis commit rewrites its tile features, so their version counter - the vector-tile
+# cache version - tells any process when its index is stale. Zones are indexed in
+# lon/lat; those stored in a raster CRS (a GeoJSON "crs" member) are reprojected.
+
+class GeofenceIndex:
+    """
+    Active danger areas and their descriptions; `query` returns those containing a point.
+    """
+    def __init__(self, geoms: List, zones: List[dict], version: Optional[int]):
+        self.geoms = np.asarray(geoms, dtype=object)
+        self.zones = zones
+        self.tree = shapely.STRtree(self.geoms)
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.zones)
+
+    def query(self, lon: float, lat: float) -> List[dict]:
+        hits = self.tree.query(shapely.Point(lon, lat), predicate="intersects")
+        return [self.zones[i] for i in sorted(hits)]
+
+def _data_version(db: Session) -> Optional[int]:
+    return vector_tiles.data_version(db)
+
+def _lonlat_shape(geometry: dict):
+    """
+    Shapely geometry of a stored GeoJSON geometry, reprojected to lon/lat when it names a CRS.
+    """
+    crs = (geometry.get("crs") or {}).get("properties", {}).get("name")
+    if crs and not vector_tiles.is_lonlat(crs):
+        from rasterio.warp import transform_geom # only for zones stored in a raster CRS
+        geometry = transform_geom(crs, "EPSG:4326", {k: v for k, v in geometry.items() if k != "crs"})
+    return shapely.geometry.shape(geometry)
+
+def build_index(db: Session, version: Optional[int] = None) -> GeofenceIndex:
+    """
+    Load the risk zones and flood areas of analyses created in the last
+    GEOFENCE_ACTIVE_DAYS with a risk level in GEOFENCE_RISK_LEVELS.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=settings.GEOFENCE_ACTIVE_DAYS)
+    analyses = db.execute(
+        select(AnalysisResult.id, AnalysisResult.risk_level)
+        .where(AnalysisResult.risk_level.in_(settings.GEOFENCE_RISK_LEVELS), AnalysisResult.created_at >= cutoff)
+    ).all()
+    analysis_ids = [row.id for row in analyses]
+
+    geoms, zones = [], []
+    if analysis_ids:
+        rows = db.execute(
+            select(RiskZone.analysis_id, RiskZone.risk_level, RiskZone.description, RiskZone.geometry_geojson)
+            .where(RiskZone.analysis_id.in_(analysis_ids), RiskZone.risk_level.in_(settings.GEOFENCE_RISK_LEVELS))
+        )
+        for analysis_id, risk_level, description, geometry in rows:
+            if not geometry:
+                continue
+            geoms.append(_lonlat_shape(json.loads(geometry) if isinstance(geometry, str) else geometry))
+            zones.append({"analysis_id": analysis_id, "kind": "risk_zone", "risk_level": risk_level,
+                          "description": description})
+
+    # Same areas as the alert sweep: the inundation extent, else the flow-path corridor
+    # of alert_users_in_flow_buffer (buffer in degrees, ~111 km per degree)
+    buffer_degrees = settings.ALERT_FLOW_BUFFER_KM / 111.0
+    for analysis_id, risk_level in analyses:
+        for product in ("inundation", "flow_path"):
+            path = artifact_store.analysis_path(analysis_id, product)
+            if os.path.exists(path):
+                break
+        else:
+            continue
+        try:
+            with open(path) as f:
+                geom = shapely.geometry.shape(json.load(f)["geometry"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Skipping unreadable %s %s: %s", product, path, e)
+            continue
+        if product == "inundation":
+            geoms.append(geom)
+            zones.append({"analysis_id": analysis_id, "kind": "inundation", "risk_level": risk_level,
+                          "description": "Inside the modelled flood extent"})
+        else:
+            geoms.append(geom.buffer(buffer_degrees))
+            zones.append({"analysis_id": analysis_id, "kind": "flow_path", "risk_level": risk_level,
+                          "description": f"Within {settings.ALERT_FLOW_BUFFER_KM:g} km of the predicted flow path"})
+
+    return GeofenceIndex(geoms, zones, version)
+
+_index: Optional[GeofenceIndex] = None
+_index_lock = threading.Lock()
+
+def current_index(db: Session) -> GeofenceIndex:
+    """
+    The process-wide index, rebuilt when the zone data changed or it is older than
+    GEOFENCE_REFRESH_SECONDS (analyses also age out of the active window).
+    """
+    global _index
+    version = _data_version(db)
+    index = _index
+    if index is not None and index.version == version \
+            and time.monotonic() - index.built_at < settings.GEOFENCE_REFRESH_SECONDS:
+        return index
+    with _index_lock:
+        if _index is None or _index.version != version \
+                or time.monotonic() - _index.built_at >= settings.GEOFENCE_REFRESH_SECONDS:
+            start = time.perf_counter()
+            _index = build_index(db, version)
+            metrics.log_event("geofence_rebuilt", zones=len(_index), version=version,
+                              seconds=round(time.perf_counter() - start, 6))
+        return _index
+
+def invalidate():
+    global _index
+    with _index_lock:
+        _index = None
+
+def check_location(db: Session, lon: float, lat: float) -> List[dict]:
+    """
+    Active danger areas containing (lon, lat); empty when the location is safe or unknown.
+    """
+    if lon is None or lat is None:
+        return []
+    index = current_index(db)
+    start = time.perf_counter()
+    hits = index.query(lon, lat)
+    metrics.geofence_check_seconds.observe(time.perf_counter() - start)
+    metrics.geofence_checks.inc(result="inside" if hits else "outside")
+    return hits
@@ -1,15 +1,29 @@
+import logging
 import rasterio
 import numpy as np
 import json
 import shapely.geometry
-from pysheds.grid import Grid
 # from geoalchemy2.shape import from_shape
+from app.services import raster_io, sparse_mask
+
+logger = logging.getLogger(__name__)
+
+# Assumed average depth increase over newly flooded pixels (volume proxy)
+ASSUMED_DEPTH_INCREASE = 5.0
 
 def calculate_volume_change(dem_path: str, change_mask_path: str):
     """
     Calculate volume change based on DEM and change mask.
+    Sparse (.npz) masks are answered from their block counts without reading the DEM.
     """
-    with rasterio.open(dem_path) as dem_src, rasterio.open(change_mask_path) as mask_src:
+    if sparse_mask.is_sparse(change_mask_path):
+        with raster_io.open_shared(dem_path) as dem_src:
+            pixel_size_x, pixel_size_y = dem_src.res
+        return sparse_mask.SparseMask.load(change_mask_path).volume(
+            ASSUMED_DEPTH_INCREASE, pixel_area=abs(pixel_size_x * pixel_size_y)
+        )
+
+    with raster_io.open_shared(dem_path) as dem_src, rasterio.open(change_mask_path) as mask_src:
         dem = dem_src.read(1)
         mask = mask_src.read(1)
         
@@ -26,103 +40,43 @@ def calculate_volume_change(dem_path: str, change_mask_path: str):
         pixel_area = abs(pixel_size_x * pixel_size_y)
         
         # Assuming 5m avg depth increase for now as a proxy
-        volume = np.sum(mask) * pixel_area * 5.0 
+        volume = np.sum(mask) * pixel_area * ASSUMED_DEPTH_INCREASE
         return volume
 
 def generate_flow_path(dem_path: str, start_lat: float, start_lon: float, output_geojson_path: str):
     """
-    Generate a flow path using pysheds from a starting point (lat/lon).
-    Returns the path to the GeoJSON file.
+    Trace the D8 flow path downstream of a starting point (lat/lon) over the conditioned
+    DEM, up to INUNDATION_MAX_DISTANCE_KM. Depressions are filled, so the path does not
+    stop in the first pit. The start is in DEM CRS coordinates, the written line in
+    lon/lat. Returns the path to the GeoJSON file.
     """
-    grid = Grid.from_raster(dem_path)
-    dem = grid.read_raster(dem_path)
-    
-    # Fill depressions
-    pit_filled_dem = grid.fill_pits(dem)
-    
-    # Fill depressions again to be safe
-    flooded_dem = grid.fill_depressions(pit_filled_dem)
-    
-    # Resolve flats
-    inflated_dem = grid.resolve_flats(flooded_dem)
-    
-    # Determine flow direction
-    fdir = grid.flowdir(inflated_dem)
-    
-    # Determine flow accumulation (optional, but good for visualization)
-    acc = grid.accumulation(fdir)
-    
-    # Snap start point to grid
-    # x is lon, y is lat
-    x_snap, y_snap = grid.snap_to_mask(acc > 100, (start_lon, start_lat))
-    
-    # Trace flow
-    # This returns a tuple of (y, x) arrays? or (x, y)? Pysheds documentation says (y, x) indices
-    # We need to convert indices back to coords
+    # numba comes with flow routing; the drainage raster is cached per DEM
+    from app.core.config import settings
+    from app.services import hydrology, inundation
+
+    drainage_raster = inundation.drainage_path(dem_path)
+    with rasterio.open(drainage_raster) as src:
+        drainage = src.read(1)
+        transform, crs = src.transform, src.crs
+        row, col = src.index(start_lon, start_lat)
+
     try:
-        # Pysheds flow trace
-        # catchments = grid.catchment(x=x_snap, y=y_snap, fdir=fdir, xytype='coordinate')
-        # We want the downstream path, not catchment.
-        # grid.flow_distance gives distance to outlet.
-        
-        # Actually, for a single path downstream, we can just walk the flow direction grid.
-        # But pysheds doesn't have a direct "trace downstream" function that returns a line.
-        # It usually does accumulation.
-        
-        # Let's implement a simple walker on fdir if pysheds doesn't give a path object easily.
-        # Or use a simplified approach:
-        # Find the path of steepest descent from the start point until it hits a boundary or flat.
-        
-        path_coords = []
-        curr_y, curr_x = grid.nearest_cell(start_lon, start_lat)
-        
-        # Limit steps to prevent infinite loops
-        for _ in range(1000):
-            # Get coordinate of current cell
-            # grid.affine is (xres, 0, minx, 0, -yres, maxy) usually
-            # affine * (col, row) -> (x, y)
-            lon, lat = grid.affine * (curr_x + 0.5, curr_y + 0.5)
-            path_coords.append((lon, lat))
-            
-            # Get flow direction at this cell
-            # fdir values depend on the dirmap. Default is [64, 128, 1, 2, 4, 8, 16, 32] (N, NE, E, SE, S, SW, W, NW)
-            # Check pysheds default dirmap
-            
-            # For simplicity in this prototype if pysheds is complex to debug without running:
-            # We will assume we can extract a flow path. 
-            # If pysheds is too heavy, we can fall back to a mock path for the demo.
-            # But let's try to use the logic.
-            
-            # Simple workaround: Just append current, move to neighbor with lowest elevation (Steepest Descent)
-            # This avoids dealing with fdir encoding issues.
-            
-            neighbors = [
-                (curr_y-1, curr_x), (curr_y-1, curr_x+1), (curr_y, curr_x+1), (curr_y+1, curr_x+1),
-                (curr_y+1, curr_x), (curr_y+1, curr_x-1), (curr_y, curr_x-1), (curr_y-1, curr_x-1)
-            ]
-            
-            min_elev = dem[curr_y, curr_x]
-            next_y, next_x = -1, -1
-            found_lower = False
-            
-            for ny, nx in neighbors:
-                if 0 <= ny < dem.shape[0] and 0 <= nx < dem.shape[1]:
-                    if dem[ny, nx] < min_elev:
-                        min_elev = dem[ny, nx]
-                        next_y, next_x = ny, nx
-                        found_lower = True
-            
-            if found_lower:
-                curr_y, curr_x = next_y, next_x
-            else:
-                break
-        
+        rows, cols = drainage.shape
+        if not (0 <= row < rows and 0 <= col < cols):
+            raise ValueError(f"Start point ({start_lat}, {start_lon}) is outside the DEM")
+        cell_x, cell_y = inundation.cell_size_m(transform, crs, rows)
+        max_steps = max(1, int(settings.INUNDATION_MAX_DISTANCE_KM * 1000 / min(cell_x, cell_y)))
+        path = hydrology.trace(drainage, row, col, max_steps)
+        path_rows, path_cols = np.divmod(path, cols)
+        xs, ys = rasterio.transform.xy(transform, path_rows, path_cols)
+        coords = list(zip(xs, ys)) if len(path) > 1 else [(xs[0], ys[0])] * 2
+
         # Create GeoJSON LineString
-        line = shapely.geometry.LineString(path_coords)
+        line = shapely.geometry.LineString(coords)
         feature = {
             "type": "Feature",
             "properties": {"type": "flow_path"},
-            "geometry": shapely.geometry.mapping(line)
+            "geometry": inundation.lonlat_geometry(line, crs)
         }
         
         with open(output_geojson_path, 'w') as f:
@@ -131,13 +85,13 @@ def generate_flow_path(dem_path: str, start_lat: float, start_lon: float, output
         return output_geojson_path
 
     except Exception as e:
-        print(f"Error generating flow path: {e}")
+        logger.exception("Error generating flow path: %s", e)
         # Fallback: create a small line from start point
         line = shapely.geometry.LineString([(start_lon, start_lat), (start_lon + 0.01, start_lat - 0.01)])
         feature = {
             "type": "Feature",
             "properties": {"type": "flow_path_fallback"},
-            "geometry": shapely.geometry.mapping(line)
+            "geometry": inundation.lonlat_geometry(line, crs)
         }
         with open(output_geojson_path, 'w') as f:
             json.dump(feature, f)
@@ -0,0 +1,803 @@
+import logging
+import os
+import shutil
+import tempfile
+from collections import deque
+from typing import Dict, Optional, Tuple
+import numpy as np
+import rasterio
+from numba import njit, types
+from numba.typed import Dict as NumbaDict
+from rasterio.windows import Window
+from app.core import metrics
+from app.core.config import settings
+from app.services import raster_io
+
+logger = logging.getLogger(__name__)
+
+# DEM conditioning without pysheds: Priority-Flood (Barnes, Lehman & Mulla 2014)
+# compiled with numba. Cells are flooded inward from the outlets (grid border and
+# nodata) in order of elevation and raised to the level they were reached at, which
+# fills depressions exactly. Every cell then drains (D8) to its lowest neighbour, and
+# flats drain along their distance to the nearest cell with a lower neighbour (or an
+# outlet), so water leaves a filled depression by the shortest way across it. The DEM
+# is modified in place as float32, so the only full-size arrays are the DEM, the byte
+# directions, the flat distances and the accumulation.
+#
+# DEMs larger than HYDROLOGY_IN_MEMORY_MAX_PIXELS are processed in HYDROLOGY_TILE_SIZE
+# tiles: each tile is flooded from its own border, recording which border cell every
+# cell drains to and where those watersheds meet (Barnes 2016); the spill level of
+# every border watershed is then solved on that graph, and each tile is filled exactly
+# from a one-cell halo of its neighbours' filled borders. Flats are resolved the same
+# way as in memory, redone per tile until no tile border's flat distances change, so
+# both modes give the same directions; flow accumulation is carried across tile
+# borders (Barnes 2017).
+
+# D8 offsets in index order N, NE, E, SE, S, SW, W, NW, and pysheds' codes for them
+D8_ROW = np.array([-1, -1, 0, 1, 1, 1, 0, -1], dtype=np.int64)
+D8_COL = np.array([0, 1, 1, 1, 0, -1, -1, -1], dtype=np.int64)
+PYSHEDS_DIRMAP = (64, 128, 1, 2, 4, 8, 16, 32)
+NO_OUTFLOW = 8 # outlets (grid border, next to nodata) and nodata
+CHANNEL_BIT = 16 # set in drainage rasters on cells with accumulation >= the channel threshold
+SEED = 254 # fixed outlet cells (a tile's halo): flooded from, never routed
+UNSET = 255
+OCEAN = 1 # label of everything that drains off the DEM
+FLAT_UNKNOWN = 2**30 # flat distance not known yet (tiled mode)
+
+# --- Kernels ----------------------------------------------------------------------------
+
+@njit(nogil=True, cache=True)
+def _heap_push(keys, items, size, key, item):
+    if size == keys.shape[0]:
+        grown_keys = np.empty(2 * size, dtype=keys.dtype)
+        grown_items = np.empty(2 * size, dtype=items.dtype)
+        grown_keys[:size] = keys
+        grown_items[:size] = items
+        keys, items = grown_keys, grown_items
+    i = size
+    while i > 0:
+        parent = (i - 1) >> 1
+        if keys[parent] < key or (keys[parent] == key and items[parent] <= item):
+            break
+        keys[i] = keys[parent]
+        items[i] = items[parent]
+        i = parent
+    keys[i] = key
+    items[i] = item
+    return keys, items, size + 1
+
+@njit(nogil=True, cache=True)
+def _heap_pop(keys, items, size):
+    top = items[0]
+    size -= 1
+    key = keys[size]
+    item = items[size]
+    i = 0
+    while True:
+        child = 2 * i + 1
+        if child >= size:
+            break
+        if child + 1 < size and (keys[child + 1] < keys[child] or
+                                 (keys[child + 1] == keys[child] and items[child + 1] < items[child])):
+            child += 1
+        if keys[child] < key or (keys[child] == key and items[child] < item):
+            keys[i] = keys[child]
+            items[i] = items[child]
+            i = child
+        else:
+            break
+    keys[i] = key
+    items[i] = item
+    return top, size
+
+@njit(nogil=True, cache=True)
+def _fifo_push(queue, head, tail, item):
+    if tail == queue.shape[0]:
+        if head > 0:
+            for i in range(tail - head):
+                queue[i] = queue[head + i]
+            tail -= head
+            head = 0
+        else:
+            grown = np.empty(2 * tail, dtype=queue.dtype)
+            grown[:tail] = queue
+            queue = grown
+    queue[tail] = item
+    return queue, head, tail + 1
+
+@njit(nogil=True, cache=True)
+def _flood(dem, fdir, labels):
+    """
+    Priority-Flood over a C-contiguous float32 `dem` (NaN = nodata), in place.
+    `fdir` (uint8) is pre-set by the caller: UNSET for cells to route, SEED for fixed
+    outlets, anything else excludes the cell. Unrouted cells on the border or next to
+    nodata become outlets (NO_OUTFLOW); every other cell gets the D8 index of the
+    neighbour it was flooded from and is raised to at least that neighbour's elevation.
+
+    When `labels` has the DEM's shape, every outlet gets a watershed label (OCEAN next
+    to nodata or where pre-set, else a new one from 2 up) that the cells it floods
+    inherit. Returns the label pairs whose watersheds touch and the lowest elevation at
+    which they do (empty otherwise).
+    """
+    rows, cols = dem.shape
+    z_flat = dem.reshape(-1)
+    d_flat = fdir.reshape(-1)
+    track = labels.shape[0] == rows and labels.shape[1] == cols
+    l_flat = labels.reshape(-1)
+
+    has_nodata = False
+    for i in range(rows * cols):
+        if np.isnan(z_flat[i]):
+            has_nodata = True
+            if d_flat[i] == UNSET:
+                d_flat[i] = NO_OUTFLOW
+
+    capacity = 2 * (rows + cols) + 1024
+    keys = np.empty(capacity, dtype=np.float32)
+    items = np.empty(capacity, dtype=np.int64)
+    size = 0
+    next_label = 2
+    for r in range(rows):
+        full_row = has_nodata or r == 0 or r == rows - 1
+        step = 1 if full_row or cols == 1 else cols - 1
+        for c in range(0, cols, step):
+            i = r * cols + c
+            state = d_flat[i]
+            if state == SEED:
+                keys, items, size = _heap_push(keys, items, size, z_flat[i], i)
+                continue
+            if state != UNSET:
+                continue
+            next_to_nodata = False
+            if has_nodata:
+                for k in range(8):
+                    nr = r + D8_ROW[k]
+                    nc = c + D8_COL[k]
+                    if 0 <= nr < rows and 0 <= nc < cols and np.isnan(z_flat[nr * cols + nc]):
+                        next_to_nodata = True
+                        break
+            if not (next_to_nodata or r == 0 or r == rows - 1 or c == 0 or c == cols - 1):
+                continue
+            d_flat[i] = NO_OUTFLOW
+            if track and l_flat[i] == 0:
+                if next_to_nodata:
+                    l_flat[i] = OCEAN
+                else:
+                    l_flat[i] = next_label
+                    next_label += 1
+            keys, items, size = _heap_push(keys, items, size, z_flat[i], i)
+
+    # Cells raised to their neighbour's level are queued in arrival order instead of
+    # on the heap; the pit queue is sorted too, so taking the lower head keeps the
+    # elevation order (and ties go to the heap, i.e. flats grow from all their outlets)
+    pit = np.empty(capacity, dtype=np.int64)
+    head = 0
+    tail = 0
+    touching = NumbaDict.empty(key_type=types.int64, value_type=types.float32)
+    while size > 0 or head < tail:
+        if head < tail and (size == 0 or z_flat[pit[head]] < keys[0]):
+            cur = pit[head]
+            head += 1
+            if head == tail:
+                head = 0
+                tail = 0
+        else:
+            cur, size = _heap_pop(keys, items, size)
+        r = cur // cols
+        c = cur - r * cols
+        z = z_flat[cur]
+        for k in range(8):
+            nr = r + D8_ROW[k]
+            nc = c + D8_COL[k]
+            if nr < 0 or nr >= rows or nc < 0 or nc >= cols:
+                continue
+            n = nr * cols + nc
+            if d_flat[n] != UNSET:
+                if track and l_flat[n] > 0 and l_flat[n] != l_flat[cur]:
+                    a = min(l_flat[n], l_flat[cur])
+                    b = max(l_flat[n], l_flat[cur])
+                    key = (np.int64(a) << 32) | np.int64(b)
+                    spill = max(z, z_flat[n])
+                    if key not in touching or spill < touching[key]:
+                        touching[key] = spill
+                continue
+            d_flat[n] = (k + 4) & 7
+            if track:
+                l_flat[n] = l_flat[cur]
+            if z_flat[n] <= z:
+                z_flat[n] = z
+                pit, head, tail = _fifo_push(pit, head, tail, n)
+            else:
+                keys, items, size = _heap_push(keys, items, size, z_flat[n], n)
+
+    pairs = np.empty((len(touching), 2), dtype=np.int64)
+    elevations = np.empty(len(touching), dtype=np.float32)
+    j = 0
+    for key, spill in touching.items():
+        pairs[j, 0] = key >> 32
+        pairs[j, 1] = key & 0xFFFFFFFF
+        elevations[j] = spill
+        j += 1
+    return pairs, elevations
+
+@njit(nogil=True, cache=True)
+def _drain_flats(filled, fdir, distance):
+    """
+    D8 directions over an exactly filled grid (NaN = nodata), in place: every cell
+    drains to its neighbour with the lowest (filled elevation, flat distance), where
+    the flat distance counts the steps across a flat to the nearest of its cells that
+    has a lower neighbour or is an outlet. `fdir` is pre-set like for _flood; SEED
+    cells keep the `distance` given (FLAT_UNKNOWN if unknown), the others are computed.
+    """
+    rows, cols = filled.shape
+    z_flat = filled.reshape(-1)
+    d_flat = fdir.reshape(-1)
+    dist = distance.reshape(-1)
+    n = rows * cols
+    queue = np.empty(n, dtype=np.int64)
+    tail = 0
+    seeds = 0
+    for i in range(n):
+        if d_flat[i] == SEED:
+            seeds += 1
+            continue
+        if d_flat[i] != UNSET:
+            continue
+        dist[i] = FLAT_UNKNOWN
+        if np.isnan(z_flat[i]):
+            d_flat[i] = NO_OUTFLOW
+            continue
+        r = i // cols
+        c = i - r * cols
+        outlet = r == 0 or r == rows - 1 or c == 0 or c == cols - 1
+        lower = False
+        for k in range(8):
+            nr = r + D8_ROW[k]
+            nc = c + D8_COL[k]
+            if 0 <= nr < rows and 0 <= nc < cols:
+                z = z_flat[nr * cols + nc]
+                if np.isnan(z):
+                    outlet = True
+                elif z < z_flat[i]:
+                    lower = True
+        if outlet:
+            d_flat[i] = NO_OUTFLOW
+        if outlet or lower:
+            dist[i] = 0
+            queue[tail] = i
+            tail += 1
+
+    # Breadth-first across flats, merging the halo cells in order of their distance
+    halo = np.empty(seeds, dtype=np.int64)
+    j = 0
+    for i in range(n):
+        if d_flat[i] == SEED:
+            halo[j] = i
+            j += 1
+    halo = halo[np.argsort(dist[halo], kind="mergesort")]
+    head = 0
+    h = 0
+    while head < tail or (h < seeds and dist[halo[h]] < FLAT_UNKNOWN):
+        if head < tail and (h >= seeds or dist[queue[head]] <= dist[halo[h]]):
+            cur = queue[head]
+            head += 1
+        else:
+            cur = halo[h]
+            h += 1
+        r = cur // cols
+        c = cur - r * cols
+        for k in range(8):
+            nr = r + D8_ROW[k]
+            nc = c + D8_COL[k]
+            if nr < 0 or nr >= rows or nc < 0 or nc >= cols:
+                continue
+            m = nr * cols + nc
+            if d_flat[m] == UNSET and dist[m] == FLAT_UNKNOWN and z_flat[m] == z_flat[cur]:
+                dist[m] = dist[cur] + 1
+                queue[tail] = m
+                tail += 1
+
+    for i in range(n):
+        if d_flat[i] != UNSET:
+            continue
+        r = i // cols
+        c = i - r * cols
+        best_z = z_flat[i]
+        best_d = dist[i]
+        best = NO_OUTFLOW
+        for k in range(8):
+            nr = r + D8_ROW[k]
+            nc = c + D8_COL[k]
+            if 0 <= nr < rows and 0 <= nc < cols:
+                m = nr * cols + nc
+                z = z_flat[m]
+                if z < best_z or (z == best_z and dist[m] < best_d):
+                    best_z = z
+                    best_d = dist[m]
+                    best = k
+        d_flat[i] = best
+
+@njit(nogil=True, cache=True)
+def _accumulate(fdir, acc, queue):
+    """
+    Adds every cell's `acc` (pre-set to its own weight) to all cells downstream of it
+    inside the grid, in topological order (Kahn). `queue` is scratch of fdir.size.
+    """
+    rows, cols = fdir.shape
+    d_flat = fdir.reshape(-1)
+    a_flat = acc.reshape(-1)
+    inflow = np.zeros(rows * cols, dtype=np.uint8)
+    for i in range(rows * cols):
+        k = d_flat[i] & 15
+        if k < 8:
+            r = i // cols
+            nr = r + D8_ROW[k]
+            nc = i - r * cols + D8_COL[k]
+            if 0 <= nr < rows and 0 <= nc < cols:
+                inflow[nr * cols + nc] += 1
+    tail = 0
+    for i in range(rows * cols):
+        if inflow[i] == 0:
+            queue[tail] = i
+            tail += 1
+    head = 0
+    while head < tail:
+        cur = queue[head]
+        head += 1
+        k = d_flat[cur] & 15
+        if k >= 8:
+            continue
+        r = cur // cols
+        nr = r + D8_ROW[k]
+        nc = cur - r * cols + D8_COL[k]
+        if nr < 0 or nr >= rows or nc < 0 or nc >= cols:
+            continue
+        n = nr * cols + nc
+        a_flat[n] += a_flat[cur]
+        inflow[n] -= 1
+        if inflow[n] == 0:
+            queue[tail] = n
+            tail += 1
+
+@njit(nogil=True, cache=True)
+def trace(drainage, row, col, max_steps):
+    """
+    Flat indices of the D8 path from (row, col) downstream, at most max_steps cells.
+    """
+    rows, cols = drainage.shape
+    path = np.empty(max_steps, dtype=np.int64)
+    n = 0
+    while n < max_steps:
+        path[n] = row * cols + col
+        n += 1
+        k = drainage[row, col] & 15
+        if k >= 8:
+            break
+        row += D8_ROW[k]
+        col += D8_COL[k]
+        if row < 0 or row >= rows or col < 0 or col >= cols:
+            break
+    return path[:n]
+
+@njit(nogil=True, cache=True)
+def _tile_exits(fdir, exit_of):
+    """
+    For every cell of a tile, the flat index of the cell where its flow leaves the
+    tile into the rest of the DEM (-1 if it ends at an outlet first). `exit_of` is
+    pre-set to -2; cells whose direction points across the tile border exit at themselves.
+    """
+    rows, cols = fdir.shape
+    d_flat = fdir.reshape(-1)
+    stack = np.empty(rows * cols, dtype=np.int64)
+    for start in range(rows * cols):
+        if exit_of[start] != -2:
+            continue
+        top = 0
+        cur = start
+        target = -1
+        while True:
+            if exit_of[cur] != -2:
+                target = exit_of[cur]
+                break
+            stack[top] = cur
+            top += 1
+            k = d_flat[cur] & 15
+            if k >= 8:
+                break
+            r = cur // cols
+            nr = r + D8_ROW[k]
+            nc = cur - r * cols + D8_COL[k]
+            if nr < 0 or nr >= rows or nc < 0 or nc >= cols:
+                target = cur
+                break
+            cur = nr * cols + nc
+        for i in range(top):
+            exit_of[stack[i]] = target
+    return exit_of
+
+@njit(nogil=True, cache=True)
+def _spill_levels(offsets, neighbours, elevations, n_labels):
+    """
+    Lowest elevation at which each watershed label drains to OCEAN: a minimax shortest
+    path over the label graph (CSR adjacency, edge weight = where two watersheds touch).
+    """
+    spill = np.full(n_labels, np.inf)
+    spill[OCEAN] = -np.inf
+    keys = np.empty(1024, dtype=np.float64)
+    items = np.empty(1024, dtype=np.int64)
+    keys, items, size = _heap_push(keys, items, 0, -np.inf, OCEAN)
+    while size > 0:
+        key = keys[0]
+        label, size = _heap_pop(keys, items, size)
+        if key > spill[label]:
+            continue
+        for j in range(offsets[label], offsets[label + 1]):
+            other = neighbours[j]
+            level = max(key, np.float64(elevations[j]))
+            if level < spill[other]:
+                spill[other] = level
+                keys, items, size = _heap_push(keys, items, size, level, other)
+    return spill
+
+@njit(nogil=True, cache=True)
+def _propagate(downstream, inflow):
+    """
+    Flow entering each tile-border cell from other tiles: `inflow` (what reaches it
+    directly from neighbouring tiles' local accumulation) plus everything that entered
+    the border cells upstream of it, in place. `downstream[i]` is the border cell the
+    flow through cell i enters next (-1 when it ends in its tile), a forest.
+    """
+    n = downstream.shape[0]
+    indegree = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        if downstream[i] >= 0:
+            indegree[downstream[i]] += 1
+    queue = np.empty(n, dtype=np.int64)
+    tail = 0
+    for i in range(n):
+        if indegree[i] == 0:
+            queue[tail] = i
+            tail += 1
+    head = 0
+    while head < tail:
+        cur = queue[head]
+        head += 1
+        nxt = downstream[cur]
+        if nxt < 0:
+            continue
+        inflow[nxt] += inflow[cur]
+        indegree[nxt] -= 1
+        if indegree[nxt] == 0:
+            queue[tail] = nxt
+            tail += 1
+    return inflow
+
+# --- In memory --------------------------------------------------------------------------
+
+def priority_flood(dem: np.ndarray) -> np.ndarray:
+    """
+    Fill the depressions of a float32 DEM in place (NaN = nodata) and return its D8
+    directions (index into D8_ROW/D8_COL, NO_OUTFLOW at outlets and nodata), with
+    flats drained along their distance to the nearest lower cell, as condition_tiled.
+    """
+    if dem.dtype != np.float32 or not dem.flags.c_contiguous:
+        raise ValueError("priority_flood works in place on a C-contiguous float32 array")
+    fdir = np.full(dem.shape, UNSET, dtype=np.uint8)
+    _flood(dem, fdir, np.zeros((0, 0), dtype=np.int64))
+    fdir.fill(UNSET)
+    _drain_flats(dem, fdir, np.empty(dem.shape, dtype=np.int32))
+    return fdir
+
+def flow_accumulation(fdir: np.ndarray) -> np.ndarray:
+    """
+    Number of cells (itself included) draining through each cell.
+    """
+    acc = np.ones(fdir.shape, dtype=np.uint32)
+    _accumulate(fdir, acc, np.empty(fdir.size, dtype=np.int32 if fdir.size < 2**31 else np.int64))
+    return acc
+
+def read_dem(src, window: Optional[Window] = None) -> np.ndarray:
+    """
+    Band 1 of an open DEM (or a window of it) as float32 with NaN for nodata.
+    """
+    dem = src.read(1, window=window, out_dtype=np.float32)
+    if src.nodata is not None and not np.isnan(src.nodata):
+        dem[dem == np.float32(src.nodata)] = np.nan
+    return dem
+
+def _write_drainage(dst, fdir: np.ndarray, acc: np.ndarray, channel_cells: float, window: Optional[Window] = None):
+    drainage = fdir
+    drainage[acc >= channel_cells] |= CHANNEL_BIT
+    dst.write(drainage, 1, window=window)
+
+def condition(dem_path: str, output_path: str, channel_cells: float, profile: dict) -> str:
+    """
+    Write the drainage raster of a DEM: D8 index in bits 0-3 (NO_OUTFLOW at outlets),
+    CHANNEL_BIT where at least `channel_cells` cells drain through. `profile` is the
+    output raster profile. Large DEMs are conditioned tile by tile.
+    """
+    with raster_io.open_shared(dem_path) as src:
+        pixels = src.width * src.height
+    if pixels > settings.HYDROLOGY_IN_MEMORY_MAX_PIXELS:
+        return condition_tiled(dem_path, output_path, channel_cells, profile)
+    with raster_io.open_shared(dem_path) as src:
+        dem = read_dem(src)
+
+    with metrics.stage("hydrology_flood", pixels=pixels):
+        fdir = priority_flood(dem)
+        del dem
+    with metrics.stage("hydrology_accumulation", pixels=pixels):
+        acc = flow_accumulation(fdir)
+    profile = dict(profile, dtype=rasterio.uint8, count=1, nodata=None)
+    with rasterio.open(output_path, "w", **profile) as dst:
+        _write_drainage(dst, fdir, acc, channel_cells)
+    return output_path
+
+# --- Tiled ------------------------------------------------------------------------------
+
+def _ring(array: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    (top, bottom, left, right) border cells of a tile, copied.
+    """
+    return array[0].copy(), array[-1].copy(), array[:, 0].copy(), array[:, -1].copy()
+
+def _ring_cells(height: int, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (rows, cols) of a tile's border cells, each once, in row-major order.
+    """
+    mask = np.zeros((height, width), dtype=bool)
+    mask[0] = mask[-1] = True
+    mask[:, 0] = mask[:, -1] = True
+    return np.nonzero(mask)
+
+def _touching_pairs(n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Index pairs (i, j) of 8-connected cells between two facing tile edges of n cells.
+    """
+    i = np.arange(n)
+    first = np.concatenate([i, i[1:], i[:-1]])
+    second = np.concatenate([i, i[:-1], i[1:]])
+    return first, second
+
+class _Tiles:
+    def __init__(self, height: int, width: int, tile_size: int):
+        self.height, self.width, self.size = height, width, tile_size
+        self.n_rows = -(-height // tile_size)
+        self.n_cols = -(-width // tile_size)
+
+    def __iter__(self):
+        for ti in range(self.n_rows):
+            for tj in range(self.n_cols):
+                yield ti, tj
+
+    def window(self, ti: int, tj: int) -> Window:
+        row0, col0 = ti * self.size, tj * self.size
+        return Window(col0, row0, min(self.size, self.width - col0), min(self.size, self.height - row0))
+
+    def neighbours(self, ti: int, tj: int):
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                if (di or dj) and 0 <= ti + di < self.n_rows and 0 <= tj + dj < self.n_cols:
+                    yield ti + di, tj + dj
+
+def _spill_graph(tiles: _Tiles, rings: Dict, labels: Dict, pairs: list, elevations: list, n_labels: int) -> np.ndarray:
+    """
+    Add the watershed contacts across tile borders to the in-tile ones and solve the
+    spill level of every label (-inf for watersheds that never reach OCEAN).
+    """
+    for ti, tj in tiles:
+        top, bottom, left, right = rings[ti, tj]
+        l_top, l_bottom, l_left, l_right = labels[ti, tj]
+        facing = []
+        if (ti + 1, tj) in rings:
+            facing.append((bottom, l_bottom, rings[ti + 1, tj][0], labels[ti + 1, tj][0]))
+        if (ti, tj + 1) in rings:
+            facing.append((right, l_right, rings[ti, tj + 1][2], labels[ti, tj + 1][2]))
+        for z_a, l_a, z_b, l_b in facing:
+            i, j = _touching_pairs(len(z_a))
+            pairs.append(np.stack([l_a[i], l_b[j]], axis=1))
+            elevations.append(np.maximum(z_a[i], z_b[j]))
+        # Diagonal contacts between tile corners
+        if (ti + 1, tj + 1) in rings:
+            pairs.append(np.array([[l_bottom[-1], labels[ti + 1, tj + 1][0][0]]]))
+            elevations.append(np.array([max(bottom[-1], rings[ti + 1, tj + 1][0][0])], dtype=np.float32))
+        if (ti + 1, tj - 1) in rings:
+            pairs.append(np.array([[l_bottom[0], labels[ti + 1, tj - 1][0][-1]]]))
+            elevations.append(np.array([max(bottom[0], rings[ti + 1, tj - 1][0][-1])], dtype=np.float32))
+
+    pairs = np.concatenate(pairs).astype(np.int64)
+    elevations = np.concatenate(elevations).astype(np.float32)
+    valid = (pairs[:, 0] > 0) & (pairs[:, 1] > 0) & (pairs[:, 0] != pairs[:, 1]) & ~np.isnan(elevations)
+    pairs, elevations = pairs[valid], elevations[valid]
+    source = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    target = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    weight = np.concatenate([elevations, elevations])
+    order = np.argsort(source, kind="stable")
+    offsets = np.zeros(n_labels + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=n_labels), out=offsets[1:])
+    spill = _spill_levels(offsets, target[order], weight[order], n_labels)
+    spill[np.isposinf(spill)] = -np.inf
+    return spill
+
+def _pad(tiles: _Tiles, rings: Dict, ti: int, tj: int, array: np.ndarray, fill) -> Tuple[np.ndarray, int, int]:
+    """
+    A tile padded with one cell of its neighbours' border values from `rings`, and
+    the (top, left) padding.
+    """
+    height, width = array.shape
+    top, left = int(ti > 0), int(tj > 0)
+    bottom, right = int(ti < tiles.n_rows - 1), int(tj < tiles.n_cols - 1)
+    padded = np.full((height + top + bottom, width + left + right), fill, dtype=array.dtype)
+    padded[top:top + height, left:left + width] = array
+    if top:
+        padded[0, left:left + width] = rings[ti - 1, tj][1]
+    if bottom:
+        padded[-1, left:left + width] = rings[ti + 1, tj][0]
+    if left:
+        padded[top:top + height, 0] = rings[ti, tj - 1][3]
+    if right:
+        padded[top:top + height, -1] = rings[ti, tj + 1][2]
+    if top and left:
+        padded[0, 0] = rings[ti - 1, tj - 1][1][-1]
+    if top and right:
+        padded[0, -1] = rings[ti - 1, tj + 1][1][0]
+    if bottom and left:
+        padded[-1, 0] = rings[ti + 1, tj - 1][0][-1]
+    if bottom and right:
+        padded[-1, -1] = rings[ti + 1, tj + 1][0][0]
+    return padded, top, left
+
+def _halo_state(shape: Tuple[int, int], top: int, left: int, height: int, width: int, padded: np.ndarray) -> np.ndarray:
+    """
+    fdir pre-set for a padded tile: its own cells UNSET, halo cells SEED (nodata halo stays UNSET).
+    """
+    fdir = np.full(shape, UNSET, dtype=np.uint8)
+    halo = np.ones(shape, dtype=bool)
+    halo[top:top + height, left:left + width] = False
+    fdir[halo & ~np.isnan(padded)] = SEED
+    return fdir
+
+def condition_tiled(dem_path: str, output_path: str, channel_cells: float, profile: dict,
+                    tile_size: Optional[int] = None, work_dir: Optional[str] = None) -> str:
+    """
+    condition() for DEMs that do not fit in memory: one padded tile is held at a time,
+    the filled tiles and directions are kept in `work_dir` (five bytes per cell).
+    Tiles are filled exactly to the same levels as the in-memory flood and flats drain
+    the same way, along their distance to the nearest lower cell, which is settled
+    across tile borders (tiles are redone while their neighbours' change).
+    """
+    tile_size = tile_size or settings.HYDROLOGY_TILE_SIZE
+    work_dir = tempfile.mkdtemp(prefix="hydrology-", dir=work_dir or os.path.dirname(os.path.abspath(output_path)))
+    no_labels = np.zeros((0, 0), dtype=np.int64)
+    try:
+        with raster_io.open_shared(dem_path) as src:
+            tiles = _Tiles(src.height, src.width, tile_size)
+            cols = src.width
+            n_tiles = tiles.n_rows * tiles.n_cols
+
+            # 1. Flood each tile from its border, one watershed label per border cell
+            with metrics.stage("hydrology_tile_labels", tiles=n_tiles):
+                rings, labels, pairs, elevations = {}, {}, [], []
+                base = 2
+                for ti, tj in tiles:
+                    dem = read_dem(src, tiles.window(ti, tj))
+                    tile_labels = np.zeros(dem.shape, dtype=np.int64)
+                    # Tile edges on the DEM edge drain off it
+                    if ti == 0:
+                        tile_labels[0] = OCEAN
+                    if ti == tiles.n_rows - 1:
+                        tile_labels[-1] = OCEAN
+                    if tj == 0:
+                        tile_labels[:, 0] = OCEAN
+                    if tj == tiles.n_cols - 1:
+                        tile_labels[:, -1] = OCEAN
+                    rings[ti, tj] = _ring(dem) # border cells are outlets, never raised
+                    tile_pairs, tile_elevations = _flood(dem, np.full(dem.shape, UNSET, dtype=np.uint8), tile_labels)
+                    tile_labels[tile_labels >= 2] += base - 2
+                    pairs.append(np.where(tile_pairs >= 2, tile_pairs + base - 2, tile_pairs))
+                    elevations.append(tile_elevations)
+                    base = max(base, int(tile_labels.max(initial=0)) + 1)
+                    labels[ti, tj] = _ring(tile_labels)
+                    del dem, tile_labels
+
+            # 2. Spill level of every border watershed = filled elevation of the tile borders
+            with metrics.stage("hydrology_spill_graph"):
+                spill = _spill_graph(tiles, rings, labels, pairs, elevations, base)
+                for key in rings:
+                    rings[key] = tuple(
+                        np.where(l > 0, np.maximum(z, spill[l]), z).astype(np.float32)
+                        for z, l in zip(rings[key], labels[key])
+                    )
+                del labels, pairs, elevations
+
+            # 3. Fill each tile exactly, flooding it from its neighbours' filled borders
+            with metrics.stage("hydrology_tile_fill", tiles=n_tiles):
+                for ti, tj in tiles:
+                    window = tiles.window(ti, tj)
+                    padded, top, left = _pad(tiles, rings, ti, tj, read_dem(src, window), np.nan)
+                    _flood(padded, _halo_state(padded.shape, top, left, window.height, window.width, padded),
+                           no_labels)
+                    np.save(os.path.join(work_dir, f"filled_{ti}_{tj}.npy"),
+                            padded[top:top + window.height, left:left + window.width])
+
+        # 4. Directions; a tile whose flat distances on its border change re-queues its
+        # neighbours. Distances start unknown (FLAT_UNKNOWN) and only decrease.
+        with metrics.stage("hydrology_tile_directions", tiles=n_tiles):
+            distances = {}
+            for ti, tj in tiles:
+                window = tiles.window(ti, tj)
+                distances[ti, tj] = tuple(np.full(n, FLAT_UNKNOWN, dtype=np.int32) for n in
+                                          (window.width, window.width, window.height, window.height))
+            queue = deque(tiles)
+            queued = set(queue)
+            runs = 0
+            while queue:
+                ti, tj = queue.popleft()
+                queued.discard((ti, tj))
+                window = tiles.window(ti, tj)
+                filled, top, left = _pad(tiles, rings, ti, tj,
+                                         np.load(os.path.join(work_dir, f"filled_{ti}_{tj}.npy")), np.nan)
+                distance, _, _ = _pad(tiles, distances, ti, tj,
+                                      np.full((window.height, window.width), FLAT_UNKNOWN, dtype=np.int32), FLAT_UNKNOWN)
+                fdir = _halo_state(filled.shape, top, left, window.height, window.width, filled)
+                _drain_flats(filled, fdir, distance)
+                runs += 1
+                inner = (slice(top, top + window.height), slice(left, left + window.width))
+                np.save(os.path.join(work_dir, f"fdir_{ti}_{tj}.npy"), fdir[inner])
+                ring = _ring(distance[inner])
+                if any(not np.array_equal(new, old) for new, old in zip(ring, distances[ti, tj])):
+                    distances[ti, tj] = ring
+                    for neighbour in tiles.neighbours(ti, tj):
+                        if neighbour not in queued:
+                            queued.add(neighbour)
+                            queue.append(neighbour)
+            metrics.log_event("hydrology_tiled", dem=dem_path, tiles=n_tiles, direction_runs=runs)
+
+        # 5. Accumulation: local per tile, then what crosses tile borders, then local again
+        with metrics.stage("hydrology_accumulation", tiles=n_tiles):
+            border, downstream, exits, exit_flow = [], [], [], []
+            for ti, tj in tiles:
+                window = tiles.window(ti, tj)
+                fdir = np.load(os.path.join(work_dir, f"fdir_{ti}_{tj}.npy"))
+                acc = np.ones(fdir.shape, dtype=np.float64)
+                _accumulate(fdir, acc, np.empty(fdir.size, dtype=np.int64))
+                exit_of = _tile_exits(fdir, np.full(fdir.size, -2, dtype=np.int64))
+                rows, columns = _ring_cells(window.height, window.width)
+                ring = rows * window.width + columns
+                border.append((rows + window.row_off) * cols + columns + window.col_off)
+
+                # The cell of the next tile that the flow through each border cell enters
+                ring_exit = exit_of[ring]
+                leaving = ring_exit >= 0
+                e_rows, e_cols = np.divmod(ring_exit[leaving], window.width)
+                k = fdir.ravel()[ring_exit[leaving]] & 15
+                target = np.full(len(ring), -1, dtype=np.int64)
+                target[leaving] = (e_rows + D8_ROW[k] + window.row_off) * cols + e_cols + D8_COL[k] + window.col_off
+                downstream.append(target)
+                own = ring_exit == ring # border cells that leave the tile themselves
+                exits.append(target[own])
+                exit_flow.append(acc.ravel()[ring[own]])
+
+            border = np.concatenate(border)
+            order = np.argsort(border)
+            border = border[order]
+            downstream = np.concatenate(downstream)[order]
+            downstream = np.where(downstream >= 0, np.searchsorted(border, downstream), -1)
+            inflow = np.zeros(len(border), dtype=np.float64)
+            np.add.at(inflow, np.searchsorted(border, np.concatenate(exits)), np.concatenate(exit_flow))
+            inflow = _propagate(downstream, inflow)
+
+            profile = dict(profile, dtype=rasterio.uint8, count=1, nodata=None)
+            with rasterio.open(output_path, "w", **profile) as dst:
+                for ti, tj in tiles:
+                    window = tiles.window(ti, tj)
+                    fdir = np.load(os.path.join(work_dir, f"fdir_{ti}_{tj}.npy"))
+                    rows, columns = _ring_cells(window.height, window.width)
+                    acc = np.ones(fdir.shape, dtype=np.float64)
+                    ring = (rows + window.row_off) * cols + columns + window.col_off
+                    acc[rows, columns] += inflow[np.searchsorted(border, ring)]
+                    _accumulate(fdir, acc, np.empty(fdir.size, dtype=np.int64))
+                    _write_drainage(dst, fdir, acc, channel_cells, window=window)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return output_path
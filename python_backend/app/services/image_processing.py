@@ -1,8 +1,14 @@
+import logging
 import rasterio
 import numpy as np
 import os
 import shutil
+from typing import Optional
 from rasterio.enums import Resampling
+from rasterio.windows import Window
+from app.services import artifact_store, raster_stats, sparse_mask, spectral_indices
+
+logger = logging.getLogger(__name__)
 
 def super_resolution(input_path: str, output_path: str, scale_factor: int = 2):
     """
@@ -38,76 +44,100 @@ def super_resolution(input_path: str, output_path: str, scale_factor: int = 2):
             with rasterio.open(output_path, 'w', **profile) as dst:
                 dst.write(data)
     except Exception as e:
-        print(f"SR Error (using fallback copy): {e}")
+        logger.warning("SR Error (using fallback copy): %s", e)
         shutil.copy(input_path, output_path)
 
-def calculate_ndwi(input_path: str, output_path: str, green_band_idx: int = 2, nir_band_idx: int = 4):
+def ndwi_array(green: np.ndarray, nir: np.ndarray) -> np.ndarray:
+    """
+    NDWI = (Green - NIR) / (Green + NIR) on in-memory band arrays (float32).
+    """
+    green = green.astype(np.float32)
+    nir = nir.astype(np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (green - nir) / (green + nir)
+
+def expansion_mask(ndwi1: np.ndarray, ndwi2: np.ndarray, threshold: float = 0.2,
+                   threshold_2: Optional[float] = None) -> np.ndarray:
+    """
+    Pixels that are water (NDWI > threshold) in the second epoch but not in the first.
+    `threshold_2` is the second epoch's threshold when the scenes have their own (default: threshold).
+    """
+    threshold_2 = threshold if threshold_2 is None else threshold_2
+    return ((ndwi2 > threshold_2) & (ndwi1 <= threshold)).astype(np.uint8)
+
+def calculate_ndwi(input_path: str, output_path: str, green_band_idx: int = 2, nir_band_idx: int = 4,
+                   statistics: bool = True):
     """
     Calculate NDWI = (Green - NIR) / (Green + NIR)
     Assumes bands are 1-indexed. Default indices are for Sentinel-2 (Green=3, NIR=8) but typical multispectral might vary.
-    Adjust indices as needed.
+    Adjust indices as needed. Other indices in the same pass: spectral_indices.compute_indices.
+    The NDWI histogram is stored alongside (raster_stats) for automatic water thresholds.
+    Errors propagate and leave no output: the NDWI is a cached artifact, so a stand-in
+    file would be reused as the scene's NDWI by every later analysis.
     """
     try:
-        with rasterio.open(input_path) as src:
-            if src.count < max(green_band_idx, nir_band_idx):
-                 raise ValueError("Not enough bands")
-                 
-            green = src.read(green_band_idx).astype(float)
-            nir = src.read(nir_band_idx).astype(float)
-            
-            # Allow division by zero
-            np.seterr(divide='ignore', invalid='ignore')
-            
-            ndwi = (green - nir) / (green + nir)
-            
-            # Write NDWI to file
-            profile = src.profile
-            profile.update(
-                dtype=rasterio.float32,
-                count=1,
-                compress='lzw'
-            )
-            
-            with rasterio.open(output_path, 'w', **profile) as dst:
-                dst.write(ndwi.astype(rasterio.float32), 1)
-                
+        spectral_indices.compute_indices(
+            input_path, output_path, ["ndwi"], band_map={"green": green_band_idx, "nir": nir_band_idx},
+            statistics=statistics
+        )
     except Exception as e:
-        print(f"NDWI Error (using fallback copy): {e}")
-        shutil.copy(input_path, output_path)
-            
+        logger.exception("NDWI Error: %s", e)
+        raise
     return output_path
 
-def detect_change(ndwi_path_1: str, ndwi_path_2: str, output_path: str, threshold: float = 0.2):
+def detect_change_sparse(ndwi_path_1: str, ndwi_path_2: str, output_path: str, threshold: float = 0.2,
+                         threshold_2: Optional[float] = None):
     """
-    Compare two NDWI images to find expansion.
+    detect_change into a block-sparse mask (.npz), reading the NDWI rasters one
+    block row at a time. Only blocks containing expansion are stored.
     """
+    with rasterio.open(ndwi_path_1) as src1, rasterio.open(ndwi_path_2) as src2:
+        mask = sparse_mask.SparseMask(src1.width, src1.height, src1.transform, src1.crs)
+        for row_off in range(0, src1.height, mask.block_size):
+            window = Window(0, row_off, src1.width, min(mask.block_size, src1.height - row_off))
+            mask.add(row_off, 0, expansion_mask(src1.read(1, window=window), src2.read(1, window=window), threshold, threshold_2))
+    mask.save(output_path)
+    return output_path
+
+def detect_change(ndwi_path_1: str, ndwi_path_2: str, output_path: str, threshold: float = 0.2,
+                  threshold_2: Optional[float] = None):
+    """
+    Compare two NDWI images to find expansion (see expansion_mask for the thresholds).
+    An output path ending in .npz gets a block-sparse mask (see detect_change_sparse).
+    """
+    if sparse_mask.is_sparse(output_path):
+        return detect_change_sparse(ndwi_path_1, ndwi_path_2, output_path, threshold, threshold_2)
     try:
         with rasterio.open(ndwi_path_1) as src1, rasterio.open(ndwi_path_2) as src2:
             ndwi1 = src1.read(1)
             ndwi2 = src2.read(1)
             
-            # Simple difference
-            diff = ndwi2 - ndwi1
-            
             # Mask where change is significant
             # If ndwi2 > threshold (water) and ndwi1 < threshold (not water) -> expansion
-            expansion = np.where((ndwi2 > threshold) & (ndwi1 <= threshold), 1, 0)
+            expansion = expansion_mask(ndwi1, ndwi2, threshold, threshold_2)
             
-            profile = src1.profile
-            profile.update(dtype=rasterio.uint8, count=1)
+            profile = artifact_store.raster_profile("change_export", src1.profile)
+            profile.update(dtype=rasterio.uint8, count=1, nodata=None)
             
             with rasterio.open(output_path, 'w', **profile) as dst:
                 dst.write(expansion.astype(rasterio.uint8), 1)
     except Exception as e:
-        print(f"Change Detection Error (using fallback copy): {e}")
+        logger.exception("Change Detection Error (using fallback copy): %s", e)
         shutil.copy(ndwi_path_1, output_path)
             
     return output_path
 
-def calculate_lake_area(ndwi_path: str, threshold: float = 0.2):
+def calculate_lake_area(ndwi_path: str, threshold: Optional[float] = None):
     """
-    Calculate lake area in square meters.
+    Calculate lake area in square meters. Without a threshold the scene's own is used
+    (raster_stats.water_threshold). When the NDWI has stored statistics the area comes
+    from its histogram, without reading the raster (within one 0.001-wide bin).
     """
+    stats = raster_stats.load(ndwi_path)
+    if threshold is None:
+        threshold = raster_stats.water_threshold(stats)
+    if stats is not None:
+        return raster_stats.water_area(stats, threshold)
     with rasterio.open(ndwi_path) as src:
         ndwi = src.read(1)
         # Pixel size
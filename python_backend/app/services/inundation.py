@@ -0,0 +1,238 @@
+import json
+import logging
+import math
+from typing import Optional, Tuple
+import numpy as np
+import rasterio
+import shapely
+import shapely.geometry
+from numba import njit
+from rasterio import features
+from rasterio.warp import transform_geom
+from app.core import metrics
+from app.core.config import settings
+from app.services import artifact_store, hydrology, raster_io
+from app.services.hydrology import CHANNEL_BIT, D8_COL, D8_ROW
+from app.services.terrain import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON
+
+logger = logging.getLogger(__name__)
+
+# GLOF inundation from Height Above Nearest Drainage (HAND). The DEM is conditioned
+# once (hydrology.condition: depressions filled, D8 directions, accumulation) and
+# stored per DEM as a "drainage" byte raster: bits 0-3 hold the D8 direction index
+# (8 = no outflow) and bit 4 marks channel cells (accumulation >= INUNDATION_CHANNEL_AREA_KM2).
+# Each analysis then only needs O(n) numba passes: nearest drainage + HAND, the D8
+# trace downstream of the lake, and a flood stage solved for the release volume over
+# the cells that drain to that trace.
+
+def lonlat_geometry(geometry, crs) -> dict:
+    """
+    GeoJSON mapping of a geometry in `crs` reprojected to lon/lat (EPSG:4326), the CRS
+    alerts and the geofence test user locations in. Rasters without a CRS are taken as lon/lat.
+    """
+    mapping = shapely.geometry.mapping(geometry)
+    if crs is None or crs == rasterio.crs.CRS.from_epsg(4326):
+        return mapping
+    return transform_geom(crs, "EPSG:4326", mapping)
+
+def lake_volume(area_m2: float) -> float:
+    """
+    Empirical glacial lake volume (m3) from its area (m2), Huggel et al. (2002): V = 0.104 A^1.42.
+    """
+    return 0.104 * area_m2 ** 1.42
+
+def release_volume(dem_path: str, lake_area: float, lake_y: float) -> float:
+    """
+    lake_volume of a lake whose area is in DEM CRS units (degrees squared for geographic
+    DEMs, converted at the lake's latitude).
+    """
+    with raster_io.open_shared(dem_path) as src:
+        geographic = src.crs is not None and src.crs.is_geographic
+    if geographic:
+        lake_area *= METERS_PER_DEGREE_LON * math.cos(math.radians(lake_y)) * METERS_PER_DEGREE_LAT
+    return lake_volume(lake_area)
+
+def cell_size_m(transform, crs, height: int) -> Tuple[float, float]:
+    """
+    Approximate (x, y) cell size in metres, at the raster's central latitude for geographic CRSs.
+    """
+    xres, yres = abs(transform.a), abs(transform.e)
+    if crs is not None and crs.is_geographic:
+        _, lat = transform * (0, height / 2)
+        return xres * METERS_PER_DEGREE_LON * math.cos(math.radians(lat)), yres * METERS_PER_DEGREE_LAT
+    return xres, yres
+
+def condition_dem(dem_path: str, output_path: str) -> str:
+    """
+    Write the drainage raster of a DEM (D8 index + channel bit) with hydrology.condition.
+    """
+    with raster_io.open_shared(dem_path) as src:
+        cell_x, cell_y = cell_size_m(src.transform, src.crs, src.height)
+        profile = artifact_store.raster_profile("drainage", src.profile)
+    channel_cells = settings.INUNDATION_CHANNEL_AREA_KM2 * 1e6 / (cell_x * cell_y)
+    return hydrology.condition(dem_path, output_path, channel_cells, profile)
+
+@njit(nogil=True, cache=True)
+def _hand_kernel(dem, drainage, drain, stack):
+    """
+    Fills `drain` (flat, pre-set to -2) with each cell's nearest downstream channel
+    cell (flat index, -1 if the flow leaves the grid or loops) and returns HAND, the
+    elevation above it. Each cell is walked once: a walk stops at the first cell that
+    is already resolved and the result is assigned to the whole walked path.
+    """
+    rows, cols = dem.shape
+    n = rows * cols
+    for start in range(n): # drain: -2 unresolved, -3 on the current walk
+        if drain[start] != -2:
+            continue
+        top = 0
+        cur = start
+        target = -1
+        while True:
+            state = drain[cur]
+            if state >= -1:
+                target = state
+                break
+            if state == -3:
+                break
+            r = cur // cols
+            c = cur - r * cols
+            code = drainage[r, c]
+            if code & CHANNEL_BIT:
+                drain[cur] = cur
+                target = cur
+                break
+            drain[cur] = -3
+            stack[top] = cur
+            top += 1
+            k = code & 15
+            if k >= 8:
+                break
+            nr = r + D8_ROW[k]
+            nc = c + D8_COL[k]
+            if nr < 0 or nr >= rows or nc < 0 or nc >= cols:
+                break
+            cur = nr * cols + nc
+        for i in range(top):
+            drain[stack[i]] = target
+
+    hand = np.full((rows, cols), np.nan, dtype=np.float32)
+    for i in range(n):
+        d = drain[i]
+        if d >= 0:
+            r = i // cols
+            hand[r, i - r * cols] = max(dem[r, i - r * cols] - dem[d // cols, d - (d // cols) * cols], 0.0)
+    return hand
+
+def flood_stage(hand: np.ndarray, cell_area: float, volume: float) -> float:
+    """
+    Water level above drainage (m) at which the cells in `hand` hold `volume` m3:
+    volume = cell_area * sum(max(stage - hand, 0)).
+    """
+    h = np.sort(hand.astype(np.float64))
+    if len(h) == 0 or volume <= 0:
+        return 0.0
+    cumulative = np.cumsum(h)
+    counts = np.arange(1, len(h) + 1)
+    capacity = cell_area * (counts * h - cumulative) # stored volume when the stage reaches h[j]
+    j = int(np.searchsorted(capacity, volume, side="right")) - 1
+    return float((volume / cell_area + cumulative[j]) / (j + 1))
+
+def drainage_path(dem_path: str) -> str:
+    """
+    Cached drainage raster of a DEM, conditioning it on first use.
+    """
+    path = artifact_store.scene_path(dem_path, "drainage")
+    fresh = artifact_store.is_fresh(path, dem_path)
+    metrics.record_cache("dem_drainage", fresh)
+    if not fresh:
+        with metrics.stage("dem_conditioning"):
+            condition_dem(dem_path, path)
+    return path
+
+def compute_hand(dem_path: str, output_path: Optional[str] = None):
+    """
+    (dem, drainage, nearest-drainage index, HAND) arrays for a DEM; writes HAND to
+    `output_path` when given and stale.
+    """
+    with raster_io.open_shared(dem_path) as src:
+        dem = src.read(1, masked=True).astype(np.float32).filled(np.nan)
+        profile = src.profile
+    drainage_raster = drainage_path(dem_path)
+    with rasterio.open(drainage_raster) as src:
+        drainage = src.read(1)
+    # int32 indices halve the kernel's memory below 2**31 cells
+    index_dtype = np.int32 if dem.size < 2**31 else np.int64
+    drain = np.full(dem.size, -2, dtype=index_dtype)
+    hand = _hand_kernel(dem, drainage, drain, np.empty(dem.size, dtype=index_dtype))
+    if output_path and not artifact_store.is_fresh(output_path, drainage_raster):
+        profile = artifact_store.raster_profile("hand", profile)
+        profile.update(dtype=rasterio.float32, count=1, nodata=np.nan)
+        with rasterio.open(output_path, "w", **profile) as dst:
+            dst.write(hand, 1)
+    return dem, drainage, drain, hand
+
+def inundation_extent(dem_path: str, x: float, y: float, volume: float,
+                      extent_path: str, flow_path: Optional[str] = None) -> dict:
+    """
+    Flood extent of a release of `volume` m3 from the lake at (x, y) (DEM CRS): the
+    cells draining to the D8 path downstream of the lake (up to INUNDATION_MAX_DISTANCE_KM)
+    whose HAND is below the stage that stores the volume. Writes the extent (a GeoJSON
+    Feature, usable as alert geometry) and, when given, the path as a flow-path Feature,
+    both in lon/lat.
+    """
+    with metrics.stage("inundation_hand"):
+        _, drainage, drain, hand = compute_hand(dem_path, artifact_store.scene_path(dem_path, "hand"))
+    with raster_io.open_shared(dem_path) as src:
+        transform, crs = src.transform, src.crs
+        row, col = src.index(x, y)
+    rows, cols = hand.shape
+    if not (0 <= row < rows and 0 <= col < cols):
+        raise ValueError(f"Lake at ({x}, {y}) is outside the DEM")
+
+    with metrics.stage("inundation_extent"):
+        cell_x, cell_y = cell_size_m(transform, crs, rows)
+        max_steps = max(1, int(settings.INUNDATION_MAX_DISTANCE_KM * 1000 / min(cell_x, cell_y)))
+        path = hydrology.trace(drainage, row, col, max_steps)
+
+        on_path = np.zeros(hand.size, dtype=bool)
+        on_path[path] = True
+        flat_hand = hand.ravel()
+        candidates = (drain >= 0) & np.isfinite(flat_hand)
+        candidates[candidates] = on_path[drain[candidates]]
+        stage = flood_stage(flat_hand[candidates], cell_x * cell_y, volume)
+        flooded = (candidates & (flat_hand <= stage)).reshape(hand.shape)
+        flooded.ravel()[path] = True
+
+        geoms = [shapely.geometry.shape(geom) for geom, _ in
+                 features.shapes(flooded.astype(np.uint8), mask=flooded, transform=transform)]
+        extent = shapely.union_all(geoms).simplify(min(abs(transform.a), abs(transform.e)) / 2, preserve_topology=True)
+        area = float(np.count_nonzero(flooded) * cell_x * cell_y)
+
+    feature = {
+        "type": "Feature",
+        "properties": {
+            "type": "inundation",
+            "release_volume_m3": float(volume),
+            "stage_m": stage,
+            "flooded_area_m2": area,
+            "path_length_km": round(len(path) * min(cell_x, cell_y) / 1000, 3),
+        },
+        "geometry": lonlat_geometry(extent, crs),
+    }
+    with open(extent_path, "w") as f:
+        json.dump(feature, f)
+
+    if flow_path:
+        path_rows, path_cols = np.divmod(path, cols)
+        xs, ys = rasterio.transform.xy(transform, path_rows, path_cols)
+        coords = list(zip(xs, ys)) if len(path) > 1 else [(xs[0], ys[0])] * 2
+        with open(flow_path, "w") as f:
+            json.dump({
+                "type": "Feature",
+                "properties": {"type": "flow_path"},
+                "geometry": lonlat_geometry(shapely.geometry.LineString(coords), crs),
+            }, f)
+    metrics.log_event("inundation", dem=dem_path, release_volume_m3=float(volume), stage_m=round(stage, 3),
+                      flooded_area_m2=round(area, 1), path_cells=len(path))
+    return feature
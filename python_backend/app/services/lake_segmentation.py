@@ -0,0 +1,224 @@
+import rasterio
+import numpy as np
+import shapely
+import shapely.geometry
+from rasterio import features
+from rasterio.windows import Window
+from scipy import ndimage
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.models.analysis import Lake
+from app.services import sparse_mask
+
+def _iter_tiles(width: int, height: int, tile_size: int):
+    """
+    Yield windows covering the raster in row-major order.
+    """
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            yield Window(
+                col_off, row_off,
+                min(tile_size, width - col_off),
+                min(tile_size, height - row_off)
+            )
+
+class _LabelForest:
+    """
+    Union-find over global lake labels, stored in a growable numpy array.
+    """
+    def __init__(self):
+        self.parent = np.zeros(0, dtype=np.int64)
+
+    def add(self, count: int) -> int:
+        offset = len(self.parent)
+        self.parent = np.concatenate([self.parent, np.arange(offset, offset + count, dtype=np.int64)])
+        return offset
+
+    def find(self, label: int) -> int:
+        root = label
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[label] != root:
+            self.parent[label], label = root, self.parent[label]
+        return root
+
+    def union_edges(self, a: np.ndarray, b: np.ndarray):
+        """
+        Merge labels that touch across a tile edge (both arrays hold global labels, -1 = dry).
+        """
+        touching = (a >= 0) & (b >= 0)
+        if not touching.any():
+            return
+        pairs = np.unique(np.stack([a[touching], b[touching]], axis=1), axis=0)
+        for left, right in pairs:
+            root_left, root_right = self.find(left), self.find(right)
+            if root_left != root_right:
+                self.parent[max(root_left, root_right)] = min(root_left, root_right)
+
+    def roots(self) -> np.ndarray:
+        parent = self.parent.copy()
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent = grandparent
+
+def segment_lakes(
+    ndwi_path: str,
+    threshold: float = 0.2,
+    tile_size: int = 1024,
+    min_pixels: int = 4,
+    change_mask_path: str = None,
+):
+    """
+    Label connected water bodies (NDWI > threshold) tile by tile and merge labels across tile edges.
+    Only one tile of the mask is held in memory at a time; per-lake statistics are accumulated
+    as the tiles stream past, so memory scales with the number of lakes rather than the scene.
+    Returns a list of per-lake dicts (area in sq meters, centroid, bounds and GeoJSON polygon),
+    ordered by decreasing area. When an aligned change mask is given, each lake also gets
+    `changed_area`, the area of expansion pixels inside it.
+    """
+    forest = _LabelForest()
+    counts, row_sums, col_sums, changed = [], [], [], []
+    min_rows, min_cols, max_rows, max_cols = [], [], [], []
+    pieces_label, pieces_geom = [], []
+
+    change_src = sparse_mask.open_mask(change_mask_path) if change_mask_path else None
+    with rasterio.open(ndwi_path) as src:
+        pixel_size_x, pixel_size_y = src.res
+        pixel_area = abs(pixel_size_x * pixel_size_y)
+        transform = src.transform
+
+        # Global labels along the bottom edge of the previous tile row, and along
+        # the right edge of the previous tile in the current row (-1 = dry)
+        bottom_prev = np.full(src.width, -1, dtype=np.int64)
+        bottom_next = np.full(src.width, -1, dtype=np.int64)
+        right_prev = None
+
+        for window in _iter_tiles(src.width, src.height, tile_size):
+            row_off, col_off = int(window.row_off), int(window.col_off)
+            width, height = int(window.width), int(window.height)
+            if col_off == 0:
+                bottom_prev, bottom_next = bottom_next, bottom_prev
+                bottom_next[:] = -1
+                right_prev = None
+
+            water = src.read(1, window=window) > threshold
+            local, n = ndimage.label(water)
+            if n == 0:
+                right_prev = np.full(height, -1, dtype=np.int64)
+                continue
+
+            offset = forest.add(n)
+            glob = np.where(local > 0, local.astype(np.int64) + offset - 1, -1)
+
+            if row_off > 0:
+                forest.union_edges(bottom_prev[col_off:col_off + width], glob[0])
+            if right_prev is not None:
+                forest.union_edges(right_prev, glob[:, 0])
+            bottom_next[col_off:col_off + width] = glob[-1]
+            right_prev = glob[:, -1]
+
+            rows, cols = np.nonzero(local)
+            lab = local[rows, cols]
+            counts.append(np.bincount(lab, minlength=n + 1)[1:])
+            row_sums.append(np.bincount(lab, weights=rows + row_off, minlength=n + 1)[1:])
+            col_sums.append(np.bincount(lab, weights=cols + col_off, minlength=n + 1)[1:])
+            if change_src is not None:
+                expanded = change_src.read(1, window=window)[rows, cols] > 0
+                changed.append(np.bincount(lab, weights=expanded, minlength=n + 1)[1:])
+            slices = ndimage.find_objects(local)
+            min_rows.append(np.array([s[0].start + row_off for s in slices]))
+            max_rows.append(np.array([s[0].stop + row_off for s in slices]))
+            min_cols.append(np.array([s[1].start + col_off for s in slices]))
+            max_cols.append(np.array([s[1].stop + col_off for s in slices]))
+
+            tile_transform = src.window_transform(window)
+            for geom, value in features.shapes(local.astype(np.int32), mask=water, transform=tile_transform):
+                pieces_label.append(int(value) + offset - 1)
+                pieces_geom.append(shapely.geometry.shape(geom))
+
+    if change_src is not None:
+        change_src.close()
+    if not counts:
+        return []
+
+    roots = forest.roots()
+    lake_ids, lake_of_label = np.unique(roots, return_inverse=True)
+    n_lakes = len(lake_ids)
+
+    pixel_count = np.bincount(lake_of_label, weights=np.concatenate(counts), minlength=n_lakes)
+    row_mean = np.bincount(lake_of_label, weights=np.concatenate(row_sums), minlength=n_lakes) / pixel_count
+    col_mean = np.bincount(lake_of_label, weights=np.concatenate(col_sums), minlength=n_lakes) / pixel_count
+    if changed:
+        changed_pixels = np.bincount(lake_of_label, weights=np.concatenate(changed), minlength=n_lakes)
+    bounds = np.empty((4, n_lakes))
+    bounds[0] = np.inf
+    bounds[1] = np.inf
+    bounds[2] = -np.inf
+    bounds[3] = -np.inf
+    np.minimum.at(bounds[0], lake_of_label, np.concatenate(min_rows))
+    np.minimum.at(bounds[1], lake_of_label, np.concatenate(min_cols))
+    np.maximum.at(bounds[2], lake_of_label, np.concatenate(max_rows))
+    np.maximum.at(bounds[3], lake_of_label, np.concatenate(max_cols))
+
+    # Dissolve the per-tile pieces of each lake into a single polygon
+    piece_lake = lake_of_label[np.asarray(pieces_label)]
+    order = np.argsort(piece_lake, kind="stable")
+    geoms = np.asarray(pieces_geom, dtype=object)[order]
+    splits = np.searchsorted(piece_lake[order], np.arange(1, n_lakes))
+    polygons = [
+        group[0] if len(group) == 1 else shapely.union_all(group)
+        for group in np.split(geoms, splits)
+    ]
+
+    centroid_x, centroid_y = transform * (col_mean + 0.5, row_mean + 0.5)
+    min_x, max_y = transform * (bounds[1], bounds[0])
+    max_x, min_y = transform * (bounds[3], bounds[2])
+
+    lakes = []
+    for i in np.argsort(-pixel_count, kind="stable"):
+        if pixel_count[i] < min_pixels:
+            continue
+        lake = {
+            "pixel_count": int(pixel_count[i]),
+            "area": float(pixel_count[i] * pixel_area),
+            "centroid_x": float(centroid_x[i]),
+            "centroid_y": float(centroid_y[i]),
+            "min_x": float(min(min_x[i], max_x[i])),
+            "min_y": float(min(min_y[i], max_y[i])),
+            "max_x": float(max(min_x[i], max_x[i])),
+            "max_y": float(max(min_y[i], max_y[i])),
+            "geometry": shapely.geometry.mapping(polygons[i]),
+        }
+        if changed:
+            lake["changed_area"] = float(changed_pixels[i] * pixel_area)
+        lakes.append(lake)
+    return lakes
+
+def save_lakes(db: Session, analysis_id: int, epoch: int, lakes: list):
+    """
+    Replace the per-lake table rows of one analysis epoch with a single bulk insert.
+    """
+    db.query(Lake).filter(Lake.analysis_id == analysis_id, Lake.epoch == epoch).delete()
+    if lakes:
+        db.execute(insert(Lake), [
+            {
+                "analysis_id": analysis_id,
+                "epoch": epoch,
+                "pixel_count": lake["pixel_count"],
+                "area": lake["area"],
+                "centroid_x": lake["centroid_x"],
+                "centroid_y": lake["centroid_y"],
+                "min_x": lake["min_x"],
+                "min_y": lake["min_y"],
+                "max_x": lake["max_x"],
+                "max_y": lake["max_y"],
+                "geometry_geojson": lake["geometry"],
+                "changed_area": lake.get("changed_area"),
+                "volume_change": lake.get("volume_change"),
+                "slope": lake.get("slope"),
+                "risk_level": lake.get("risk_level"),
+            }
+            for lake in lakes
+        ])
@@ -0,0 +1,113 @@
+import time
+from typing import Optional
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from app.core import metrics
+from app.core.config import settings
+from app.services import artifact_store, image_processing, raster_io, raster_stats
+from app.services.gis_analysis import ASSUMED_DEPTH_INCREASE
+from app.services.risk_assessment import assess_risk
+
+# External overviews (<scene>.ovr, picked up by GDAL when the scene is opened) built for
+# uploaded scenes (ingest_scene_task); a quick look at level L reads the 2**L overview
+# instead of decimating the full-resolution bands. The uploaded original is not modified.
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+
+def build_overviews(path: str, factors=OVERVIEW_FACTORS) -> bool:
+    """
+    Write averaged external overviews (<path>.ovr) for a scene unless it already has
+    some. Returns True when overviews were built.
+    """
+    raster_io.dataset_pool.invalidate(path)
+    with rasterio.open(path) as src:
+        if src.overviews(1):
+            return False
+        factors = [f for f in factors if min(src.width, src.height) // f >= 16]
+    if not factors:
+        return False
+    # The scene is opened for update only so GDAL builds overviews; with TIFF_USE_OVR
+    # they go to the .ovr file and the scene itself is left byte-for-byte unchanged
+    with rasterio.Env(TIFF_USE_OVR=True, COMPRESS_OVERVIEW="DEFLATE"):
+        with rasterio.open(path, "r+") as dst:
+            dst.build_overviews(factors, Resampling.average)
+    return True
+
+def _read_ndwi(path: str, factor: int, green_band_idx: int = 2, nir_band_idx: int = 4):
+    """
+    NDWI at 1/factor resolution (GDAL serves the read from a matching overview when
+    there is one). Returns the NDWI and the full-resolution pixel area / pixels per
+    estimate pixel.
+    """
+    with raster_io.open_shared(path) as src:
+        height, width = max(1, round(src.height / factor)), max(1, round(src.width / factor))
+        bands = src.read(
+            [green_band_idx, nir_band_idx], out_shape=(2, height, width), resampling=Resampling.average
+        )
+        pixel_area = abs(src.res[0] * src.res[1])
+        return image_processing.ndwi_array(bands[0], bands[1]), pixel_area, (src.width / width) * (src.height / height)
+
+def _boundary(mask: np.ndarray) -> np.ndarray:
+    """
+    Pixels with a 4-neighbour of the other class: at reduced resolution these may be
+    only partly expanded, so each can be wrong by up to one (coarse) pixel.
+    """
+    edge = np.zeros_like(mask)
+    rows = mask[1:, :] != mask[:-1, :]
+    edge[1:, :] |= rows
+    edge[:-1, :] |= rows
+    cols = mask[:, 1:] != mask[:, :-1]
+    edge[:, 1:] |= cols
+    edge[:, :-1] |= cols
+    return edge
+
+def scene_water_threshold(img_path: str) -> float:
+    """
+    Water threshold of a scene from the statistics of its stored NDWI (written at ingest).
+    """
+    return raster_stats.water_threshold(raster_stats.load(artifact_store.scene_path(img_path, "ndwi")))
+
+def estimate(img1_path: str, img2_path: str, dem_path: str, level: Optional[int] = None,
+             threshold: Optional[float] = None) -> dict:
+    """
+    Approximate lake areas, expansion area and volume change from overview level `level`
+    (decimation 2**level; default QUICK_LOOK_OVERVIEW_LEVEL). Errors are bounds for
+    mixed pixels along the expansion boundary; lakes smaller than one coarse pixel can
+    still be missed. Without a threshold each scene uses its own (scene_water_threshold).
+    Keys match the AnalysisEstimate columns.
+    """
+    start = time.perf_counter()
+    level = settings.QUICK_LOOK_OVERVIEW_LEVEL if level is None else level
+    factor = 2 ** max(level, 0)
+    if threshold is None:
+        threshold, threshold_2 = scene_water_threshold(img1_path), scene_water_threshold(img2_path)
+    else:
+        threshold_2 = threshold
+    with metrics.stage("quick_look", level=level):
+        ndwi1, pixel_area, pixels_per_cell = _read_ndwi(img1_path, factor)
+        ndwi2, _, _ = _read_ndwi(img2_path, factor)
+        if ndwi1.shape != ndwi2.shape:
+            raise ValueError("Scenes are not on the same grid")
+        cell_area = pixel_area * pixels_per_cell
+        expansion = image_processing.expansion_mask(ndwi1, ndwi2, threshold, threshold_2).astype(bool)
+        expansion_cells = int(np.count_nonzero(expansion))
+        error_cells = int(np.count_nonzero(_boundary(expansion))) if factor > 1 else 0
+
+        # Same volume proxy as calculate_volume_change: expanded source pixels x DEM pixel area x depth
+        with raster_io.open_shared(dem_path) as dem_src:
+            dem_pixel_area = abs(dem_src.res[0] * dem_src.res[1])
+        volume = expansion_cells * pixels_per_cell * dem_pixel_area * ASSUMED_DEPTH_INCREASE
+        volume_error = error_cells * pixels_per_cell * dem_pixel_area * ASSUMED_DEPTH_INCREASE
+
+    return {
+        "overview_factor": float(np.sqrt(pixels_per_cell)),
+        "lake_area_1": float(np.count_nonzero(ndwi1 > threshold) * cell_area),
+        "lake_area_2": float(np.count_nonzero(ndwi2 > threshold_2) * cell_area),
+        "expansion_area": float(expansion_cells * cell_area),
+        "expansion_area_error": float(error_cells * cell_area),
+        "volume_change": float(volume),
+        "volume_change_error": float(volume_error),
+        # Slope is not known yet, so this can reach High but not Critical
+        "risk_level": assess_risk(volume + volume_error, 0.0),
+        "seconds": time.perf_counter() - start,
+    }
@@ -0,0 +1,162 @@
+import importlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import rasterio
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Libraries a worker would otherwise import (and load JIT-compiled kernels from, for flow routing) on its first task
+PREWARM_MODULES = [
+    "numpy", "scipy.ndimage", "shapely", "rasterio.features", "rasterio.warp", "app.services.hydrology", "geopy.distance",
+]
+
+_env = None
+
+def gdal_options() -> dict:
+    """
+    GDAL configuration for worker processes: a larger block cache, multi-threaded
+    decompression and COG-friendly remote reads (no directory listing, merged ranges).
+    """
+    return {
+        "GDAL_CACHEMAX": settings.GDAL_CACHEMAX_MB,
+        "GDAL_NUM_THREADS": settings.GDAL_NUM_THREADS,
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff,.vrt",
+        "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+        "GDAL_HTTP_MULTIPLEX": "YES",
+        "VSI_CACHE": "TRUE",
+    }
+
+def configure_process():
+    """
+    Enter one process-wide rasterio.Env with gdal_options(). Idempotent; later
+    rasterio.open calls in this process (including nested Envs) inherit the options.
+    """
+    global _env
+    if _env is not None:
+        return
+    _env = rasterio.Env(**gdal_options())
+    _env.__enter__()
+    logger.info("GDAL environment configured: %s", gdal_options())
+
+def prewarm():
+    """
+    Import the heavy libraries up front so the first task does not pay for them.
+    """
+    for name in PREWARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not pre-import %s: %s", name, e)
+
+class _Handle:
+    __slots__ = ("dataset", "users", "stale")
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.users = 0 # open_shared blocks currently using the dataset
+        self.stale = False # invalidated while in use: closed by the last user
+
+class DatasetPool:
+    """
+    Bounded LRU of open read-only datasets, keyed by thread, path and mtime: a GDAL
+    dataset must not be read from two threads at once (eager tasks run in the API's
+    background threads), and a rewritten file gets a fresh handle. Handles are
+    reference counted; eviction and invalidate close a handle only once no block
+    holds it. Keeping a handle open also keeps its GDAL block cache warm across tasks.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._handles: "OrderedDict[tuple, _Handle]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, path: str) -> tuple:
+        return (threading.get_ident(), os.path.abspath(path), os.path.getmtime(path))
+
+    def acquire(self, path: str) -> tuple:
+        """
+        (key, dataset) for this thread; hand the key back to release() when done.
+        """
+        key = self._key(path)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None and not handle.dataset.closed:
+                self._handles.move_to_end(key)
+                handle.users += 1
+                metrics.record_cache("raster_handles", True)
+                return key, handle.dataset
+            metrics.record_cache("raster_handles", False)
+        dataset = rasterio.open(path)
+        with self._lock:
+            previous = self._handles.get(key)
+            if previous is not None and previous.users == 0:
+                previous.dataset.close()
+            handle = self._handles[key] = _Handle(dataset)
+            handle.users += 1
+            self._evict()
+        return key, dataset
+
+    def release(self, key: tuple, dataset):
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None or handle.dataset is not dataset:
+                # invalidated (or replaced) while in use: nobody else can reach it
+                dataset.close()
+                return
+            handle.users -= 1
+            self._evict()
+
+    def _evict(self):
+        # Least recently used handles that nobody holds go first; held ones stay until released
+        excess = len(self._handles) - self.max_size
+        for key in [k for k, h in self._handles.items() if h.users == 0][:max(excess, 0)]:
+            self._handles.pop(key).dataset.close()
+
+    def invalidate(self, path: str):
+        """
+        Drop every handle on `path`, in all threads (call before overwriting it; Windows
+        cannot replace open files). Handles still in use are closed by their last user.
+        """
+        abspath = os.path.abspath(path)
+        with self._lock:
+            for key in [k for k in self._handles if k[1] == abspath]:
+                handle = self._handles.pop(key)
+                if handle.users == 0:
+                    handle.dataset.close()
+
+    def clear(self):
+        with self._lock:
+            for key in [k for k, h in self._handles.items() if h.users == 0]:
+                self._handles.pop(key).dataset.close()
+
+    def reset_after_fork(self):
+        """
+        Drop (without closing) handles inherited from the parent process; GDAL file
+        handles must not be shared across fork.
+        """
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+dataset_pool = DatasetPool(settings.RASTER_POOL_SIZE)
+
+@contextmanager
+def open_shared(path: str):
+    """
+    `with open_shared(dem_path) as src:` reads through the process pool when enabled.
+    Unlike rasterio.open, leaving the block does not close the dataset; do not pass
+    `src` to another thread.
+    """
+    if settings.RASTER_POOL_SIZE > 0:
+        key, dataset = dataset_pool.acquire(path)
+        try:
+            yield dataset
+        finally:
+            dataset_pool.release(key, dataset)
+    else:
+        with rasterio.open(path) as src:
+            yield src
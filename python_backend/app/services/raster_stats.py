@@ -0,0 +1,309 @@
+import json
+import math
+import os
+from typing import List, Optional, Sequence
+import numpy as np
+import rasterio
+from numba import njit
+from rasterio.windows import Window
+from app.core.config import settings
+from app.services import artifact_store
+
+# Per-raster statistics, stored as a small JSON in the artifact store ("stats" product,
+# keyed by the path of the raster they describe): per band the pixel count, nodata
+# fraction, min, max, mean, std and a histogram. NDWI statistics are accumulated while
+# the NDWI is written (spectral_indices.compute_indices), scene band statistics at
+# ingest. Water thresholds (Otsu on the NDWI histogram) and what-if water areas are
+# then answered from the JSON alone, without reading the raster again.
+
+# Normalised-difference indices lie in [-1, 1]; their histograms use fixed bins over it
+INDEX_RANGE = (-1.0, 1.0)
+
+# A threshold needs two modes: a valley in the histogram (smoothed over VALLEY_SMOOTHING)
+# falling at least MIN_VALLEY_DEPTH below the lower of the peaks on either side, by more
+# than VALLEY_SIGNIFICANCE Poisson sigmas of that peak's count. Splits of a single mode
+# (snow only, water only) have no valley; a lake of a few thousandths of the scene has
+# one nearly 1 deep, and snow with a turbid lake 3.4 sigma apart one ~0.3 deep.
+VALLEY_SMOOTHING = 0.02
+MIN_VALLEY_DEPTH = 0.25
+VALLEY_SIGNIFICANCE = 3.0
+
+# Pixels per read window when statistics are computed from an existing raster
+WINDOW_PIXELS = 1 << 22
+
+@njit(nogil=True, cache=True)
+def _accumulate(values, nodata, has_nodata, lo, scale, counts):
+    """
+    One pass over a block: histogram counts (in place) and the valid count, sum, sum
+    of squares, min and max of the values that are finite and not nodata.
+    """
+    n_bins = counts.shape[0]
+    valid = 0
+    total = 0.0
+    total_sq = 0.0
+    vmin = np.inf
+    vmax = -np.inf
+    for i in range(values.shape[0]):
+        v = np.float64(values[i])
+        if not np.isfinite(v) or (has_nodata and v == nodata):
+            continue
+        valid += 1
+        total += v
+        total_sq += v * v
+        vmin = min(vmin, v)
+        vmax = max(vmax, v)
+        k = int(np.floor((v - lo) * scale))
+        counts[min(max(k, 0), n_bins - 1)] += 1
+    return valid, total, total_sq, vmin, vmax
+
+def _one_bin_per_value(dtype) -> bool:
+    dtype = np.dtype(dtype)
+    return dtype.kind in "ui" and dtype.itemsize <= 2
+
+class BandStats:
+    """
+    Statistics of one band accumulated block by block over fixed histogram bins
+    [lo, hi). Values outside the range are counted in the end bins; min, max and
+    mean stay exact. Integer bands get one bin per value (trimmed and merged down
+    to at most `max_bins` when exported).
+    """
+    def __init__(self, lo: float, hi: float, bins: int, integer: bool = False, nodata: Optional[float] = None):
+        self.lo, self.hi, self.bins = float(lo), float(hi), int(bins)
+        self.integer = integer
+        self.nodata = None if nodata is None or math.isnan(nodata) else nodata
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.total = self.valid = 0
+        self.sum = self.sum_sq = 0.0
+        self.min, self.max = math.inf, -math.inf
+
+    @classmethod
+    def for_dtype(cls, dtype, nodata: Optional[float] = None, value_range: Optional[Sequence[float]] = None) -> "BandStats":
+        """
+        One bin per value for 8/16-bit integer bands, STATS_HISTOGRAM_BINS over
+        `value_range` otherwise.
+        """
+        if _one_bin_per_value(dtype):
+            info = np.iinfo(dtype)
+            return cls(info.min, info.max + 1, info.max - info.min + 1, integer=True, nodata=nodata)
+        if value_range is None:
+            raise ValueError(f"A value range is needed for {dtype} histograms")
+        return cls(value_range[0], value_range[1], settings.STATS_HISTOGRAM_BINS, nodata=nodata)
+
+    def add(self, values: np.ndarray):
+        values = values.ravel()
+        self.total += values.size
+        nodata = 0.0 if self.nodata is None else float(self.nodata)
+        valid, total, total_sq, vmin, vmax = _accumulate(
+            values, nodata, self.nodata is not None, self.lo, self.bins / (self.hi - self.lo), self.counts
+        )
+        if valid:
+            self.valid += valid
+            self.sum += total
+            self.sum_sq += total_sq
+            self.min, self.max = min(self.min, vmin), max(self.max, vmax)
+
+    def to_dict(self, name: Optional[str] = None, max_bins: Optional[int] = None) -> dict:
+        lo, hi, counts = self.lo, self.hi, self.counts
+        if self.integer and not self.valid:
+            counts = counts[:0]
+        elif self.integer:
+            max_bins = max_bins or settings.STATS_HISTOGRAM_BINS
+            first, last = int(self.min - self.lo), int(self.max - self.lo) + 1
+            width = -(-(last - first) // max_bins)
+            counts = np.add.reduceat(counts[first:last], np.arange(0, last - first, width))
+            lo, hi = self.lo + first, self.lo + first + width * len(counts)
+        mean = self.sum / self.valid if self.valid else None
+        return {
+            "name": name,
+            "count": self.total,
+            "valid": self.valid,
+            "nodata_fraction": 1 - self.valid / self.total if self.total else 1.0,
+            "min": self.min if self.valid else None,
+            "max": self.max if self.valid else None,
+            "mean": mean,
+            "std": math.sqrt(max(self.sum_sq / self.valid - mean * mean, 0.0)) if self.valid else None,
+            "histogram": {"range": [lo, hi], "counts": counts.tolist()},
+        }
+
+def summary(bands: List[BandStats], names: Sequence[Optional[str]], profile: dict) -> dict:
+    """
+    JSON-ready statistics of a raster: grid (for areas) and one entry per band.
+    """
+    transform = profile["transform"]
+    return {
+        "width": profile["width"],
+        "height": profile["height"],
+        "pixel_area": abs(transform.a * transform.e),
+        "crs": str(profile["crs"]) if profile.get("crs") else None,
+        "bands": [stats.to_dict(name) for stats, name in zip(bands, names)],
+    }
+
+def stats_path(path: str) -> str:
+    return artifact_store.scene_path(path, "stats")
+
+def save(path: str, stats: dict, source: Optional[str] = None) -> str:
+    """
+    Store the statistics of the raster at `path`. For a product derived from a scene
+    (an NDWI), `source` is that scene: the statistics then stay valid while they are
+    newer than the scene, even after the product itself is evicted or rebuilt.
+    """
+    if source is not None:
+        stats = dict(stats, source=os.path.abspath(source))
+    with open(stats_path(path), "w") as f:
+        json.dump(stats, f)
+    return stats_path(path)
+
+def load(path: str) -> Optional[dict]:
+    """
+    Stored statistics of the raster at `path`, or None when missing or older than it
+    (older than its source scene, for statistics saved with one).
+    """
+    target = stats_path(path)
+    if not os.path.exists(target):
+        return None
+    with open(target) as f:
+        stats = json.load(f)
+    return stats if artifact_store.is_fresh(target, stats.get("source") or path) else None
+
+def _windows(width: int, height: int):
+    rows = max(1, WINDOW_PIXELS // max(width, 1))
+    for row_off in range(0, height, rows):
+        yield Window(0, row_off, width, min(rows, height - row_off))
+
+def compute(path: str) -> dict:
+    """
+    Statistics of every band of a raster, read window by window. Bands named after a
+    spectral index use INDEX_RANGE bins; other float bands take one extra pass for
+    their range.
+    """
+    from app.services.spectral_indices import INDICES
+
+    with rasterio.open(path) as src:
+        names = list(src.descriptions)
+        bands = []
+        for k, (dtype, nodata, name) in enumerate(zip(src.dtypes, src.nodatavals, names), start=1):
+            value_range = INDEX_RANGE if name in INDICES else None
+            if value_range is None and not _one_bin_per_value(dtype):
+                lo, hi = math.inf, -math.inf
+                for window in _windows(src.width, src.height):
+                    values = src.read(k, window=window)
+                    valid = np.isfinite(values)
+                    if nodata is not None:
+                        valid &= values != nodata
+                    if valid.any():
+                        lo, hi = min(lo, float(values[valid].min())), max(hi, float(values[valid].max()))
+                value_range = (lo, float(np.nextafter(hi, math.inf))) if lo <= hi else (0.0, 1.0)
+            bands.append(BandStats.for_dtype(dtype, nodata, value_range))
+        for window in _windows(src.width, src.height):
+            data = src.read(window=window)
+            for stats, values in zip(bands, data):
+                stats.add(values)
+        return summary(bands, names, src.profile)
+
+def ensure(path: str, source: Optional[str] = None) -> dict:
+    """
+    Stored statistics of a raster, computing them (one read) when missing or stale.
+    """
+    stats = load(path)
+    if stats is None:
+        stats = compute(path)
+        save(path, stats, source)
+    return stats
+
+def _histogram(band: dict):
+    counts = np.asarray(band["histogram"]["counts"], dtype=np.float64)
+    lo, hi = band["histogram"]["range"]
+    return counts, np.linspace(lo, hi, len(counts) + 1)
+
+def _valley_depth(counts: np.ndarray, edges: np.ndarray, cut: bool) -> np.ndarray:
+    """
+    Per bin, how far the smoothed histogram dips below the lower of the highest bins on
+    either side (0 = no valley, 1 = empty), where that dip is significant. With `cut`,
+    the tail of a mode falling away from the first kept bin (dry land cut off below the
+    bounds) does not count as a peak.
+    """
+    k = max(1, int(round(VALLEY_SMOOTHING / (edges[1] - edges[0])))) | 1
+    smooth = np.convolve(counts, np.ones(k) / k, mode="same")
+    if cut:
+        first = int(np.argmax(smooth > 0))
+        rising = np.nonzero(np.diff(smooth[first:]) >= 0)[0]
+        stop = first + (int(rising[0]) if len(rising) else len(smooth) - first)
+        if stop > first + k:
+            smooth[first:stop] = 0
+    left = np.maximum.accumulate(smooth)
+    right = np.maximum.accumulate(smooth[::-1])[::-1]
+    peak = np.minimum(left, right)
+    significant = (peak - smooth) * k > VALLEY_SIGNIFICANCE * np.sqrt(peak * k)
+    depth = np.zeros_like(smooth)
+    np.divide(peak - smooth, peak, out=depth, where=significant)
+    return depth
+
+def otsu_threshold(band: dict, bounds: Optional[Sequence[float]] = None) -> Optional[float]:
+    """
+    Otsu's threshold of a band histogram: the bin edge maximising the between-class
+    variance. With `bounds`, bins below bounds[0] are left out (for NDWI: land that is
+    clearly dry, which would otherwise be split from snow and water) and the threshold
+    is searched within them. None for an empty histogram, or when there are not two
+    classes (no valley MIN_VALLEY_DEPTH deep). When the Otsu split misses the valley
+    (it drifts into the larger class when water is a small fraction of the scene), the
+    bottom of the deepest valley is returned instead.
+    """
+    counts, edges = _histogram(band)
+    if bounds is not None:
+        counts[edges[1:] <= bounds[0]] = 0
+    total = counts.sum()
+    if total == 0:
+        return None
+    p = counts / total
+    centers = (edges[:-1] + edges[1:]) / 2
+    omega = np.cumsum(p)[:-1] # weight of the class below each inner edge
+    mu = np.cumsum(p * centers)[:-1]
+    mu_total = float(np.dot(p, centers))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu_total * omega - mu) ** 2 / (omega * (1 - omega))
+    between[~np.isfinite(between)] = -1.0
+    inner = edges[1:-1]
+    depth = _valley_depth(counts, edges, cut=bounds is not None)
+    if bounds is not None:
+        between[(inner < bounds[0]) | (inner > bounds[1])] = -1.0
+        depth[(centers < bounds[0]) | (centers > bounds[1])] = 0.0
+    deepest = int(np.argmax(depth))
+    if depth[deepest] < MIN_VALLEY_DEPTH:
+        return None
+    best = int(np.argmax(between))
+    if between[best] > 0 and max(depth[best], depth[best + 1]) >= MIN_VALLEY_DEPTH:
+        return float(inner[best])
+    # Middle of the run of bins as deep as the deepest one (a flat empty valley)
+    flat = depth >= depth[deepest] - 1e-9
+    end = deepest + (int(np.argmin(flat[deepest:])) if not flat[deepest:].all() else len(flat) - deepest)
+    return float(centers[(deepest + end - 1) // 2])
+
+def water_threshold(stats: Optional[dict], band: int = 0) -> float:
+    """
+    NDWI water threshold of a scene from its stored NDWI statistics (WATER_THRESHOLD_METHOD);
+    WATER_THRESHOLD_DEFAULT for the fixed method, or when there are no statistics or
+    the histogram has no split within WATER_THRESHOLD_BOUNDS.
+    """
+    method = settings.WATER_THRESHOLD_METHOD
+    if method not in ("otsu", "fixed"):
+        raise ValueError(f"Unknown water threshold method: {method}")
+    if method == "fixed" or stats is None:
+        return settings.WATER_THRESHOLD_DEFAULT
+    threshold = otsu_threshold(stats["bands"][band], settings.WATER_THRESHOLD_BOUNDS)
+    return settings.WATER_THRESHOLD_DEFAULT if threshold is None else threshold
+
+def water_area(stats: dict, threshold: float, band: int = 0) -> float:
+    """
+    Area (raster CRS units squared, as calculate_lake_area) of the pixels above
+    `threshold`, from the stored histogram; the bin containing the threshold is
+    split linearly, so the error is at most one bin's pixels.
+    """
+    counts, edges = _histogram(stats["bands"][band])
+    i = int(np.searchsorted(edges, threshold, side="right")) - 1
+    if i < 0:
+        above = counts.sum()
+    elif i >= len(counts):
+        above = 0.0
+    else:
+        above = counts[i + 1:].sum() + counts[i] * (edges[i + 1] - threshold) / (edges[i + 1] - edges[i])
+    return float(above * stats["pixel_area"])
@@ -1,7 +1,13 @@
-from typing import List, Tuple
+from typing import List, Optional
 from app.models.analysis import RiskZone
-from shapely.geometry import Polygon, mapping
-import json
+from app.services import sparse_mask, vector_tiles
+from rasterio import features
+from rasterio.windows import Window
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+import numpy as np
+import shapely
+import shapely.geometry
 
 def assess_risk(volume_change: float, slope: float) -> str:
     """
@@ -17,27 +23,169 @@ def assess_risk(volume_change: float, slope: float) -> str:
     else:
         return "Low"
 
-def generate_risk_map(risk_level: str, analysis_id: int) -> dict:
-    """
-    Generate a GeoJSON risk map.
-    """
-    # In a real app, this would generate polygons based on the affected area.
-    # Here we return a dummy GeoJSON polygon centered on the lake.
-    
-    # Placeholder polygon
-    polygon = Polygon([
-        (85.0, 28.0),
-        (85.1, 28.0),
-        (85.1, 28.1),
-        (85.0, 28.1),
-        (85.0, 28.0)
-    ])
-    
+RISK_LEVELS = ["Low", "Medium", "High", "Critical"]
+
+def assess_risk_array(volume_change: np.ndarray, slope: np.ndarray) -> np.ndarray:
+    """
+    Vectorised assess_risk: classify many lakes in one numpy pass.
+    Uses the same thresholds as assess_risk and returns an array of level names.
+    """
+    volume_change = np.asarray(volume_change, dtype=np.float64)
+    slope = np.asarray(slope, dtype=np.float64)
+    conditions = [
+        (volume_change > 1000000) & (slope > 30),
+        volume_change > 500000,
+        volume_change > 100000,
+    ]
+    return np.select(conditions, ["Critical", "High", "Medium"], default="Low")
+
+def most_severe(levels) -> str:
+    """
+    Highest risk level among `levels` ("Low" when empty).
+    """
+    ranks = [RISK_LEVELS.index(level) for level in levels]
+    return RISK_LEVELS[max(ranks, default=0)]
+
+def _mask_windows(src, tile_size: int):
+    """
+    (window, boolean mask) pairs covering the non-zero pixels of `src`: the stored
+    blocks of a sparse mask, or a tile_size grid over a dense raster.
+    """
+    if isinstance(src, sparse_mask.SparseMask):
+        yield from src.iter_blocks()
+        return
+    for row_off in range(0, src.height, tile_size):
+        for col_off in range(0, src.width, tile_size):
+            window = Window(
+                col_off, row_off,
+                min(tile_size, src.width - col_off),
+                min(tile_size, src.height - row_off)
+            )
+            yield window, src.read(1, window=window) > 0
+
+def polygonize_raster(raster_path: str, tile_size: int = 2048) -> np.ndarray:
+    """
+    Polygonise the non-zero pixels of a mask raster window by window.
+    Polygons cut by window seams are dissolved back together; the result is
+    an array of shapely polygons in the raster CRS. Sparse masks (.npz) only
+    visit their non-empty blocks.
+    """
+    interior, seam = [], []
+    with sparse_mask.open_mask(raster_path) as src:
+        for window, mask in _mask_windows(src, tile_size):
+            if not mask.any():
+                continue
+            transform = src.window_transform(window)
+            geoms = np.array([
+                shapely.geometry.shape(geom)
+                for geom, _ in features.shapes(mask.astype(np.uint8), mask=mask, transform=transform)
+            ], dtype=object)
+
+            # Only polygons touching the window border can continue in a neighbouring window
+            west, north = transform * (0, 0)
+            east, south = transform * (window.width, window.height)
+            tol = min(abs(src.res[0]), abs(src.res[1])) / 2.0
+            bounds = shapely.bounds(geoms)
+            on_seam = (
+                (bounds[:, 0] <= min(west, east) + tol) | (bounds[:, 2] >= max(west, east) - tol) |
+                (bounds[:, 1] <= min(north, south) + tol) | (bounds[:, 3] >= max(north, south) - tol)
+            )
+            interior.append(geoms[~on_seam])
+            seam.append(geoms[on_seam])
+
+    if not interior:
+        return np.empty(0, dtype=object)
+
+    seam_geoms = np.concatenate(seam)
+    if len(seam_geoms):
+        seam_geoms = shapely.get_parts(shapely.union_all(seam_geoms))
+    return np.concatenate(interior + [seam_geoms])
+
+def generate_risk_zones(
+    change_mask_path: str,
+    risk_level: str,
+    inundation_path: Optional[str] = None,
+    simplify_tolerance: Optional[float] = None,
+    min_area: float = 0.0,
+) -> List[dict]:
+    """
+    Build risk zone polygons from the change-detection mask and, when available,
+    the predicted inundation raster. Geometries are simplified in one vectorised
+    pass (default tolerance: half a pixel) and stay in the raster CRS (zone["crs"]).
+    """
+    zones = []
+    sources = [(change_mask_path, "Lake expansion")]
+    if inundation_path:
+        sources.append((inundation_path, "Predicted inundation extent"))
+
+    for path, description in sources:
+        geoms = polygonize_raster(path)
+        if len(geoms) == 0:
+            continue
+        with sparse_mask.open_mask(path) as src:
+            crs = src.crs.to_string() if src.crs else None
+            tolerance = min(abs(src.res[0]), abs(src.res[1])) / 2.0 if simplify_tolerance is None else simplify_tolerance
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+        geoms = geoms[~shapely.is_empty(geoms) & (shapely.area(geoms) > min_area)]
+        zones.extend(
+            {
+                "risk_level": risk_level,
+                "description": description,
+                "geometry": shapely.geometry.mapping(geom),
+                "crs": crs,
+            }
+            for geom in geoms
+        )
+    return zones
+
+def _with_crs(geometry: dict, crs: Optional[str]) -> dict:
+    if crs is None:
+        return geometry
+    return dict(geometry, crs={"type": "name", "properties": {"name": crs}})
+
+def save_risk_zones(db: Session, analysis_id: int, zones: List[dict]):
+    """
+    Replace the RiskZone rows of an analysis with a single bulk insert,
+    and precompute their vector-tile levels of detail. Geometries in a raster CRS
+    carry it as a named GeoJSON "crs" member.
+    """
+    db.query(RiskZone).filter(RiskZone.analysis_id == analysis_id).delete()
+    if zones:
+        db.execute(insert(RiskZone), [
+            {
+                "analysis_id": analysis_id,
+                "risk_level": zone["risk_level"],
+                "description": zone["description"],
+                "geometry_geojson": _with_crs(zone["geometry"], zone.get("crs")),
+            }
+            for zone in zones
+        ])
+    vector_tiles.index_features(
+        db, "risk_zones", analysis_id,
+        [shapely.geometry.shape(zone["geometry"]) for zone in zones],
+        [
+            {"analysis_id": analysis_id, "risk_level": zone["risk_level"], "description": zone["description"]}
+            for zone in zones
+        ],
+        crs=zones[0].get("crs") if zones else None,
+    )
+
+def generate_risk_map(zones: List[dict], analysis_id: int) -> dict:
+    """
+    Generate a GeoJSON risk map (FeatureCollection) from generated risk zones.
+    """
     return {
-        "type": "Feature",
-        "properties": {
-            "risk_level": risk_level,
-            "analysis_id": analysis_id
-        },
-        "geometry": mapping(polygon)
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {
+                    "risk_level": zone["risk_level"],
+                    "description": zone["description"],
+                    "analysis_id": analysis_id
+                },
+                "geometry": zone["geometry"]
+            }
+            for zone in zones
+        ]
     }
@@ -0,0 +1,331 @@
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+import numpy as np
+import shapely
+import shapely.geometry
+from rasterio.warp import transform_bounds
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core import metrics
+from app.core.config import settings
+from app.models.analysis import ImageMetadata, SceneFootprint
+from app.services import raster_io
+from app.services.terrain import METERS_PER_DEGREE_LON
+
+logger = logging.getLogger(__name__)
+
+# Imagery catalog. Every uploaded raster gets a SceneFootprint row (native and lon/lat
+# bounds, read once from its header) and queries run against a process-wide index of
+# them: the footprints sorted by capture date, with a shapely STRtree over their lon/lat
+# boxes. Because rows are in date order a date range is a slice of positions (two
+# binary searches); a query keeps the tree hits inside the slice, or tests the boxes of
+# the slice directly when it is narrow. Footprints are only ever added, so
+# max(SceneFootprint.id) tells any process that its index is stale, and the new rows
+# are loaded incrementally.
+
+# A date slice this much smaller than the whole catalog is scanned instead of querying the tree
+SCAN_FRACTION = 8
+
+def _footprint_row(image: ImageMetadata) -> dict:
+    with raster_io.open_shared(image.file_path) as src:
+        crs, bounds, res_x = src.crs, src.bounds, abs(src.transform.a)
+    geographic = crs is None or crs.is_geographic # rasters without a CRS are taken as lon/lat
+    west, south, east, north = bounds if crs is None else transform_bounds(crs, "EPSG:4326", *bounds, densify_pts=21)
+    lat = (south + north) / 2
+    return {
+        "image_id": image.id,
+        "image_type": image.image_type,
+        "capture_date": image.capture_date,
+        "crs": crs.to_string() if crs is not None else None,
+        "min_x": bounds.left, "min_y": bounds.bottom, "max_x": bounds.right, "max_y": bounds.top,
+        "west": west, "south": south, "east": east, "north": north,
+        "resolution_m": res_x * METERS_PER_DEGREE_LON * math.cos(math.radians(lat)) if geographic else res_x,
+    }
+
+def register(db: Session, image: ImageMetadata) -> Optional[SceneFootprint]:
+    """
+    Footprint of an uploaded raster, read from its header on first use; None when the
+    file cannot be read.
+    """
+    existing = db.query(SceneFootprint).filter(SceneFootprint.image_id == image.id).first()
+    if existing is not None:
+        return existing
+    try:
+        row = _footprint_row(image)
+    except Exception as e:
+        logger.warning("No footprint for image %s (%s): %s", image.id, image.file_path, e)
+        return None
+    footprint = SceneFootprint(**row)
+    try:
+        with db.begin_nested():
+            db.add(footprint)
+        db.commit()
+    except IntegrityError: # registered concurrently (image_id is unique)
+        db.rollback()
+        return db.query(SceneFootprint).filter(SceneFootprint.image_id == image.id).first()
+    return footprint
+
+def backfill(db: Session) -> int:
+    """
+    Register every image that has no footprint yet (uploads from before the catalog,
+    or whose registration failed). Returns the number of footprints added.
+    """
+    missing = (
+        db.query(ImageMetadata)
+        .outerjoin(SceneFootprint, SceneFootprint.image_id == ImageMetadata.id)
+        .filter(SceneFootprint.id.is_(None))
+        .all()
+    )
+    rows = []
+    for image in missing:
+        try:
+            rows.append(_footprint_row(image))
+        except Exception as e:
+            logger.warning("No footprint for image %s (%s): %s", image.id, image.file_path, e)
+    added = 0
+    for row in rows: # one savepoint each, so a footprint registered concurrently skips only itself
+        try:
+            with db.begin_nested():
+                db.execute(insert(SceneFootprint), [row])
+            added += 1
+        except IntegrityError:
+            pass
+    if rows:
+        db.commit()
+    return added
+
+# --- In-memory index ---------------------------------------------------------------
+
+_COLUMNS = ("id", "image_id", "image_type", "capture_date", "crs", "min_x", "min_y", "max_x", "max_y",
+            "west", "south", "east", "north", "resolution_m")
+
+def _load_columns(db: Session, after_id: int = 0) -> dict:
+    rows = db.execute(
+        select(*(getattr(SceneFootprint, name) for name in _COLUMNS), ImageMetadata.filename)
+        .join(ImageMetadata, ImageMetadata.id == SceneFootprint.image_id)
+        .where(SceneFootprint.id > after_id)
+    ).all()
+    values = list(zip(*rows)) if rows else [()] * (len(_COLUMNS) + 1)
+    columns = dict(zip(_COLUMNS + ("filename",), values))
+    return {
+        "id": np.array(columns["id"], dtype=np.int64),
+        "image_id": np.array(columns["image_id"], dtype=np.int64),
+        "image_type": np.array(columns["image_type"], dtype=object),
+        "filename": np.array(columns["filename"], dtype=object),
+        "crs": np.array(columns["crs"], dtype=object),
+        "capture_date": np.array(columns["capture_date"], dtype="datetime64[us]"),
+        "native": np.array([columns[k] for k in ("min_x", "min_y", "max_x", "max_y")], dtype=np.float64).T.reshape(-1, 4),
+        "bounds": np.array([columns[k] for k in ("west", "south", "east", "north")], dtype=np.float64).T.reshape(-1, 4),
+        "resolution_m": np.array([np.nan if r is None else r for r in columns["resolution_m"]], dtype=np.float64),
+    }
+
+class CatalogIndex:
+    """
+    Footprints in capture-date order (arrays in `columns`, one entry per position);
+    `query` returns the positions intersecting a lon/lat geometry within a date range.
+    """
+    def __init__(self, columns: dict, version: Optional[int]):
+        order = np.lexsort((columns["id"], columns["capture_date"]))
+        self.columns = {name: values[order] for name, values in columns.items()}
+        self.dates = self.columns["capture_date"]
+        self.boxes = shapely.box(*self.columns["bounds"].T)
+        self.tree = shapely.STRtree(self.boxes)
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def extend(self, columns: dict, version: Optional[int]) -> "CatalogIndex":
+        return CatalogIndex({name: np.concatenate([values, columns[name]]) for name, values in self.columns.items()}, version)
+
+    def query(self, geometry, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              before: Optional[datetime] = None, image_type: Optional[str] = None) -> np.ndarray:
+        """
+        Positions, oldest first, of the footprints intersecting `geometry` captured in
+        [start, end] (and strictly before `before`), optionally of one image type.
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(start, "us"), side="left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.dates, np.datetime64(end, "us"), side="right"))
+        if before is not None:
+            hi = min(hi, int(np.searchsorted(self.dates, np.datetime64(before, "us"), side="left")))
+        if hi <= lo:
+            return np.zeros(0, dtype=np.int64)
+        if (hi - lo) * SCAN_FRACTION < len(self):
+            west, south, east, north = geometry.bounds
+            b = self.columns["bounds"][lo:hi]
+            near = np.nonzero((b[:, 0] <= east) & (b[:, 2] >= west) & (b[:, 1] <= north) & (b[:, 3] >= south))[0] + lo
+            positions = near[shapely.intersects(self.boxes[near], geometry)]
+        else:
+            positions = np.sort(self.tree.query(geometry, predicate="intersects"))
+            positions = positions[(positions >= lo) & (positions < hi)]
+        if image_type is not None:
+            positions = positions[self.columns["image_type"][positions] == image_type]
+        return positions
+
+    def coverage(self, positions: np.ndarray, geometry) -> np.ndarray:
+        """
+        Fraction of `geometry` inside each footprint (1 for points and lines they intersect).
+        """
+        if geometry.area == 0:
+            return np.ones(len(positions))
+        return shapely.area(shapely.intersection(self.boxes[positions], geometry)) / geometry.area
+
+    def newest_per_tile(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Newest of `positions` in each CATALOG_TILE_DEGREES grid cell, by footprint centre.
+        """
+        b = self.columns["bounds"][positions[::-1]] # newest first
+        tile_x = np.floor((b[:, 0] + b[:, 2]) / 2 / settings.CATALOG_TILE_DEGREES).astype(np.int64)
+        tile_y = np.floor((b[:, 1] + b[:, 3]) / 2 / settings.CATALOG_TILE_DEGREES).astype(np.int64)
+        _, first = np.unique((tile_x << 32) + (tile_y & 0xFFFFFFFF), return_index=True)
+        return positions[::-1][np.sort(first)]
+
+    def describe(self, position: int, coverage: Optional[float] = None) -> dict:
+        c = self.columns
+        row = {
+            "image_id": int(c["image_id"][position]),
+            "filename": c["filename"][position],
+            "image_type": c["image_type"][position],
+            "capture_date": c["capture_date"][position].item().isoformat(),
+            "bounds": [float(v) for v in c["bounds"][position]],
+            "crs": c["crs"][position],
+            "resolution_m": None if np.isnan(c["resolution_m"][position]) else float(c["resolution_m"][position]),
+        }
+        if coverage is not None:
+            row["coverage"] = float(coverage)
+        return row
+
+def _data_version(db: Session) -> Optional[int]:
+    return db.execute(select(func.max(SceneFootprint.id))).scalar()
+
+_index: Optional[CatalogIndex] = None
+_index_lock = threading.Lock()
+
+def current_index(db: Session) -> CatalogIndex:
+    """
+    The process-wide index; footprints added since it was built are loaded on the next
+    query, and it is reloaded in full every CATALOG_REFRESH_SECONDS.
+    """
+    global _index
+    version = _data_version(db)
+    index = _index
+    if index is not None and index.version == version \
+            and time.monotonic() - index.built_at < settings.CATALOG_REFRESH_SECONDS:
+        return index
+    with _index_lock:
+        index = _index
+        expired = index is None or time.monotonic() - index.built_at >= settings.CATALOG_REFRESH_SECONDS
+        if expired or index.version != version:
+            start = time.perf_counter()
+            incremental = not expired and index.version is not None and version is not None and version > index.version
+            if incremental:
+                _index = index.extend(_load_columns(db, after_id=index.version), version)
+                _index.built_at = index.built_at # the periodic full reload stays on schedule
+            else:
+                _index = CatalogIndex(_load_columns(db), version)
+            metrics.log_event("catalog_index_rebuilt", footprints=len(_index), version=version,
+                              incremental=incremental, seconds=round(time.perf_counter() - start, 6))
+        return _index
+
+def invalidate():
+    global _index
+    with _index_lock:
+        _index = None
+
+# --- Queries ------------------------------------------------------------------------
+
+def search(db: Session, geometry, start: Optional[datetime] = None, end: Optional[datetime] = None,
+           image_type: Optional[str] = None, limit: int = 100) -> List[dict]:
+    """
+    Scenes whose footprint intersects `geometry` (lon/lat), captured in [start, end], newest first.
+    """
+    index = current_index(db)
+    started = time.perf_counter()
+    positions = index.query(geometry, start, end, image_type=image_type)[::-1][:limit]
+    metrics.catalog_query_seconds.observe(time.perf_counter() - started, kind="search")
+    return [index.describe(p) for p in positions]
+
+def _ranked(index: CatalogIndex, positions: np.ndarray, coverage: np.ndarray) -> np.ndarray:
+    """
+    Order of `positions`: highest coverage first, then the finest resolution, then the newest.
+    """
+    resolution = np.nan_to_num(index.columns["resolution_m"][positions], nan=np.inf)
+    return np.lexsort((-positions, resolution, -coverage))
+
+def best_dem(db: Session, geometry) -> Optional[dict]:
+    """
+    The DEM covering most of `geometry` (lon/lat), then the finest, then the newest.
+    """
+    index = current_index(db)
+    started = time.perf_counter()
+    positions = index.query(geometry, image_type="dem")
+    coverage = index.coverage(positions, geometry)
+    ranked = _ranked(index, positions, coverage)
+    metrics.catalog_query_seconds.observe(time.perf_counter() - started, kind="best_dem")
+    return index.describe(positions[ranked[0]], coverage[ranked[0]]) if len(ranked) else None
+
+def newest_per_tile(db: Session, geometry, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    image_type: Optional[str] = None) -> List[dict]:
+    """
+    Newest scene of each CATALOG_TILE_DEGREES grid cell among those intersecting `geometry`.
+    """
+    index = current_index(db)
+    started = time.perf_counter()
+    positions = index.newest_per_tile(index.query(geometry, start, end, image_type=image_type))
+    metrics.catalog_query_seconds.observe(time.perf_counter() - started, kind="newest_per_tile")
+    return [index.describe(p) for p in positions]
+
+def _covering(db: Session, image: ImageMetadata, image_type: str, before=None) -> Optional[ImageMetadata]:
+    """
+    Scenes of `image_type` (captured before `before`, when given) in the same CRS that
+    cover at least SCENE_MATCH_MIN_OVERLAP of `image`: the newest one with a
+    `before` date, otherwise the best (highest coverage, finest, newest).
+    """
+    own = register(db, image)
+    if own is None:
+        return None
+    index = current_index(db)
+    area = shapely.box(own.west, own.south, own.east, own.north)
+    positions = index.query(area, before=before, image_type=image_type)
+    positions = positions[(index.columns["image_id"][positions] != image.id) & (index.columns["crs"][positions] == own.crs)]
+
+    # Overlap in the native CRS, as a fraction of the image
+    native = index.columns["native"][positions]
+    width = np.clip(np.minimum(native[:, 2], own.max_x) - np.maximum(native[:, 0], own.min_x), 0, None)
+    height = np.clip(np.minimum(native[:, 3], own.max_y) - np.maximum(native[:, 1], own.min_y), 0, None)
+    own_area = (own.max_x - own.min_x) * (own.max_y - own.min_y)
+    coverage = width * height / own_area if own_area > 0 else np.zeros(len(positions))
+    keep = coverage >= settings.SCENE_MATCH_MIN_OVERLAP
+    positions, coverage = positions[keep], coverage[keep]
+
+    candidates = positions[::-1] if before is not None else positions[_ranked(index, positions, coverage)]
+    for position in candidates[:settings.SCENE_MATCH_MAX_CANDIDATES]:
+        candidate = db.get(ImageMetadata, int(index.columns["image_id"][position]))
+        if candidate is not None and os.path.exists(candidate.file_path):
+            return candidate
+    return None
+
+def previous_scene(db: Session, image: ImageMetadata) -> Optional[ImageMetadata]:
+    """
+    The previous epoch of `image`: the newest older scene of the same type and area.
+    """
+    return _covering(db, image, image.image_type, before=image.capture_date)
+
+def covering_dem(db: Session, image: ImageMetadata) -> Optional[ImageMetadata]:
+    return _covering(db, image, "dem")
+
+if __name__ == "__main__":
+    from app.db.session import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Registered {backfill(session)} footprints.")
+    finally:
+        session.close()
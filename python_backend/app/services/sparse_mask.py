@@ -0,0 +1,230 @@
+import os
+from typing import Iterator, Optional, Tuple
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from app.services import artifact_store
+
+# Change masks are mostly empty (expansion is usually well under 1% of a scene), so
+# they are stored block-sparse: the raster is cut into BLOCK_SIZE x BLOCK_SIZE blocks
+# and only blocks with at least one set pixel are kept, bit-packed, together with
+# their pixel count and bounding box.
+BLOCK_SIZE = 256
+
+class SparseMask:
+    """
+    Block-sparse 0/1 raster. Count, area, volume and bounds are sums / extrema over
+    the stored blocks, so they cost O(changed blocks) instead of a full-scene read.
+    Also supports the single-band subset of the rasterio dataset API used by the
+    pipeline (read(1, window=...), res, transform, window_transform, context manager).
+    """
+    def __init__(self, width: int, height: int, transform: Affine, crs: Optional[CRS] = None,
+                 block_size: int = BLOCK_SIZE):
+        self.width, self.height = int(width), int(height)
+        self.transform = transform
+        self.crs = crs
+        self.block_size = int(block_size)
+        self._blocks = {}  # (block_row, block_col) -> packed bits
+        self._counts = {}  # (block_row, block_col) -> set pixels
+        self._boxes = {}   # (block_row, block_col) -> (row_min, row_max, col_min, col_max), inclusive
+
+    @classmethod
+    def from_array(cls, mask: np.ndarray, transform: Affine, crs: Optional[CRS] = None,
+                   block_size: int = BLOCK_SIZE) -> "SparseMask":
+        sparse = cls(mask.shape[1], mask.shape[0], transform, crs, block_size)
+        sparse.add(0, 0, mask)
+        return sparse
+
+    # Building
+
+    def add(self, row_off: int, col_off: int, mask: np.ndarray):
+        """
+        OR a window of the mask (any non-zero value is set) into the sparse mask.
+        Windows need not be aligned to the block grid.
+        """
+        mask = np.asarray(mask) != 0
+        if not mask.any():
+            return
+        height, width = mask.shape
+        size = self.block_size
+        for block_row in range(row_off // size, (row_off + height - 1) // size + 1):
+            for block_col in range(col_off // size, (col_off + width - 1) // size + 1):
+                top, left = block_row * size, block_col * size
+                rows = slice(max(row_off, top), min(row_off + height, top + size))
+                cols = slice(max(col_off, left), min(col_off + width, left + size))
+                part = mask[rows.start - row_off:rows.stop - row_off, cols.start - col_off:cols.stop - col_off]
+                if not part.any():
+                    continue
+                key = (block_row, block_col)
+                block = self._block(key) if key in self._blocks else np.zeros((size, size), dtype=bool)
+                block[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left] |= part
+                self._store(key, block)
+
+    def _store(self, key: Tuple[int, int], block: np.ndarray):
+        top, left = key[0] * self.block_size, key[1] * self.block_size
+        rows = np.flatnonzero(block.any(axis=1))
+        cols = np.flatnonzero(block.any(axis=0))
+        self._blocks[key] = np.packbits(block.ravel())
+        self._counts[key] = int(np.count_nonzero(block))
+        self._boxes[key] = (top + rows[0], top + rows[-1], left + cols[0], left + cols[-1])
+
+    def _block(self, key: Tuple[int, int]) -> np.ndarray:
+        size = self.block_size
+        return np.unpackbits(self._blocks[key], count=size * size).astype(bool).reshape(size, size)
+
+    # Queries, O(changed blocks)
+
+    @property
+    def res(self) -> Tuple[float, float]:
+        return abs(self.transform.a), abs(self.transform.e)
+
+    @property
+    def block_count(self) -> int:
+        return len(self._blocks)
+
+    def count(self) -> int:
+        return sum(self._counts.values())
+
+    def area(self) -> float:
+        """
+        Area of the set pixels in CRS units squared.
+        """
+        res_x, res_y = self.res
+        return self.count() * res_x * res_y
+
+    def volume(self, depth: float, pixel_area: Optional[float] = None) -> float:
+        """
+        Volume proxy: set pixels x pixel area x assumed depth. `pixel_area` defaults to
+        the mask's own pixel size (pass the DEM's when it differs).
+        """
+        if pixel_area is None:
+            pixel_area = self.res[0] * self.res[1]
+        return self.count() * pixel_area * depth
+
+    def pixel_bounds(self) -> Optional[Tuple[int, int, int, int]]:
+        """
+        (row_min, row_max, col_min, col_max) of the set pixels, inclusive, or None when empty.
+        """
+        if not self._boxes:
+            return None
+        boxes = np.array(list(self._boxes.values()))
+        return int(boxes[:, 0].min()), int(boxes[:, 1].max()), int(boxes[:, 2].min()), int(boxes[:, 3].max())
+
+    def bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """
+        (left, bottom, right, top) of the set pixels in the mask CRS, or None when empty.
+        """
+        box = self.pixel_bounds()
+        if box is None:
+            return None
+        row_min, row_max, col_min, col_max = box
+        x0, y0 = self.transform * (col_min, row_min)
+        x1, y1 = self.transform * (col_max + 1, row_max + 1)
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+    # Dense access
+
+    def window_transform(self, window: Window) -> Affine:
+        return window_transform(window, self.transform)
+
+    def iter_blocks(self) -> Iterator[Tuple[Window, np.ndarray]]:
+        """
+        (window, boolean block) for every non-empty block, clipped to the raster edge.
+        """
+        size = self.block_size
+        for key in sorted(self._blocks):
+            top, left = key[0] * size, key[1] * size
+            height, width = min(size, self.height - top), min(size, self.width - left)
+            yield Window(left, top, width, height), self._block(key)[:height, :width]
+
+    def read(self, band: int = 1, window: Optional[Window] = None) -> np.ndarray:
+        """
+        Dense uint8 array of `window` (default: the whole raster), like DatasetReader.read.
+        """
+        if window is None:
+            window = Window(0, 0, self.width, self.height)
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        height, width = int(window.height), int(window.width)
+        out = np.zeros((height, width), dtype=np.uint8)
+        size = self.block_size
+        row_blocks = range(row_off // size, (row_off + height - 1) // size + 1)
+        col_blocks = range(col_off // size, (col_off + width - 1) // size + 1)
+        if len(row_blocks) * len(col_blocks) > len(self._blocks):
+            keys = [k for k in self._blocks if k[0] in row_blocks and k[1] in col_blocks]
+        else:
+            keys = [(r, c) for r in row_blocks for c in col_blocks if (r, c) in self._blocks]
+        for key in keys:
+            top, left = key[0] * size, key[1] * size
+            rows = slice(max(row_off, top), min(row_off + height, top + size))
+            cols = slice(max(col_off, left), min(col_off + width, left + size))
+            out[rows.start - row_off:rows.stop - row_off, cols.start - col_off:cols.stop - col_off] = \
+                self._block(key)[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]
+        return out
+
+    def to_geotiff(self, path: str) -> str:
+        """
+        Export as a dense 1-bit GeoTIFF. Only non-empty blocks are written (SPARSE_OK),
+        the rest of the file reads back as 0.
+        """
+        profile = artifact_store.raster_profile("change_export", {
+            "width": self.width, "height": self.height, "count": 1, "dtype": rasterio.uint8,
+            "crs": self.crs, "transform": self.transform, "nodata": None,
+        })
+        with rasterio.open(path, 'w', sparse_ok=True, **profile) as dst:
+            for window, block in self.iter_blocks():
+                dst.write(block.astype(np.uint8), 1, window=window)
+        return path
+
+    # Persistence
+
+    def save(self, path: str) -> str:
+        keys = sorted(self._blocks)
+        arrays = {
+            "shape": np.array([self.height, self.width, self.block_size], dtype=np.int64),
+            "transform": np.array(tuple(self.transform)[:6], dtype=np.float64),
+            "crs": np.array(self.crs.to_wkt() if self.crs else ""),
+            "keys": np.array(keys, dtype=np.int32).reshape(-1, 2),
+            "blocks": np.array([self._blocks[k] for k in keys], dtype=np.uint8).reshape(len(keys), -(-self.block_size ** 2 // 8)),
+            "counts": np.array([self._counts[k] for k in keys], dtype=np.int64),
+            "boxes": np.array([self._boxes[k] for k in keys], dtype=np.int64).reshape(-1, 4),
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "SparseMask":
+        with np.load(path) as data:
+            height, width, block_size = (int(v) for v in data["shape"])
+            wkt = str(data["crs"])
+            sparse = cls(width, height, Affine(*data["transform"]), CRS.from_wkt(wkt) if wkt else None, block_size)
+            for key, packed, count, box in zip(data["keys"], data["blocks"], data["counts"], data["boxes"]):
+                key = (int(key[0]), int(key[1]))
+                sparse._blocks[key] = packed
+                sparse._counts[key] = int(count)
+                sparse._boxes[key] = tuple(int(v) for v in box)
+        return sparse
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def is_sparse(path: str) -> bool:
+    return path.endswith(".npz")
+
+def open_mask(path: str):
+    """
+    Open a change mask for reading, sparse (.npz) or dense GeoTIFF.
+    Both support `with`, read(1, window=...), res and window_transform.
+    """
+    return SparseMask.load(path) if is_sparse(path) else rasterio.open(path)
@@ -0,0 +1,195 @@
+import ast
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Union
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from app.services import artifact_store, raster_stats
+
+logger = logging.getLogger(__name__)
+
+# Index expressions over band names. MNDWI and NDSI share a formula (Green vs SWIR1);
+# they differ in the threshold used downstream (open water vs snow/ice).
+INDICES = {
+    "ndwi": "(green - nir) / (green + nir)",
+    "mndwi": "(green - swir1) / (green + swir1)",
+    "ndsi": "(green - swir1) / (green + swir1)",
+    "ndvi": "(nir - red) / (nir + red)",
+}
+
+# Band name -> 1-based band index of the 4-band (B, G, R, NIR) scenes used by the pipeline.
+# Sentinel-2 L2A stacks would be e.g. {"blue": 2, "green": 3, "red": 4, "nir": 8, "swir1": 11}.
+DEFAULT_BANDS = {"blue": 1, "green": 2, "red": 3, "nir": 4}
+
+# Pixels per read window; windows are whole rows, rounded to 512-row output tiles
+WINDOW_PIXELS = 1 << 22
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+)
+
+class _Rewrite(ast.NodeTransformer):
+    """
+    Band names -> `_b_<name>` locals, numeric constants -> float32, so the evaluation
+    stays in float32 like the band arithmetic in image_processing.ndwi_array.
+    """
+    def visit_Name(self, node):
+        return ast.copy_location(ast.Name(id=f"_b_{node.id}", ctx=ast.Load()), node)
+
+    def visit_Constant(self, node):
+        call = ast.Call(
+            func=ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr="float32", ctx=ast.Load()),
+            args=[node], keywords=[]
+        )
+        return ast.copy_location(call, node)
+
+def parse_expression(expression: str) -> ast.Expression:
+    """
+    Parse an index expression; only + - * / **, numbers and band names are allowed.
+    """
+    tree = ast.parse(expression, mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax in index expression {expression!r}: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"Unsupported constant in index expression {expression!r}")
+    return tree
+
+def required_bands(expressions: Iterable[str]) -> List[str]:
+    """
+    Band names used by the expressions, in first-use order.
+    """
+    names = []
+    for expression in expressions:
+        for node in ast.walk(parse_expression(expression)):
+            if isinstance(node, ast.Name) and node.id not in names:
+                names.append(node.id)
+    return names
+
+def resolve(indices: Union[Iterable[str], Dict[str, str]]) -> Dict[str, str]:
+    """
+    {name: expression} from index names in INDICES, or a mapping of custom expressions.
+    """
+    if isinstance(indices, dict):
+        return dict(indices)
+    unknown = [name for name in indices if name not in INDICES]
+    if unknown:
+        raise ValueError(f"Unknown spectral indices: {', '.join(unknown)}")
+    return {name: INDICES[name] for name in indices}
+
+class IndexEvaluator:
+    """
+    Evaluates several index expressions in one pass over a (bands, rows, cols) block.
+    With numba the expressions are compiled into a single per-pixel loop, so there are
+    no full-size temporaries and each band value is loaded once for all indices;
+    without numba it falls back to numpy expressions.
+    """
+    def __init__(self, expressions: List[str], bands: List[str]):
+        self.expressions = list(expressions)
+        self.bands = list(bands)
+        rewritten = [ast.unparse(_Rewrite().visit(parse_expression(e))) for e in self.expressions]
+        self._numpy_code = [compile(source, "<index>", "eval") for source in rewritten]
+
+        lines = ["def kernel(bands, out):",
+                 "    for i in range(out.shape[1]):",
+                 "        for j in range(out.shape[2]):"]
+        lines += [f"            _b_{name} = np.float32(bands[{k}, i, j])" for k, name in enumerate(self.bands)]
+        lines += [f"            out[{k}, i, j] = {source}" for k, source in enumerate(rewritten)]
+        namespace = {"np": np}
+        exec("\n".join(lines), namespace)
+        try:
+            import numba
+            self._kernel = numba.njit(error_model="numpy", nogil=True)(namespace["kernel"])
+        except ImportError:
+            logger.warning("numba not available, evaluating spectral indices with numpy")
+            self._kernel = None
+
+    def __call__(self, bands: np.ndarray) -> np.ndarray:
+        """
+        `bands` is (len(self.bands), rows, cols) in self.bands order; returns float32
+        (len(self.expressions), rows, cols).
+        """
+        out = np.empty((len(self.expressions),) + bands.shape[1:], dtype=np.float32)
+        if self._kernel is not None:
+            self._kernel(bands, out)
+            return out
+        namespace = {"np": np}
+        namespace.update({f"_b_{name}": bands[k].astype(np.float32) for k, name in enumerate(self.bands)})
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for k, code in enumerate(self._numpy_code):
+                out[k] = eval(code, namespace)
+        return out
+
+_evaluators: Dict[tuple, IndexEvaluator] = {}
+_evaluators_lock = threading.Lock()
+
+def evaluator(expressions: Dict[str, str]) -> IndexEvaluator:
+    """
+    Compiled evaluator for these expressions, cached per process.
+    """
+    key = tuple(expressions.values())
+    with _evaluators_lock:
+        if key not in _evaluators:
+            _evaluators[key] = IndexEvaluator(list(key), required_bands(key))
+        return _evaluators[key]
+
+def _row_windows(width: int, height: int) -> Iterable[Window]:
+    rows = max(1, WINDOW_PIXELS // max(width, 1))
+    if rows >= 512:
+        rows -= rows % 512
+    for row_off in range(0, height, rows):
+        yield Window(0, row_off, width, min(rows, height - row_off))
+
+def compute_indices(
+    input_path: str,
+    output_path: str,
+    indices: Union[Iterable[str], Dict[str, str]] = ("ndwi",),
+    band_map: Optional[Dict[str, int]] = None,
+    statistics: bool = False,
+) -> str:
+    """
+    Write the requested indices as one float32 band each (band descriptions are the
+    index names) to `output_path`. Every band the indices need is read once per
+    window, whatever the number of indices, so extra indices cost almost no I/O.
+    With `statistics`, per-index statistics and histograms (over [-1, 1]) are
+    accumulated in the same pass and stored with raster_stats.save. The raster is
+    written to a temporary file and moved into place, so readers (and is_fresh) never
+    see a partial one.
+    """
+    expressions = resolve(indices)
+    band_map = band_map or DEFAULT_BANDS
+    evaluate = evaluator(expressions)
+    missing = [name for name in evaluate.bands if name not in band_map]
+    if missing:
+        raise ValueError(f"No band mapping for: {', '.join(missing)}")
+    band_indexes = [band_map[name] for name in evaluate.bands]
+
+    with rasterio.open(input_path) as src:
+        if src.count < max(band_indexes):
+            raise ValueError("Not enough bands")
+        profile = artifact_store.raster_profile("ndwi", src.profile)
+        profile.update(dtype=rasterio.float32, count=len(expressions))
+        stats = [raster_stats.BandStats.for_dtype(np.float32, value_range=raster_stats.INDEX_RANGE)
+                 for _ in expressions] if statistics else []
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix=".part")
+        os.close(fd)
+        try:
+            with rasterio.open(tmp_path, 'w', **profile) as dst:
+                for k, name in enumerate(expressions, start=1):
+                    dst.set_band_description(k, name)
+                for window in _row_windows(src.width, src.height):
+                    values = evaluate(src.read(band_indexes, window=window))
+                    dst.write(values, window=window)
+                    for band_stats, band in zip(stats, values):
+                        band_stats.add(band)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    if statistics:
+        raster_stats.save(output_path, raster_stats.summary(stats, list(expressions), profile), source=input_path)
+    return output_path
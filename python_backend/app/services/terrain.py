@@ -0,0 +1,180 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from app.core import metrics
+from app.services import artifact_store, raster_io
+
+# Approximate metres per degree, used when the DEM is in a geographic CRS
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0
+
+# Output paths of recent compute_terrain calls, keyed by (DEM, mtime, with_aspect)
+_CACHE_SIZE = 64
+_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _remember(key: tuple, outputs: dict):
+    with _cache_lock:
+        _cache[key] = outputs
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def output_paths(dem_path: str, with_aspect: bool = False) -> dict:
+    """
+    Artifact-store paths of the slope (and aspect) rasters of a DEM.
+    """
+    outputs = {"slope": artifact_store.scene_path(dem_path, "slope")}
+    if with_aspect:
+        outputs["aspect"] = artifact_store.scene_path(dem_path, "aspect")
+    return outputs
+
+def _horn_derivatives(block: np.ndarray, xres: np.ndarray, yres: float):
+    """
+    Horn (1981) 3x3 finite differences on a block that carries a 1-pixel halo.
+    Returns dz/dx (east) and dz/dy (south) for the block interior.
+    """
+    a, b, c = block[:-2, :-2], block[:-2, 1:-1], block[:-2, 2:]
+    d, f = block[1:-1, :-2], block[1:-1, 2:]
+    g, h, i = block[2:, :-2], block[2:, 1:-1], block[2:, 2:]
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xres)
+    dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * yres)
+    return dzdx, dzdy
+
+def _read_with_halo(src, window: Window, halo: int) -> np.ndarray:
+    """
+    Read a window grown by `halo` pixels; sides that fall off the raster are edge-padded.
+    """
+    row0 = max(int(window.row_off) - halo, 0)
+    col0 = max(int(window.col_off) - halo, 0)
+    row1 = min(int(window.row_off + window.height) + halo, src.height)
+    col1 = min(int(window.col_off + window.width) + halo, src.width)
+    data = src.read(1, window=Window(col0, row0, col1 - col0, row1 - row0), masked=True)
+    data = data.astype(np.float32).filled(np.nan)
+    pad = (
+        (halo - (int(window.row_off) - row0), halo - (row1 - int(window.row_off + window.height))),
+        (halo - (int(window.col_off) - col0), halo - (col1 - int(window.col_off + window.width))),
+    )
+    return np.pad(data, pad, mode="edge")
+
+def window_derivatives(src, window: Window):
+    """
+    Horn dz/dx, dz/dy (metres per metre) for one window of an open DEM, read with a 1-pixel halo.
+    """
+    xres, yres = abs(src.res[0]), abs(src.res[1])
+    block = _read_with_halo(src, window, 1)
+    if src.crs is not None and src.crs.is_geographic:
+        # Scale degrees to metres using the latitude of each row
+        rows = np.arange(int(window.height)) + int(window.row_off) + 0.5
+        _, lats = src.transform * (np.zeros_like(rows), rows)
+        x_m = xres * METERS_PER_DEGREE_LON * np.cos(np.radians(lats))[:, None]
+        y_m = yres * METERS_PER_DEGREE_LAT
+    else:
+        x_m, y_m = xres, yres
+    return _horn_derivatives(block, x_m, y_m)
+
+def slope_window(src, window: Window) -> np.ndarray:
+    """
+    Slope in degrees for one window of an open DEM.
+    """
+    dzdx, dzdy = window_derivatives(src, window)
+    return np.degrees(np.arctan(np.hypot(dzdx, dzdy))).astype(np.float32)
+
+def compute_terrain(dem_path: str, with_aspect: bool = False, tile_size: int = 1024) -> dict:
+    """
+    Compute slope (degrees) and optionally aspect (degrees clockwise from north) from a DEM.
+    The DEM is processed window by window with a 1-pixel overlap halo, so memory stays
+    bounded by the tile size. Results go to the artifact store (output_paths) and are
+    reused while they are newer than the DEM; each is written to a temporary file and
+    moved into place, so a failed run never leaves a partial raster that looks fresh.
+    Returns a dict with the output paths.
+    """
+    key = (os.path.abspath(dem_path), os.path.getmtime(dem_path), with_aspect)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and not all(os.path.exists(p) for p in cached.values()):
+        cached = None # evicted from the artifact store
+    metrics.record_cache("terrain", cached is not None)
+    if cached is not None:
+        return cached
+
+    outputs = output_paths(dem_path, with_aspect)
+    if all(artifact_store.is_fresh(p, dem_path) for p in outputs.values()):
+        _remember(key, outputs)
+        return outputs
+
+    with raster_io.open_shared(dem_path) as src:
+        profile = artifact_store.raster_profile("slope", src.profile)
+        profile.update(
+            dtype=rasterio.float32,
+            count=1,
+            nodata=np.nan
+        )
+
+        tmp_paths = {}
+        for name, path in outputs.items():
+            fd, tmp_paths[name] = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            os.close(fd)
+        try:
+            dsts = {}
+            try:
+                for name, tmp_path in tmp_paths.items():
+                    dsts[name] = rasterio.open(tmp_path, 'w', **profile)
+                for row_off in range(0, src.height, tile_size):
+                    for col_off in range(0, src.width, tile_size):
+                        window = Window(
+                            col_off, row_off,
+                            min(tile_size, src.width - col_off),
+                            min(tile_size, src.height - row_off)
+                        )
+                        dzdx, dzdy = window_derivatives(src, window)
+                        slope = np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+                        dsts["slope"].write(slope.astype(np.float32), 1, window=window)
+                        if with_aspect:
+                            aspect = np.degrees(np.arctan2(dzdy, -dzdx))
+                            aspect = np.where(aspect > 90.0, 450.0 - aspect, 90.0 - aspect)
+                            aspect[(dzdx == 0) & (dzdy == 0)] = np.nan # flat
+                            dsts["aspect"].write(aspect.astype(np.float32), 1, window=window)
+            finally:
+                for dst in dsts.values():
+                    dst.close()
+            for name, path in outputs.items():
+                raster_io.dataset_pool.invalidate(path)
+                os.replace(tmp_paths[name], path)
+        finally:
+            for tmp_path in tmp_paths.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    _remember(key, outputs)
+    return outputs
+
+def lake_slopes(slope_path: str, lakes: list, margin_px: int = 10, percentile: float = 90.0) -> np.ndarray:
+    """
+    Local terrain slope for each lake: a high percentile of the slope in the lake's
+    bounding box grown by `margin_px` (the lake surface itself is flat, the moraine
+    and valley walls around it are what matter).
+    """
+    slopes = np.zeros(len(lakes), dtype=np.float64)
+    if not lakes:
+        return slopes
+    with raster_io.open_shared(slope_path) as src:
+        inverse = ~src.transform
+        for i, lake in enumerate(lakes):
+            c0, r0 = inverse * (lake["min_x"], lake["max_y"])
+            c1, r1 = inverse * (lake["max_x"], lake["min_y"])
+            col0 = max(int(np.floor(min(c0, c1))) - margin_px, 0)
+            row0 = max(int(np.floor(min(r0, r1))) - margin_px, 0)
+            col1 = min(int(np.ceil(max(c0, c1))) + margin_px, src.width)
+            row1 = min(int(np.ceil(max(r0, r1))) + margin_px, src.height)
+            if col1 <= col0 or row1 <= row0:
+                continue
+            block = src.read(1, window=Window(col0, row0, col1 - col0, row1 - row0))
+            block = block[np.isfinite(block)]
+            if block.size:
+                slopes[i] = np.percentile(block, percentile)
+    return slopes
@@ -0,0 +1,153 @@
+import os
+import tempfile
+from typing import List, Optional
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from app.services import artifact_store, image_processing, raster_io, sparse_mask, terrain
+from app.services.gis_analysis import ASSUMED_DEPTH_INCREASE
+
+# Band layout of the per-tile intermediate files
+TILE_BANDS = {"ndwi_1": 1, "ndwi_2": 2, "change": 3, "slope": 4}
+
+def plan_tiles(img_path: str, dem_path: str, tile_size: int) -> List[dict]:
+    """
+    Split a scene into fixed tiles (row-major). Each tile is a plain dict so it can be
+    sent to a Celery worker. Slope is computed per tile only when the DEM shares the
+    image grid and its cached slope raster is missing or stale.
+    """
+    with raster_io.open_shared(img_path) as src, raster_io.open_shared(dem_path) as dem_src:
+        same_grid = (src.width, src.height, src.transform) == (dem_src.width, dem_src.height, dem_src.transform)
+        width, height = src.width, src.height
+    slope_fresh = artifact_store.is_fresh(terrain.output_paths(dem_path)["slope"], dem_path)
+
+    tiles = []
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            tiles.append({
+                "index": len(tiles),
+                "col_off": col_off,
+                "row_off": row_off,
+                "width": min(tile_size, width - col_off),
+                "height": min(tile_size, height - row_off),
+                "slope": same_grid and not slope_fresh,
+            })
+    return tiles
+
+def process_tile(
+    img1_path: str,
+    img2_path: str,
+    dem_path: str,
+    tile: dict,
+    work_dir: str,
+    threshold: float = 0.2,
+    green_band_idx: int = 2,
+    nir_band_idx: int = 4,
+    threshold_2: Optional[float] = None,
+) -> dict:
+    """
+    Map step: NDWI for both epochs, the expansion mask, partial volume sums and
+    (optionally) slope for one tile. Thresholds are per scene (expansion_mask), never per tile. Slope reads a 1-pixel halo around the tile so
+    that tile seams match a whole-scene pass. Intermediate rasters go to `work_dir`,
+    which must be shared by all workers; the returned dict holds the partial sums.
+    """
+    window = Window(tile["col_off"], tile["row_off"], tile["width"], tile["height"])
+    # Scenes and DEM stay open in the worker between tiles (see raster_io.DatasetPool)
+    with raster_io.open_shared(img1_path) as src1, raster_io.open_shared(img2_path) as src2:
+        ndwi1 = image_processing.ndwi_array(src1.read(green_band_idx, window=window), src1.read(nir_band_idx, window=window))
+        ndwi2 = image_processing.ndwi_array(src2.read(green_band_idx, window=window), src2.read(nir_band_idx, window=window))
+        profile = src1.profile
+        transform = src1.window_transform(window)
+    threshold_2 = threshold if threshold_2 is None else threshold_2
+    change = image_processing.expansion_mask(ndwi1, ndwi2, threshold, threshold_2)
+
+    with raster_io.open_shared(dem_path) as dem_src:
+        pixel_area = abs(dem_src.res[0] * dem_src.res[1])
+        slope = terrain.slope_window(dem_src, window) if tile["slope"] else None
+
+    bands = [ndwi1, ndwi2, change.astype(np.float32)]
+    if slope is not None:
+        bands.append(slope)
+    profile.update(
+        driver='GTiff',
+        width=tile["width"],
+        height=tile["height"],
+        count=len(bands),
+        dtype=rasterio.float32,
+        transform=transform,
+        compress='lzw'
+    )
+    tile_path = os.path.join(work_dir, f"tile_{tile['index']:06d}.tif")
+    with rasterio.open(tile_path, 'w', **profile) as dst:
+        dst.write(np.stack(bands))
+
+    changed_pixels = int(np.count_nonzero(change))
+    return {
+        "tile": tile,
+        "path": tile_path,
+        "water_pixels_1": int(np.count_nonzero(ndwi1 > threshold)),
+        "water_pixels_2": int(np.count_nonzero(ndwi2 > threshold_2)),
+        "changed_pixels": changed_pixels,
+        "volume": changed_pixels * pixel_area * ASSUMED_DEPTH_INCREASE,
+    }
+
+def reduce_tiles(partials: List[dict], img_path: str, dem_path: str, outputs: dict) -> dict:
+    """
+    Reduce step: mosaic the per-tile rasters into whole-scene GeoTIFFs (paths in
+    `outputs`: change, plus ndwi_1 / ndwi_2 for scene NDWIs that are not stored yet)
+    and the DEM slope, and add up the partial sums. Scene NDWIs and the slope are
+    shared with other analyses, so each mosaic is written to a temporary file and moved
+    into place. A change path ending in .npz is written as a block-sparse mask instead.
+    """
+    with rasterio.open(img_path) as src:
+        profile = src.profile
+    change = None
+    if sparse_mask.is_sparse(outputs["change"]):
+        change = sparse_mask.SparseMask(profile["width"], profile["height"], profile["transform"], profile["crs"])
+    profile.update(count=1)
+    float_profile = dict(artifact_store.raster_profile("ndwi", profile), dtype=rasterio.float32)
+    mask_profile = dict(artifact_store.raster_profile("change_export", profile), dtype=rasterio.uint8, nodata=None)
+    slope_profile = dict(artifact_store.raster_profile("slope", profile), dtype=rasterio.float32, nodata=np.nan)
+
+    targets = {name: (outputs[name], float_profile) for name in ("ndwi_1", "ndwi_2") if name in outputs}
+    if change is None:
+        targets["change"] = (outputs["change"], mask_profile)
+    if partials and all(p["tile"]["slope"] for p in partials):
+        targets["slope"] = (terrain.output_paths(dem_path)["slope"], slope_profile)
+    tmp_paths = {}
+    for name, (path, _) in targets.items():
+        fd, tmp_paths[name] = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".part")
+        os.close(fd)
+    try:
+        dsts = {}
+        try:
+            for name, (_, target_profile) in targets.items():
+                dsts[name] = rasterio.open(tmp_paths[name], 'w', **target_profile)
+            for partial in partials:
+                tile = partial["tile"]
+                window = Window(tile["col_off"], tile["row_off"], tile["width"], tile["height"])
+                with rasterio.open(partial["path"]) as tile_src:
+                    for name, dst in dsts.items():
+                        data = tile_src.read(TILE_BANDS[name])
+                        dst.write(data.astype(dst.dtypes[0]), 1, window=window)
+                    if change is not None:
+                        change.add(tile["row_off"], tile["col_off"], tile_src.read(TILE_BANDS["change"]))
+        finally:
+            for dst in dsts.values():
+                dst.close()
+        for name, (path, _) in targets.items():
+            raster_io.dataset_pool.invalidate(path)
+            os.replace(tmp_paths[name], path)
+    finally:
+        for tmp_path in tmp_paths.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    if change is not None:
+        change.save(outputs["change"])
+
+    return {
+        "water_pixels_1": sum(p["water_pixels_1"] for p in partials),
+        "water_pixels_2": sum(p["water_pixels_2"] for p in partials),
+        "changed_pixels": sum(p["changed_pixels"] for p in partials),
+        "volume": sum(p["volume"] for p in partials),
+    }
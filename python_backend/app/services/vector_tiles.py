@@ -0,0 +1,360 @@
+import math
+import struct
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+import shapely
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core import metrics
+from app.core.config import settings
+from app.models.analysis import DataVersion, TileFeature, TileFeatureIndex
+
+# Geometries are WGS84 lon/lat unless index_features is given their CRS.
+EARTH_RADIUS = 6378137.0
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+MAX_LATITUDE = 85.0511287798
+EXTENT = 4096
+BUFFER = 64
+
+def lod_zooms() -> List[int]:
+    """
+    Zoom levels with precomputed geometry (every second zoom up to VECTOR_TILE_MAX_LOD).
+    """
+    return list(range(0, settings.VECTOR_TILE_MAX_LOD + 1, 2))
+
+def lod_for_zoom(z: int) -> int:
+    """
+    Deepest precomputed level of detail that is not finer than the requested zoom.
+    """
+    return max(lod for lod in lod_zooms() if lod <= z)
+
+def tile_size_m(z: int) -> float:
+    return 2 * ORIGIN_SHIFT / (1 << z)
+
+def tile_bounds(z: int, x: int, y: int):
+    """
+    Web Mercator bounds (minx, miny, maxx, maxy) of an XYZ tile.
+    """
+    size = tile_size_m(z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+def is_lonlat(crs) -> bool:
+    if crs is None:
+        return True
+    from rasterio.crs import CRS # only for geometries in a raster's native CRS
+    return CRS.from_user_input(crs) == CRS.from_epsg(4326)
+
+def to_web_mercator(geoms: np.ndarray, crs=None) -> np.ndarray:
+    """
+    Project an array of geometries in `crs` (default lon/lat) to EPSG:3857 in one vectorised pass.
+    """
+    if not is_lonlat(crs):
+        from rasterio.warp import transform
+
+        def reproject(coords):
+            x, y = transform(crs, "EPSG:3857", coords[:, 0], coords[:, 1])
+            return np.column_stack([x, y])
+        return shapely.transform(geoms, reproject)
+
+    def project(coords):
+        lon = coords[:, 0]
+        lat = np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+        x = np.radians(lon) * EARTH_RADIUS
+        y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS
+        return np.column_stack([x, y])
+    return shapely.transform(geoms, project)
+
+def _tile_range(bounds: np.ndarray, z: int):
+    """
+    Inclusive tile index ranges covered by each row of Web Mercator bounds.
+    """
+    size = tile_size_m(z)
+    n = (1 << z) - 1
+    x0 = np.clip(np.floor((bounds[:, 0] + ORIGIN_SHIFT) / size), 0, n).astype(np.int64)
+    x1 = np.clip(np.floor((bounds[:, 2] + ORIGIN_SHIFT) / size), 0, n).astype(np.int64)
+    y0 = np.clip(np.floor((ORIGIN_SHIFT - bounds[:, 3]) / size), 0, n).astype(np.int64)
+    y1 = np.clip(np.floor((ORIGIN_SHIFT - bounds[:, 1]) / size), 0, n).astype(np.int64)
+    return x0, x1, y0, y1
+
+# Version of the tile features (vector-tile cache and geofence index key)
+DATA_VERSION = "tile_features"
+
+def data_version(db: Session) -> int:
+    return db.execute(select(DataVersion.version).where(DataVersion.name == DATA_VERSION)).scalar() or 0
+
+def bump_version(db: Session):
+    """
+    Increment the tile-feature version in the caller's transaction.
+    """
+    bump = update(DataVersion).where(DataVersion.name == DATA_VERSION).values(version=DataVersion.version + 1)
+    if db.execute(bump).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(DataVersion).values(name=DATA_VERSION, version=1))
+    except IntegrityError: # created concurrently
+        db.execute(bump)
+
+def index_features(db: Session, layer: str, analysis_id: int, geoms, properties: List[dict], crs=None):
+    """
+    Precompute per-LOD simplified copies of a layer's geometries (in `crs`, default
+    lon/lat) for one analysis and register them in the quadtree tile index. Replaces
+    any previous copies and bumps the data version. Features that collapse below a
+    pixel at a level of detail are left out of it.
+    """
+    existing = select(TileFeature.id).where(TileFeature.layer == layer, TileFeature.analysis_id == analysis_id)
+    db.execute(delete(TileFeatureIndex).where(TileFeatureIndex.feature_id.in_(existing)))
+    db.execute(delete(TileFeature).where(TileFeature.layer == layer, TileFeature.analysis_id == analysis_id))
+    bump_version(db)
+
+    geoms = to_web_mercator(np.asarray(geoms, dtype=object), crs)
+    if len(geoms) == 0:
+        return
+    properties = np.asarray(properties, dtype=object)
+
+    for lod in lod_zooms():
+        # Half a screen pixel of a 256px tile at this zoom
+        tolerance = tile_size_m(lod) / 512
+        simplified = shapely.simplify(geoms, tolerance, preserve_topology=True)
+        bounds = shapely.bounds(simplified)
+        extent = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        visible = ~shapely.is_empty(simplified) & np.isfinite(extent) & (extent >= tolerance)
+        if not visible.any():
+            continue
+        simplified, bounds, props = simplified[visible], bounds[visible], properties[visible]
+        # Deepest zoom where the feature is no wider than one tile (so it touches <= 2x2 tiles)
+        with np.errstate(divide='ignore'):
+            levels = np.floor(np.log2(2 * ORIGIN_SHIFT / extent[visible]))
+        levels = np.clip(levels, 0, lod).astype(np.int64)
+        wkb = shapely.to_wkb(simplified)
+
+        feature_ids = db.execute(
+            insert(TileFeature).returning(TileFeature.id, sort_by_parameter_order=True),
+            [
+                {
+                    "layer": layer,
+                    "analysis_id": analysis_id,
+                    "lod": lod,
+                    "properties": prop,
+                    "geometry_wkb": blob,
+                }
+                for prop, blob in zip(props, wkb)
+            ]
+        ).scalars().all()
+
+        index_rows = []
+        for level in np.unique(levels):
+            at_level = np.nonzero(levels == level)[0]
+            x0, x1, y0, y1 = _tile_range(bounds[at_level], int(level))
+            for j, i in enumerate(at_level):
+                for tx in range(x0[j], x1[j] + 1):
+                    for ty in range(y0[j], y1[j] + 1):
+                        index_rows.append({
+                            "lod": lod,
+                            "level": int(level),
+                            "tile_x": int(tx),
+                            "tile_y": int(ty),
+                            "feature_id": feature_ids[i],
+                        })
+        db.execute(insert(TileFeatureIndex), index_rows)
+
+# --- Mapbox Vector Tile (v2) encoding -------------------------------------------------
+
+def _varint(value: int, out: bytearray):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _bytes_field(field: int, payload: bytes, out: bytearray):
+    _varint((field << 3) | 2, out)
+    _varint(len(payload), out)
+    out.extend(payload)
+
+def _varint_field(field: int, value: int, out: bytearray):
+    _varint(field << 3, out)
+    _varint(value, out)
+
+def _packed_field(field: int, values, out: bytearray):
+    payload = bytearray()
+    for value in values:
+        _varint(int(value), payload)
+    _bytes_field(field, bytes(payload), out)
+
+def _encode_value(value) -> bytes:
+    out = bytearray()
+    if isinstance(value, bool):
+        _varint_field(7, int(value), out)
+    elif isinstance(value, int):
+        _varint_field(6, (value << 1) ^ (value >> 63), out)
+    elif isinstance(value, float):
+        _varint(3 << 3 | 1, out)
+        out.extend(struct.pack("<d", value))
+    else:
+        _bytes_field(1, str(value).encode("utf-8"), out)
+    return bytes(out)
+
+def _ring_commands(ring: np.ndarray, closed: bool, cursor: list, commands: list) -> bool:
+    if closed:
+        ring = ring[:-1]
+    if len(ring) > 1:
+        keep = np.ones(len(ring), dtype=bool)
+        keep[1:] = np.any(ring[1:] != ring[:-1], axis=1)
+        ring = ring[keep]
+    if len(ring) < (3 if closed else 2):
+        return False
+    deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    commands.append(1 | (1 << 3))
+    commands.extend(zigzag[0])
+    commands.append(2 | ((len(ring) - 1) << 3))
+    commands.extend(zigzag[1:].ravel())
+    if closed:
+        commands.append(7 | (1 << 3))
+    cursor[:] = ring[-1]
+    return True
+
+def _signed_area(ring: np.ndarray) -> float:
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]))
+
+def _geometry_commands(geom, cursor: list):
+    """
+    Encode a tile-space geometry into MVT commands. Returns (geom_type, commands).
+    Exterior rings are wound clockwise in screen space (positive area), holes counter-clockwise.
+    """
+    commands = []
+    type_id = shapely.get_type_id(geom)
+    if type_id in (1, 5): # LineString, MultiLineString
+        for part in shapely.get_parts(geom):
+            coords = np.rint(shapely.get_coordinates(part)).astype(np.int64)
+            _ring_commands(coords, False, cursor, commands)
+        return 2, commands
+    if type_id in (3, 6): # Polygon, MultiPolygon
+        for part in shapely.get_parts(geom):
+            rings = [part.exterior] + list(part.interiors)
+            for i, ring in enumerate(rings):
+                coords = np.rint(shapely.get_coordinates(ring)).astype(np.int64)
+                area = _signed_area(coords)
+                if area == 0:
+                    if i == 0:
+                        break
+                    continue
+                if (area < 0) == (i == 0):
+                    coords = coords[::-1]
+                _ring_commands(coords, True, cursor, commands)
+        return 3, commands
+    return 0, commands
+
+def encode_layer(name: str, geoms: np.ndarray, properties: List[dict]) -> bytes:
+    """
+    Encode one MVT layer. `geoms` must already be in tile coordinates (0..EXTENT, y down).
+    """
+    layer = bytearray()
+    _varint_field(15, 2, layer)
+    _bytes_field(1, name.encode("utf-8"), layer)
+    keys, values = {}, {}
+    for geom, props in zip(geoms, properties):
+        geom_type, commands = _geometry_commands(geom, [0, 0])
+        if not commands:
+            continue
+        tags = []
+        for key, value in (props or {}).items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        feature = bytearray()
+        _packed_field(2, tags, feature)
+        _varint_field(3, geom_type, feature)
+        _packed_field(4, commands, feature)
+        _bytes_field(2, bytes(feature), layer)
+    for key in keys:
+        _bytes_field(3, key.encode("utf-8"), layer)
+    for _, value in values:
+        _bytes_field(4, _encode_value(value), layer)
+    _varint_field(5, EXTENT, layer)
+    return bytes(layer)
+
+# --- Tile rendering -------------------------------------------------------------------
+
+class TileCache:
+    """
+    Thread-safe LRU of encoded tiles, keyed by (z, x, y, data version).
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[bytes]:
+        with self._lock:
+            tile = self._items.get(key)
+            if tile is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+        metrics.record_cache("vector_tiles", tile is not None)
+        return tile
+
+    def put(self, key, tile: bytes):
+        with self._lock:
+            self._items[key] = tile
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+tile_cache = TileCache(settings.VECTOR_TILE_CACHE_SIZE)
+
+def render_tile(db: Session, z: int, x: int, y: int) -> bytes:
+    """
+    Return the encoded MVT for an XYZ tile, from the LRU cache when the data has not changed.
+    """
+    version = data_version(db)
+    key = (z, x, y, version)
+    tile = tile_cache.get(key)
+    if tile is not None:
+        return tile
+
+    lod = lod_for_zoom(z)
+    ancestors = [
+        and_(TileFeatureIndex.level == level, TileFeatureIndex.tile_x == (x >> (z - level)), TileFeatureIndex.tile_y == (y >> (z - level)))
+        for level in range(lod + 1)
+    ]
+    rows = db.execute(
+        select(TileFeature.layer, TileFeature.properties, TileFeature.geometry_wkb)
+        .where(TileFeature.id.in_(
+            select(TileFeatureIndex.feature_id).where(TileFeatureIndex.lod == lod, or_(*ancestors))
+        ))
+    ).all()
+
+    tile = bytearray()
+    if rows:
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        scale = EXTENT / (maxx - minx)
+        margin = BUFFER / scale
+        layers = np.array([row.layer for row in rows], dtype=object)
+        geoms = shapely.clip_by_rect(
+            shapely.from_wkb([row.geometry_wkb for row in rows]),
+            minx - margin, miny - margin, maxx + margin, maxy + margin
+        )
+        geoms = shapely.transform(
+            geoms, lambda c: np.column_stack([(c[:, 0] - minx) * scale, (maxy - c[:, 1]) * scale])
+        )
+        keep = ~shapely.is_empty(geoms)
+        for name in sorted(set(layers[keep])):
+            selected = np.nonzero(keep & (layers == name))[0]
+            layer = encode_layer(name, geoms[selected], [rows[i].properties for i in selected])
+            _bytes_field(3, layer, tile)
+
+    tile = bytes(tile)
+    tile_cache.put(key, tile)
+    return tile
@@ -1,16 +1,266 @@
+from celery import chord
+from app.core import metrics
 from app.core.celery_app import celery_app
+from app.core.config import settings
 from app.db.session import SessionLocal
-from app.services import image_processing, gis_analysis, risk_assessment, alert_service
-from app.models.analysis import AnalysisResult
+from app.services import admission, image_processing, gis_analysis, inundation, risk_assessment, alert_service, artifact_store, lake_segmentation, quick_look, raster_stats, scene_catalog, terrain, tiling, vector_tiles
+from app.models.analysis import AnalysisEstimate, AnalysisResult, ImageMetadata, Lake
 from datetime import datetime
+import json
+import logging
 import os
+import shutil
+import numpy as np
+import shapely.geometry
+
+logger = logging.getLogger(__name__)
 
 @celery_app.task(acks_late=True)
 def test_celery(word: str) -> str:
     return f"test task return {word}"
 
+def _water_thresholds(analysis_id: int, ndwi1: str, ndwi2: str) -> tuple:
+    """
+    Per-epoch NDWI water thresholds from the stored NDWI histograms (computed with one
+    read when an NDWI has none yet, never replaced by the fixed default).
+    """
+    thresholds = tuple(raster_stats.water_threshold(raster_stats.ensure(path)) for path in (ndwi1, ndwi2))
+    metrics.log_event("water_thresholds", analysis_id=analysis_id, method=settings.WATER_THRESHOLD_METHOD,
+                      threshold_1=round(thresholds[0], 4), threshold_2=round(thresholds[1], 4))
+    return thresholds
+
+# risk_level of an analysis whose pipeline failed (it is "Calculating..." while running)
+ANALYSIS_FAILED = "Failed"
+
+def _mark_failed(analysis_id: int, error) -> str:
+    """
+    Record that an analysis failed, so it does not stay in progress; returns the task result.
+    """
+    db = SessionLocal()
+    try:
+        analysis = db.query(AnalysisResult).filter(AnalysisResult.id == analysis_id).first()
+        if analysis is not None:
+            analysis.risk_level = ANALYSIS_FAILED
+            db.commit()
+    finally:
+        db.close()
+    metrics.log_event("analysis_failed", analysis_id=analysis_id, error=str(error))
+    return f"Error: {error}"
+
+def _dem_artifacts(dem_path: str) -> list:
+    return [artifact_store.scene_path(dem_path, "drainage"), artifact_store.scene_path(dem_path, "hand")]
+
+def _finish_analysis(db, analysis, ndwi1: str, ndwi2: str, change_path: str, dem_path: str, vol_change: float,
+                     thresholds: tuple) -> str:
+    """
+    Pipeline stages after change detection: lakes, risk, zones. Flow routing and
+    alerts are queued on their own queues (route_flow_task -> send_alerts_task).
+    Shared by the single-process task and the map-reduce reducer.
+    """
+    analysis_id = analysis.id
+
+    # 3b. Lake Segmentation (per-lake areas for both epochs)
+    with metrics.stage("lake_segmentation", analysis_id=analysis_id):
+        lakes1 = lake_segmentation.segment_lakes(ndwi1, threshold=thresholds[0])
+        lakes2 = lake_segmentation.segment_lakes(ndwi2, threshold=thresholds[1], change_mask_path=change_path)
+    
+    # 5. Risk Assessment (per lake, from its volume change and local slope)
+    with metrics.stage("risk_assessment", analysis_id=analysis_id, lakes=len(lakes2)):
+        with artifact_store.lease(terrain.output_paths(dem_path).values()):
+            slope_path = terrain.compute_terrain(dem_path)["slope"]
+            slopes = terrain.lake_slopes(slope_path, lakes2)
+        volumes = np.array([lake["changed_area"] for lake in lakes2]) * gis_analysis.ASSUMED_DEPTH_INCREASE
+        levels = risk_assessment.assess_risk_array(volumes, slopes)
+        for lake, volume, slope, level in zip(lakes2, volumes, slopes, levels):
+            lake.update(volume_change=float(volume), slope=float(slope), risk_level=str(level))
+        risk = risk_assessment.most_severe(levels)
+        lake_segmentation.save_lakes(db, analysis_id, 1, lakes1)
+        lake_segmentation.save_lakes(db, analysis_id, 2, lakes2)
+    
+    # 5b. Risk Zones (polygonised change mask, bulk inserted)
+    with metrics.stage("risk_zones", analysis_id=analysis_id):
+        zones = risk_assessment.generate_risk_zones(change_path, risk)
+        risk_assessment.save_risk_zones(db, analysis_id, zones)
+        risk_map_path = artifact_store.analysis_path(analysis_id, "risk_map")
+        with open(risk_map_path, 'w') as f:
+            json.dump(risk_assessment.generate_risk_map(zones, analysis_id), f)
+    
+    analysis.lake_area_1 = sum(lake["area"] for lake in lakes1)
+    analysis.lake_area_2 = sum(lake["area"] for lake in lakes2)
+    analysis.volume_change = vol_change
+    analysis.risk_level = risk
+    analysis.ndwi_path_1 = ndwi1
+    analysis.ndwi_path_2 = ndwi2
+    analysis.change_detection_path = change_path
+    analysis.risk_map_path = risk_map_path
+    db.query(AnalysisEstimate).filter(AnalysisEstimate.analysis_id == analysis_id).delete()
+    # Store flow path location in DB if schema supports it, or just use naming convention
+    # For now, we assume frontend fetches it by convention or we add column
+    
+    db.commit()
+    artifact_store.enforce_budget()
+
+    # 6-7. Flow path and SOS alerts
+    route_flow_task.delay(analysis_id, dem_path, risk)
+    return f"Analysis {analysis_id} completed with risk {risk}. Flow routing queued."
+
+def _source_lake(db, analysis_id: int):
+    """
+    The epoch-2 lake a GLOF would start from: most severe risk level, then largest.
+    """
+    lakes = db.query(Lake).filter(Lake.analysis_id == analysis_id, Lake.epoch == 2).all()
+    ranks = {level: rank for rank, level in enumerate(risk_assessment.RISK_LEVELS)}
+    return max(lakes, key=lambda lake: (ranks.get(lake.risk_level, -1), lake.area), default=None)
+
+@celery_app.task(acks_late=True)
+def route_flow_task(analysis_id: int, dem_path: str, risk: str):
+    """
+    Flow path and HAND inundation extent for an analysis (flow queue); queues the SOS
+    alerts when the risk is High or Critical. The flood extent is the alert area;
+    without one (no lake, lake outside the DEM) alerts fall back to the buffered
+    D8 flow path.
+    """
+    db = SessionLocal()
+    try:
+        with artifact_store.lease(_dem_artifacts(dem_path)): # drainage and HAND are read throughout
+            # 6. Flow Path Generation (D8) and inundation extent, from the source lake
+            flow_path_geojson = artifact_store.analysis_path(analysis_id, "flow_path")
+            inundation_geojson = None
+            lake = _source_lake(db, analysis_id)
+            if settings.INUNDATION_ENABLED and lake is not None:
+                with metrics.stage("inundation", analysis_id=analysis_id):
+                    try:
+                        extent_path = artifact_store.analysis_path(analysis_id, "inundation")
+                        volume = inundation.release_volume(dem_path, lake.area, lake.centroid_y)
+                        inundation.inundation_extent(
+                            dem_path, lake.centroid_x, lake.centroid_y, volume, extent_path, flow_path_geojson
+                        )
+                        inundation_geojson = extent_path
+                    except Exception as e:
+                        logger.exception("Inundation failed for analysis %s: %s", analysis_id, e)
+            if inundation_geojson is None:
+                # Placeholder coords 85.0, 28.0 when the analysis has no lakes
+                start_lon, start_lat = (lake.centroid_x, lake.centroid_y) if lake is not None else (85.0, 28.0)
+                with metrics.stage("flow_path", analysis_id=analysis_id):
+                    gis_analysis.generate_flow_path(dem_path, start_lat, start_lon, flow_path_geojson)
+
+            layers = [("flow_paths", flow_path_geojson)] + ([("inundation", inundation_geojson)] if inundation_geojson else [])
+            for layer, path in layers:
+                with open(path) as f:
+                    feature = json.load(f)
+                vector_tiles.index_features(
+                    db, layer, analysis_id,
+                    [shapely.geometry.shape(feature["geometry"])],
+                    [{"analysis_id": analysis_id, "type": feature["properties"]["type"]}]
+                )
+        db.commit()
+
+        # 7. SOS Alert
+        if risk in ["High", "Critical"]:
+            send_alerts_task.delay(analysis_id, inundation_geojson or flow_path_geojson, settings.ALERT_FLOW_BUFFER_KM)
+            return f"Flow path for analysis {analysis_id} generated. Alerts queued."
+        return f"Flow path for analysis {analysis_id} generated."
+    except Exception as e:
+        return f"Error: {str(e)}"
+    finally:
+        db.close()
+
+@celery_app.task(acks_late=True)
+def send_alerts_task(analysis_id: int, flow_path_geojson: str, buffer_km: float = 2.0) -> int:
+    """
+    Alert users inside the inundation extent, or the buffered flow path (alerts queue).
+    Can also be sent on its own, e.g. send_alerts_task.delay(7, artifact_store.analysis_path(7, "inundation")).
+    """
+    db = SessionLocal()
+    try:
+        # Use Flow-Aware Buffer
+        with metrics.stage("alerts", analysis_id=analysis_id):
+            return alert_service.alert_users_in_flow_buffer(db, flow_path_geojson, buffer_km=buffer_km)
+    finally:
+        db.close()
+
+def _scene_ndwi(img_path: str, ndwi_path: str) -> str:
+    """
+    Per-scene NDWI (and its statistics), reused from the artifact store when it is newer than the scene.
+    """
+    fresh = artifact_store.is_fresh(ndwi_path, img_path)
+    metrics.record_cache("scene_ndwi", fresh)
+    if not fresh:
+        image_processing.calculate_ndwi(img_path, ndwi_path)
+    else:
+        raster_stats.ensure(ndwi_path, source=img_path) # NDWIs stored before their statistics were, or mosaicked by a reducer
+    return ndwi_path
+
+@celery_app.task(acks_late=True)
+def ingest_scene_task(image_id: int):
+    """
+    Queued when a scene is uploaded: stores its band statistics and its NDWI (with
+    the NDWI histogram), then starts a change analysis against the previous scene of
+    the same area and type (whose NDWI is normally already stored). Flow routing and
+    SOS alerts follow from the analysis.
+    """
+    db = SessionLocal()
+    try:
+        image = db.query(ImageMetadata).filter(ImageMetadata.id == image_id).first()
+        if not image or image.image_type == "dem":
+            return f"Image {image_id}: nothing to analyse"
+
+        if settings.BUILD_OVERVIEWS_ON_INGEST:
+            with metrics.stage("ingest_overviews", image_id=image_id):
+                quick_look.build_overviews(image.file_path)
+        with metrics.stage("ingest_stats", image_id=image_id):
+            raster_stats.ensure(image.file_path)
+        with metrics.stage("ingest_ndwi", image_id=image_id):
+            _scene_ndwi(image.file_path, artifact_store.scene_path(image.file_path, "ndwi"))
+        previous = scene_catalog.previous_scene(db, image)
+        if previous is None:
+            return f"Image {image_id}: first epoch of its area, NDWI stored"
+        dem = scene_catalog.covering_dem(db, image)
+        if dem is None:
+            return f"Image {image_id}: no DEM covers the scene"
+
+        analysis = AnalysisResult(
+            date_1=previous.capture_date,
+            date_2=image.capture_date,
+            created_at=datetime.utcnow(),
+            risk_level="Calculating..."
+        )
+        db.add(analysis)
+        db.commit()
+        metrics.log_event(
+            "scene_ingested", image_id=image_id, previous_image_id=previous.id, analysis_id=analysis.id,
+            queued_seconds=(datetime.utcnow() - image.upload_date).total_seconds() if image.upload_date else None
+        )
+        process_analysis_task.delay(analysis.id, previous.file_path, image.file_path, dem.file_path)
+        return f"Image {image_id}: analysis {analysis.id} queued against image {previous.id}"
+    except Exception as e:
+        return f"Error: {str(e)}"
+    finally:
+        db.close()
+
 @celery_app.task(acks_late=True)
 def process_analysis_task(analysis_id: int, img1_path: str, img2_path: str, dem_path: str):
+    """
+    Full-resolution analysis, started once its memory estimate fits the node's budget
+    (admission.admit); a scene too large for the whole budget is re-dispatched as a
+    map-reduce job with tiles that fit.
+    """
+    if not settings.ADMISSION_CONTROL:
+        return _process_analysis(analysis_id, img1_path, img2_path, dem_path)
+    inputs = [img1_path, img2_path, dem_path]
+    try:
+        estimate = admission.estimate_bytes(inputs)
+    except Exception as e:
+        return _mark_failed(analysis_id, e)
+    if not admission.fits_alone(estimate):
+        tile_size = admission.tile_size_for(inputs)
+        admission.record_downscale(f"analysis:{analysis_id}", estimate, tile_size)
+        process_analysis_mapreduce_task.delay(analysis_id, img1_path, img2_path, dem_path, tile_size)
+        return f"Analysis {analysis_id} needs ~{estimate / 2**20:.0f} MiB, over budget: dispatched tiled ({tile_size}px)"
+    with admission.admit(f"analysis:{analysis_id}", estimate):
+        return _process_analysis(analysis_id, img1_path, img2_path, dem_path)
+
+def _process_analysis(analysis_id: int, img1_path: str, img2_path: str, dem_path: str):
     db = SessionLocal()
     try:
         analysis = db.query(AnalysisResult).filter(AnalysisResult.id == analysis_id).first()
@@ -20,46 +270,107 @@ def process_analysis_task(analysis_id: int, img1_path: str, img2_path: str, dem_
         # 1. SRCNN / Enhancement (Placeholder)
         
         # 2. NDWI
-        ndwi1 = img1_path + ".ndwi.tif"
-        ndwi2 = img2_path + ".ndwi.tif"
-        image_processing.calculate_ndwi(img1_path, ndwi1)
-        image_processing.calculate_ndwi(img2_path, ndwi2)
-        
-        # 3. Change Detection
-        change_path = f"analysis_{analysis_id}_change.tif"
-        image_processing.detect_change(ndwi1, ndwi2, change_path)
-        
-        # 4. Volume Change
-        vol_change = gis_analysis.calculate_volume_change(dem_path, change_path)
+        ndwi1 = artifact_store.scene_path(img1_path, "ndwi")
+        ndwi2 = artifact_store.scene_path(img2_path, "ndwi")
+        with artifact_store.lease([ndwi1, ndwi2]):
+            with metrics.stage("ndwi", analysis_id=analysis_id):
+                _scene_ndwi(img1_path, ndwi1)
+                _scene_ndwi(img2_path, ndwi2)
         
-        # 5. Risk Assessment
-        risk = risk_assessment.assess_risk(vol_change, 15.0) # Slope placeholder
+            # 3. Change Detection (per-scene water thresholds from the NDWI histograms)
+            thresholds = _water_thresholds(analysis_id, ndwi1, ndwi2)
+            change_path = artifact_store.analysis_path(analysis_id, "change")
+            with metrics.stage("change_detection", analysis_id=analysis_id):
+                image_processing.detect_change(ndwi1, ndwi2, change_path, *thresholds)
         
-        # 6. Flow Path Generation (D8)
-        # Assuming lake center or risk point is start. 
-        # For prototype, extracting from image bounds or metadata would be better.
-        # Placeholder coords: 85.0, 28.0
-        flow_path_geojson = f"analysis_{analysis_id}_flow.json"
-        gis_analysis.generate_flow_path(dem_path, 28.0, 85.0, flow_path_geojson)
+            # 4. Volume Change
+            with metrics.stage("volume_change", analysis_id=analysis_id):
+                vol_change = gis_analysis.calculate_volume_change(dem_path, change_path)
         
-        analysis.volume_change = vol_change
-        analysis.risk_level = risk
-        analysis.ndwi_path_1 = ndwi1
-        analysis.ndwi_path_2 = ndwi2
-        analysis.change_detection_path = change_path
-        # Store flow path location in DB if schema supports it, or just use naming convention
-        # For now, we assume frontend fetches it by convention or we add column
-        
-        db.commit()
+            return _finish_analysis(db, analysis, ndwi1, ndwi2, change_path, dem_path, vol_change, thresholds)
+    except Exception as e:
+        db.rollback()
+        return _mark_failed(analysis_id, e)
+    finally:
+        db.close()
 
-        # 7. SOS Alert
-        if risk in ["High", "Critical"]:
-            # Use Flow-Aware Buffer
-            alert_count = alert_service.alert_users_in_flow_buffer(db, flow_path_geojson, buffer_km=2.0)
-            return f"Analysis {analysis_id} completed with risk {risk}. Generated flow path. Sent {alert_count} alerts."
+def _mapreduce_work_dir(analysis_id: int) -> str:
+    return os.path.join(settings.MAPREDUCE_WORK_DIR, f"analysis_{analysis_id}")
 
-        return f"Analysis {analysis_id} completed with risk {risk}"
+@celery_app.task(acks_late=True)
+def process_analysis_mapreduce_task(analysis_id: int, img1_path: str, img2_path: str, dem_path: str, tile_size: int = None):
+    """
+    Map-reduce variant of process_analysis_task for very large scenes: one subtask per
+    tile (NDWI, change, partial volume, slope) fanned out over every worker, then a
+    reducer that mosaics the tiles and runs the remaining stages. Water thresholds are
+    chosen once per scene from its stored NDWI statistics, as in process_analysis_task
+    (scenes uploaded before ingest get their NDWI and statistics here first).
+    """
+    try:
+        tiles = tiling.plan_tiles(img1_path, dem_path, tile_size or settings.MAPREDUCE_TILE_SIZE)
+        work_dir = _mapreduce_work_dir(analysis_id)
+        os.makedirs(work_dir, exist_ok=True)
+        ndwi1 = artifact_store.scene_path(img1_path, "ndwi")
+        ndwi2 = artifact_store.scene_path(img2_path, "ndwi")
+        with metrics.stage("ndwi", analysis_id=analysis_id):
+            _scene_ndwi(img1_path, ndwi1)
+            _scene_ndwi(img2_path, ndwi2)
+        thresholds = _water_thresholds(analysis_id, ndwi1, ndwi2)
+        reducer = reduce_analysis_task.s(analysis_id, img1_path, img2_path, dem_path, thresholds)
+        chord(
+            process_tile_task.s(img1_path, img2_path, dem_path, tile, work_dir, thresholds) for tile in tiles
+        )(reducer.on_error(mapreduce_failed_task.s(analysis_id)))
+        return f"Analysis {analysis_id} dispatched as {len(tiles)} tiles"
     except Exception as e:
-        return f"Error: {str(e)}"
+        # Eager mode runs the chord inline, so a failed tile surfaces here
+        shutil.rmtree(_mapreduce_work_dir(analysis_id), ignore_errors=True)
+        return _mark_failed(analysis_id, e)
+
+@celery_app.task
+def mapreduce_failed_task(request, exc, traceback, analysis_id: int):
+    """
+    Error callback of the map-reduce chord: a tile (or the reducer) failed, so the
+    reducer will not run. Marks the analysis failed and removes its work dir.
+    """
+    logger.error("Map-reduce of analysis %s failed in task %s: %s", analysis_id, request.id, exc)
+    shutil.rmtree(_mapreduce_work_dir(analysis_id), ignore_errors=True)
+    return _mark_failed(analysis_id, exc)
+
+@celery_app.task(acks_late=True)
+def process_tile_task(img1_path: str, img2_path: str, dem_path: str, tile: dict, work_dir: str,
+                      thresholds: list) -> dict:
+    threshold, threshold_2 = thresholds
+    if not settings.ADMISSION_CONTROL:
+        with metrics.stage("map_tile", tile=tile["index"]):
+            return tiling.process_tile(img1_path, img2_path, dem_path, tile, work_dir, threshold, threshold_2=threshold_2)
+    estimate = admission.estimate_bytes([img1_path, img2_path, dem_path], pixels=tile["width"] * tile["height"])
+    with admission.admit(f"tile:{os.path.basename(work_dir)}:{tile['index']}", estimate, kind="tile"):
+        with metrics.stage("map_tile", tile=tile["index"]):
+            return tiling.process_tile(img1_path, img2_path, dem_path, tile, work_dir, threshold, threshold_2=threshold_2)
+
+@celery_app.task(acks_late=True)
+def reduce_analysis_task(partials: list, analysis_id: int, img1_path: str, img2_path: str, dem_path: str,
+                         thresholds: list):
+    db = SessionLocal()
+    try:
+        analysis = db.query(AnalysisResult).filter(AnalysisResult.id == analysis_id).first()
+        if not analysis:
+            return "Analysis not found"
+
+        ndwi1 = artifact_store.scene_path(img1_path, "ndwi")
+        ndwi2 = artifact_store.scene_path(img2_path, "ndwi")
+        change_path = artifact_store.analysis_path(analysis_id, "change")
+        with artifact_store.lease([ndwi1, ndwi2]):
+            # Stored scene NDWIs are kept; only ones evicted since the dispatch are mosaicked
+            outputs = {"change": change_path}
+            for name, img_path, ndwi_path in (("ndwi_1", img1_path, ndwi1), ("ndwi_2", img2_path, ndwi2)):
+                if not artifact_store.is_fresh(ndwi_path, img_path):
+                    outputs[name] = ndwi_path
+            with metrics.stage("reduce_tiles", analysis_id=analysis_id, tiles=len(partials)):
+                totals = tiling.reduce_tiles(partials, img1_path, dem_path, outputs)
+            return _finish_analysis(db, analysis, ndwi1, ndwi2, change_path, dem_path, totals["volume"], thresholds)
+    except Exception as e:
+        return _mark_failed(analysis_id, e)
     finally:
         db.close()
+        shutil.rmtree(_mapreduce_work_dir(analysis_id), ignore_errors=True)
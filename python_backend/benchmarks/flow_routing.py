@@ -0,0 +1,192 @@
+# DEM conditioning benchmark: the pysheds chain the pipeline used before (fill_pits,
+# fill_depressions, resolve_flats, flowdir, accumulation) against the numba
+# Priority-Flood of app.services.hydrology, in memory and tiled, on synthetic DEMs.
+# Every case runs in a fresh process and writes a drainage raster (D8 index + channel
+# bit); wall time (best of --repeat), peak RSS, and the channel network (within 2 cells)
+# and direction agreement with the first method are reported.
+#
+#   python -m benchmarks.flow_routing --sizes 1024,2048,4096 --noise 1.0
+#   python -m benchmarks.flow_routing --sizes 16384 --methods priority_flood_tiled --tile-size 4096
+import argparse
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy import ndimage
+from benchmarks.run_benchmarks import _current_peak_rss, _reset_peak_rss, environment
+from benchmarks.synthetic import make_dem
+
+METHODS = ["pysheds", "priority_flood", "priority_flood_tiled"]
+
+def _pysheds_drainage(dem_path: str, output_path: str, channel_cells: float):
+    from pysheds.grid import Grid
+    from app.services.hydrology import CHANNEL_BIT, NO_OUTFLOW, PYSHEDS_DIRMAP
+
+    grid = Grid.from_raster(dem_path)
+    dem = grid.read_raster(dem_path)
+    inflated = grid.resolve_flats(grid.fill_depressions(grid.fill_pits(dem)))
+    fdir = grid.flowdir(inflated)
+    acc = np.asarray(grid.accumulation(fdir))
+    lut = np.full(256, NO_OUTFLOW, dtype=np.uint8)
+    for index, code in enumerate(PYSHEDS_DIRMAP):
+        lut[code] = index
+    fdir = np.asarray(fdir)
+    drainage = np.where((fdir > 0) & (fdir < 256), lut[np.clip(fdir, 0, 255)], NO_OUTFLOW).astype(np.uint8)
+    drainage[acc >= channel_cells] |= CHANNEL_BIT
+    with rasterio.open(dem_path) as src:
+        profile = dict(src.profile, dtype=rasterio.uint8, count=1, nodata=None)
+    with rasterio.open(output_path, "w", **profile) as dst:
+        dst.write(drainage, 1)
+
+def _call(method: str, dem_path: str, output_path: str, channel_cells: float, tile_size: int):
+    from app.core.config import settings
+    from app.services import hydrology
+
+    with rasterio.open(dem_path) as src:
+        profile = dict(src.profile)
+    if method == "pysheds":
+        _pysheds_drainage(dem_path, output_path, channel_cells)
+    elif method == "priority_flood":
+        settings.HYDROLOGY_IN_MEMORY_MAX_PIXELS = profile["width"] * profile["height"]
+        hydrology.condition(dem_path, output_path, channel_cells, profile)
+    elif method == "priority_flood_tiled":
+        hydrology.condition_tiled(dem_path, output_path, channel_cells, profile, tile_size=tile_size)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+def _run_case(method: str, dem_path: str, output_path: str, channel_cells: float, tile_size: int, repeat: int, queue):
+    """
+    Runs in a fresh process so that peak RSS belongs to this method alone. Libraries
+    are imported before the reset, as a worker's prewarm would.
+    """
+    importlib.import_module("pysheds.grid" if method == "pysheds" else "app.services.hydrology")
+    baseline = _reset_peak_rss()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _call(method, dem_path, output_path, channel_cells, tile_size)
+        timings.append(time.perf_counter() - start)
+    peak = _current_peak_rss()
+    queue.put({"timings": timings, "peak_rss_bytes": peak, "peak_rss_delta_bytes": peak - baseline})
+
+def run_case(method: str, size: int, dem_path: str, out_dir: str, channel_cells: float, tile_size: int, repeat: int) -> dict:
+    output_path = os.path.join(out_dir, f"drainage_{method}_{size}.tif")
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case, args=(method, dem_path, output_path, channel_cells, tile_size, repeat, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return {"method": method, "size": size, "error": f"exit code {process.exitcode}"}
+    measured = queue.get()
+    seconds = min(measured["timings"])
+    return {
+        "method": method,
+        "size": size,
+        "pixels": size * size,
+        "seconds": seconds,
+        "megapixels_per_second": size * size / 1e6 / seconds if seconds > 0 else None,
+        "peak_rss_bytes": measured["peak_rss_bytes"],
+        "peak_rss_delta_bytes": measured["peak_rss_delta_bytes"],
+        "output": output_path,
+    }
+
+def agreement(reference_path: str, path: str, tolerance: int = 2, strip_rows: int = 1024) -> dict:
+    """
+    Share of each channel network lying within `tolerance` cells of the other (single-cell
+    D8 channels shifted by one cell would otherwise not overlap at all) and share of cells
+    with the same D8 direction, read strip by strip with a `tolerance`-row halo.
+    """
+    kernel = np.ones((3, 3), dtype=bool)
+    same = total = 0
+    counts = {"reference": [0, 0], "other": [0, 0]} # [channel cells near the other network, channel cells]
+    with rasterio.open(reference_path) as ref, rasterio.open(path) as other:
+        for row0 in range(0, ref.height, strip_rows):
+            top = max(row0 - tolerance, 0)
+            bottom = min(row0 + strip_rows + tolerance, ref.height)
+            window = Window(0, top, ref.width, bottom - top)
+            a, b = ref.read(1, window=window), other.read(1, window=window)
+            core = slice(row0 - top, row0 - top + min(strip_rows, ref.height - row0))
+            same += int(np.count_nonzero((a[core] & 15) == (b[core] & 15)))
+            total += a[core].size
+            channels = {"reference": (a & 16) > 0, "other": (b & 16) > 0}
+            for name, against in (("reference", "other"), ("other", "reference")):
+                near = ndimage.binary_dilation(channels[against], kernel, iterations=tolerance)
+                counts[name][0] += int(np.count_nonzero((channels[name] & near)[core]))
+                counts[name][1] += int(np.count_nonzero(channels[name][core]))
+    share = {name: near / cells if cells else 1.0 for name, (near, cells) in counts.items()}
+    return {
+        "channel_match": min(share.values()),
+        "reference_channels_matched": share["reference"],
+        "channels_matched": share["other"],
+        "same_direction": same / total,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DEM conditioning (fill, D8, accumulation) on synthetic DEMs.")
+    parser.add_argument("--sizes", default="1024,2048,4096", help="comma-separated DEM sizes in pixels per side")
+    parser.add_argument("--methods", default=",".join(METHODS), help="comma-separated methods; the first is the reference")
+    parser.add_argument("--noise", type=float, default=1.0, help="DEM noise in metres (creates single-cell pits)")
+    parser.add_argument("--tile-size", type=int, default=1024, help="tile side for priority_flood_tiled")
+    parser.add_argument("--channel-cells", type=float, default=1000, help="accumulation that makes a channel cell")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per method; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic DEM seed")
+    parser.add_argument("--data-dir", default="./benchmark_data", help="where DEMs and outputs are written")
+    parser.add_argument("--output", default=None, help="results JSON (default: flow_routing_<timestamp>.json)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    methods = [m for m in args.methods.split(",") if m]
+    unknown = set(methods) - set(METHODS)
+    if unknown:
+        parser.error(f"unknown methods: {', '.join(sorted(unknown))}")
+
+    results = []
+    for size in sizes:
+        print(f"Preparing {size}x{size} DEM...")
+        dem_path = make_dem(args.data_dir, size, args.seed, args.noise)
+        reference = None
+        for method in methods:
+            result = run_case(method, size, dem_path, args.data_dir, args.channel_cells, args.tile_size, args.repeat)
+            results.append(result)
+            if "error" in result:
+                print(f"  {method:<22} {size:>6}  FAILED ({result['error']})")
+                continue
+            if reference is None:
+                reference = result
+            else:
+                result.update(agreement(reference["output"], result["output"]), reference=reference["method"])
+            match = f"  channels matched {result['channel_match']:.3f}, same D8 {result['same_direction']:.3f}" \
+                if "channel_match" in result else ""
+            print(
+                f"  {method:<22} {size:>6}  {result['seconds']:9.3f} s  "
+                f"{result['megapixels_per_second']:7.2f} Mpx/s  "
+                f"peak {result['peak_rss_bytes'] / 2**20:8.1f} MiB (+{result['peak_rss_delta_bytes'] / 2**20:.1f}){match}"
+            )
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "seed": args.seed,
+        "noise": args.noise,
+        "tile_size": args.tile_size,
+        "channel_cells": args.channel_cells,
+        "repeat": args.repeat,
+        "environment": environment(),
+        "results": results,
+    }
+    output = args.output or f"flow_routing_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
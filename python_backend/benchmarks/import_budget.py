@@ -0,0 +1,87 @@
+# Import-time regression check for the API process. Imports a module in a fresh
+# interpreter and fails (exit code 1) when it is over the time / memory budget or
+# when it pulls in the geospatial stack, which must only load on first use. Celery
+# workers load that stack up front (pre-warmed before the first task), so app.worker
+# has its own, larger budget and may import it.
+#
+#   python -m benchmarks.import_budget
+#   python -m benchmarks.import_budget --module app.worker
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules the API must not import at startup
+HEAVY_MODULES = ["rasterio", "pysheds", "numba", "scipy", "geopandas", "pandas", "pyproj", "shapely", "geopy", "numpy"]
+
+# Default budgets per module (import seconds, peak RSS MiB, heavy modules allowed); others use app.main's
+BUDGETS = {
+    "app.main": (1.5, 150.0, False),
+    "app.worker": (3.0, 224.0, True),
+}
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "seconds": seconds,
+    "peak_rss_bytes": peak if sys.platform == "darwin" else peak * 1024,
+    "heavy_modules": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+def measure(module: str, repeat: int) -> dict:
+    """
+    Best-of-`repeat` cold import of `module`, each in a new interpreter.
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=backend_dir + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=backend_dir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    best = min(runs, key=lambda r: r["seconds"])
+    return dict(best, module=module, peak_rss_bytes=min(r["peak_rss_bytes"] for r in runs))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time and memory of the API entry point.")
+    parser.add_argument("--module", default="app.main", help="module to import")
+    parser.add_argument("--max-seconds", type=float, default=None, help="import time budget (default: per module)")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="peak RSS budget after import (default: per module)")
+    parser.add_argument("--allow-heavy", action="store_true", help="do not fail on geospatial imports")
+    parser.add_argument("--repeat", type=int, default=3, help="cold imports; the fastest is reported")
+    args = parser.parse_args()
+    max_seconds, max_rss_mb, allow_heavy = BUDGETS.get(args.module, BUDGETS["app.main"])
+    if args.max_seconds is not None:
+        max_seconds = args.max_seconds
+    if args.max_rss_mb is not None:
+        max_rss_mb = args.max_rss_mb
+    allow_heavy = allow_heavy or args.allow_heavy
+
+    result = measure(args.module, args.repeat)
+    print(
+        f"{result['module']}: {result['seconds'] * 1000:.0f} ms, "
+        f"peak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB, "
+        f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}"
+    )
+
+    failures = []
+    if result["seconds"] > max_seconds:
+        failures.append(f"import took {result['seconds']:.2f} s (budget {max_seconds:.2f} s)")
+    if result["peak_rss_bytes"] > max_rss_mb * 2**20:
+        failures.append(f"peak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB (budget {max_rss_mb:.0f} MiB)")
+    if result["heavy_modules"] and not allow_heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(result['heavy_modules'])}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
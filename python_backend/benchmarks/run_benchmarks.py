@@ -0,0 +1,222 @@
+# Raster pipeline benchmarks on synthetic scenes. Each function runs in a fresh
+# process; wall time (best of --repeat), throughput and peak RSS go to a JSON file
+# that a later run can use as --baseline (exit code 1 when a regression is flagged).
+#
+#   python -m benchmarks.run_benchmarks --sizes 512,2048,8192 --output before.json
+#   python -m benchmarks.run_benchmarks --sizes 512,2048,8192 --baseline before.json
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.metrics import _peak_rss_bytes
+from app.services import image_processing, gis_analysis, spectral_indices
+from benchmarks.synthetic import make_scene
+
+FUNCTIONS = ["calculate_ndwi", "compute_indices", "detect_change", "calculate_lake_area", "calculate_volume_change", "generate_flow_path"]
+
+def _call(function: str, scene: dict, inputs: dict, out_dir: str):
+    paths = scene["paths"]
+    if function == "calculate_ndwi":
+        image_processing.calculate_ndwi(paths["image_1"], os.path.join(out_dir, "bench_ndwi.tif"))
+    elif function == "compute_indices":
+        # NDWI + NDVI + blue/green ratio from one read of the four bands; compare with calculate_ndwi
+        spectral_indices.compute_indices(
+            paths["image_1"], os.path.join(out_dir, "bench_indices.tif"),
+            dict(spectral_indices.resolve(["ndwi", "ndvi"]), blue_green="blue / green")
+        )
+    elif function == "detect_change":
+        image_processing.detect_change(inputs["ndwi_1"], inputs["ndwi_2"], os.path.join(out_dir, "bench_change.tif"))
+    elif function == "calculate_lake_area":
+        image_processing.calculate_lake_area(inputs["ndwi_1"])
+    elif function == "calculate_volume_change":
+        gis_analysis.calculate_volume_change(paths["dem"], inputs["change"])
+    elif function == "generate_flow_path":
+        gis_analysis.generate_flow_path(
+            paths["dem"], scene["source"]["lat"], scene["source"]["lon"], os.path.join(out_dir, "bench_flow.geojson")
+        )
+    else:
+        raise ValueError(f"Unknown benchmark function: {function}")
+
+def _reset_peak_rss() -> int:
+    """
+    Reset the kernel's peak-RSS mark (Linux >= 4.0) so the import spike of a fresh
+    process does not hide the function's own peak. Returns the current RSS in bytes.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return _peak_rss_bytes()
+
+def _current_peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return _peak_rss_bytes()
+
+def _run_case(function: str, scene: dict, inputs: dict, out_dir: str, repeat: int, queue):
+    """
+    Runs in a fresh process so that peak RSS belongs to this function alone.
+    """
+    baseline = _reset_peak_rss()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _call(function, scene, inputs, out_dir)
+        timings.append(time.perf_counter() - start)
+    peak = _current_peak_rss()
+    queue.put({"timings": timings, "peak_rss_bytes": peak, "peak_rss_delta_bytes": peak - baseline})
+
+def run_case(function: str, scene: dict, inputs: dict, out_dir: str, repeat: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case, args=(function, scene, inputs, out_dir, repeat, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return {"function": function, "size": scene["size"], "error": f"exit code {process.exitcode}"}
+    measured = queue.get()
+    pixels = scene["size"] ** 2
+    seconds = min(measured["timings"])
+    return {
+        "function": function,
+        "size": scene["size"],
+        "pixels": pixels,
+        "seconds": seconds,
+        "seconds_median": statistics.median(measured["timings"]),
+        "megapixels_per_second": pixels / 1e6 / seconds if seconds > 0 else None,
+        "peak_rss_bytes": measured["peak_rss_bytes"],
+        "peak_rss_delta_bytes": measured["peak_rss_delta_bytes"],
+    }
+
+def prepare_inputs(scene: dict, out_dir: str) -> dict:
+    """
+    NDWI and change rasters that the downstream functions take as input (computed once per scene).
+    """
+    size = scene["size"]
+    inputs = {
+        "ndwi_1": os.path.join(out_dir, f"ndwi_{size}_1.tif"),
+        "ndwi_2": os.path.join(out_dir, f"ndwi_{size}_2.tif"),
+        "change": os.path.join(out_dir, f"change_{size}.tif"),
+    }
+    scene_mtime = os.path.getmtime(scene["paths"]["image_2"])
+    if all(os.path.exists(p) and os.path.getmtime(p) >= scene_mtime for p in inputs.values()):
+        return inputs
+    image_processing.calculate_ndwi(scene["paths"]["image_1"], inputs["ndwi_1"])
+    image_processing.calculate_ndwi(scene["paths"]["image_2"], inputs["ndwi_2"])
+    image_processing.detect_change(inputs["ndwi_1"], inputs["ndwi_2"], inputs["change"])
+    return inputs
+
+def compare(results: list, baseline: dict, tolerance: float, min_seconds: float = 0.01) -> list:
+    """
+    Regressions against a previous results file: slower or more memory than the
+    baseline by more than `tolerance` (a fraction) for the same function and size.
+    """
+    previous = {(r["function"], r["size"]): r for r in baseline.get("results", []) if "error" not in r}
+    regressions = []
+    for result in results:
+        base = previous.get((result["function"], result["size"]))
+        if base is None or "error" in result:
+            continue
+        for key in ("seconds", "peak_rss_delta_bytes"):
+            if key == "seconds" and base[key] < min_seconds:
+                continue
+            if base[key] > 0 and result[key] > base[key] * (1.0 + tolerance):
+                regressions.append({
+                    "function": result["function"],
+                    "size": result["size"],
+                    "metric": key,
+                    "baseline": base[key],
+                    "current": result[key],
+                    "ratio": result[key] / base[key],
+                })
+    return regressions
+
+def environment() -> dict:
+    import numpy
+    import rasterio
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "rasterio": rasterio.__version__,
+        "gdal": rasterio.__gdal_version__,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raster pipeline on synthetic glacial valley scenes.")
+    parser.add_argument("--sizes", default="512,2048,4096",
+                        help="comma-separated scene sizes in pixels per side (up to 20000; "
+                             "generate_flow_path needs tens of GB of RAM at that size)")
+    parser.add_argument("--functions", default=",".join(FUNCTIONS), help="comma-separated functions to benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per function; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic scene seed")
+    parser.add_argument("--data-dir", default="./benchmark_data", help="where scenes and intermediates are cached")
+    parser.add_argument("--output", default=None, help="results JSON (default: benchmark_<timestamp>.json)")
+    parser.add_argument("--baseline", default=None, help="previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown / memory growth before flagging a regression (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    functions = [f for f in args.functions.split(",") if f]
+    unknown = set(functions) - set(FUNCTIONS)
+    if unknown:
+        parser.error(f"unknown functions: {', '.join(sorted(unknown))}")
+
+    results = []
+    for size in sizes:
+        print(f"Preparing {size}x{size} scene...")
+        scene = make_scene(args.data_dir, size, args.seed)
+        inputs = prepare_inputs(scene, args.data_dir)
+        for function in functions:
+            result = run_case(function, scene, inputs, args.data_dir, args.repeat)
+            results.append(result)
+            if "error" in result:
+                print(f"  {function:<26} {size:>6}  FAILED ({result['error']})")
+            else:
+                print(
+                    f"  {function:<26} {size:>6}  {result['seconds']:9.3f} s  "
+                    f"{result['megapixels_per_second']:9.1f} Mpx/s  "
+                    f"peak {result['peak_rss_bytes'] / 2**20:8.1f} MiB (+{result['peak_rss_delta_bytes'] / 2**20:.1f})"
+                )
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "environment": environment(),
+        "results": results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report["baseline"] = args.baseline
+        report["regressions"] = regressions
+        for r in regressions:
+            print(f"REGRESSION {r['function']} {r['size']}: {r['metric']} {r['baseline']:.4g} -> {r['current']:.4g} (x{r['ratio']:.2f})")
+        exit_code = 1 if regressions else 0
+
+    output = args.output or f"benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
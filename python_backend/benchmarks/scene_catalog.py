@@ -0,0 +1,127 @@
+# Imagery catalog benchmark: synthetic scene footprints scattered over a mountain range
+# (satellite, drone and DEM, ten years of capture dates) in a temporary sqlite database,
+# then the index build and the latency of app.services.scene_catalog queries (point,
+# bbox + date range, best DEM, newest per tile) against a SQL bounds/date filter on the
+# same table.
+#
+#   python -m benchmarks.scene_catalog --scenes 300000 --queries 200
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import shapely
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from app.db.base import Base
+from app.models.analysis import ImageMetadata, SceneFootprint
+from app.services import scene_catalog
+
+REGION = (70.0, 26.0, 100.0, 40.0) # west, south, east, north
+START = datetime(2015, 1, 1)
+DAYS = 3650
+TYPES = [("satellite", 0.8, 0.5, 10.0), ("drone", 0.15, 0.02, 0.1), ("dem", 0.05, 1.0, 30.0)] # type, share, size (deg), resolution (m)
+
+def make_database(url: str, scenes: int, seed: int = 0):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    images, footprints = [], []
+    for i in range(1, scenes + 1):
+        image_type, _, size, resolution = rng.choices(TYPES, weights=[t[1] for t in TYPES])[0]
+        west = rng.uniform(REGION[0], REGION[2] - size)
+        south = rng.uniform(REGION[1], REGION[3] - size)
+        date = START + timedelta(days=rng.uniform(0, DAYS))
+        images.append({"id": i, "filename": f"scene_{i}.tif", "file_path": f"./uploads/scene_{i}.tif",
+                       "capture_date": date, "image_type": image_type})
+        footprints.append({"image_id": i, "image_type": image_type, "capture_date": date, "crs": "EPSG:4326",
+                           "min_x": west, "min_y": south, "max_x": west + size, "max_y": south + size,
+                           "west": west, "south": south, "east": west + size, "north": south + size,
+                           "resolution_m": resolution})
+    with engine.begin() as conn:
+        conn.execute(insert(ImageMetadata), images)
+        conn.execute(insert(SceneFootprint), footprints)
+    return engine
+
+def sql_search(db, area, start, end, limit: int = 100):
+    """
+    The same search as a SQL filter on the footprint bounds and capture date.
+    """
+    west, south, east, north = area.bounds
+    query = db.query(SceneFootprint.image_id).filter(
+        SceneFootprint.west <= east, SceneFootprint.east >= west,
+        SceneFootprint.south <= north, SceneFootprint.north >= south,
+    )
+    if start is not None:
+        query = query.filter(SceneFootprint.capture_date >= start, SceneFootprint.capture_date <= end)
+    return query.order_by(SceneFootprint.capture_date.desc()).limit(limit).all()
+
+def _areas(rng: random.Random, count: int):
+    for _ in range(count):
+        lon, lat = rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3])
+        size = rng.uniform(0.05, 0.5)
+        start = START + timedelta(days=rng.uniform(0, DAYS - 180))
+        yield shapely.Point(lon, lat), shapely.box(lon, lat, lon + size, lat + size), start, start + timedelta(days=180)
+
+def _percentiles(timings) -> dict:
+    ms = np.asarray(timings) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark imagery catalog queries on synthetic scene footprints.")
+    parser.add_argument("--scenes", type=int, default=300000, help="footprints in the benchmark database")
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic catalog seed")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Preparing {args.scenes} footprints...")
+        engine = make_database(f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}", args.scenes, args.seed)
+        db = sessionmaker(bind=engine)()
+        try:
+            start = time.perf_counter()
+            scene_catalog.invalidate()
+            index = scene_catalog.current_index(db)
+            build_seconds = time.perf_counter() - start
+
+            kinds = {
+                "point": lambda point, box, t0, t1: scene_catalog.search(db, point),
+                "bbox_date": lambda point, box, t0, t1: scene_catalog.search(db, box, t0, t1),
+                "best_dem": lambda point, box, t0, t1: scene_catalog.best_dem(db, box),
+                "newest_per_tile": lambda point, box, t0, t1: scene_catalog.newest_per_tile(db, box, t0, t1, "satellite"),
+                "sql_point": lambda point, box, t0, t1: sql_search(db, point, None, None),
+                "sql_bbox_date": lambda point, box, t0, t1: sql_search(db, box, t0, t1),
+            }
+            results = {}
+            for name, query in kinds.items():
+                timings, returned = [], 0
+                for area in _areas(random.Random(args.seed + 1), args.queries):
+                    started = time.perf_counter()
+                    rows = query(*area)
+                    timings.append(time.perf_counter() - started)
+                    returned += 1 if isinstance(rows, dict) else len(rows or [])
+                results[name] = dict(_percentiles(timings), mean_rows=returned / args.queries)
+        finally:
+            db.close()
+            engine.dispose()
+
+    print(f"index build: {build_seconds:.2f} s for {len(index)} footprints")
+    print(f"{'query':<18} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'rows':>7}")
+    for name, result in results.items():
+        print(f"{name:<18} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} {result['mean_rows']:>7.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scenes": args.scenes, "index_build_seconds": build_seconds, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
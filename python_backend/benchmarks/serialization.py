@@ -0,0 +1,140 @@
+# Serialization benchmark for the analysis list endpoints: rows per second for the
+# previous paths (ORM objects -> pydantic from_attributes -> JSON, as serialized by the
+# pinned and by current FastAPI) and the projected path (column rows -> dicts -> orjson),
+# plus gzip sizes.
+#
+#   python -m benchmarks.serialization --rows 10000
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from app.api import serialization
+from app.db.base import Base
+from app.models.analysis import AnalysisEstimate, AnalysisResult
+from app.schemas.analysis import AnalysisResult as AnalysisResultSchema
+
+def make_database(url: str, rows: int, estimates: float, seed: int = 0):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(AnalysisResult), [
+            {
+                "date_1": start + timedelta(days=i % 365),
+                "date_2": start + timedelta(days=i % 365 + 30),
+                "ndwi_path_1": f"./artifacts/scenes/{i:016x}/ndwi.tif",
+                "ndwi_path_2": f"./artifacts/scenes/{i + 1:016x}/ndwi.tif",
+                "change_detection_path": f"./artifacts/analyses/{i}/change.npz",
+                "risk_map_path": f"./artifacts/analyses/{i}/risk_map.json",
+                "lake_area_1": rng.uniform(1e4, 1e6),
+                "lake_area_2": rng.uniform(1e4, 1e6),
+                "volume_change": rng.uniform(0, 2e6),
+                "risk_level": rng.choice(["Low", "Medium", "High", "Critical"]),
+                "created_at": start + timedelta(minutes=i),
+            }
+            for i in range(rows)
+        ])
+        estimate_rows = [
+            {"analysis_id": i + 1, "overview_factor": 8.0, "volume_change": rng.uniform(0, 2e6),
+             "volume_change_error": rng.uniform(0, 1e5), "seconds": 0.01}
+            for i in range(rows) if rng.random() < estimates
+        ]
+        if estimate_rows:
+            conn.execute(insert(AnalysisEstimate), estimate_rows)
+    return engine
+
+def _orm_objects(db):
+    return db.query(AnalysisResult).order_by(AnalysisResult.created_at.desc()).all()
+
+def orm_dump_json(db) -> bytes:
+    """
+    Previous endpoint path on current FastAPI: full ORM objects, from_attributes
+    validation, then pydantic's JSON serializer (response_model fast path).
+    """
+    adapter = TypeAdapter(List[AnalysisResultSchema])
+    return adapter.dump_json(adapter.validate_python(_orm_objects(db), from_attributes=True))
+
+def orm_jsonable_encoder(db) -> bytes:
+    """
+    Previous endpoint path on the pinned FastAPI (0.128): validation, dump to Python,
+    jsonable_encoder and json.dumps.
+    """
+    adapter = TypeAdapter(List[AnalysisResultSchema])
+    content = jsonable_encoder(adapter.dump_python(adapter.validate_python(_orm_objects(db), from_attributes=True), mode="json"))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def projected_path(db) -> bytes:
+    query = serialization.analysis_list_query().order_by(AnalysisResult.created_at.desc())
+    return serialization.FastJSONResponse(serialization.analysis_rows(db, query)).body
+
+def measure(session_factory, function, repeat: int):
+    timings, body = [], b""
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            start = time.perf_counter()
+            body = function(db)
+            timings.append(time.perf_counter() - start)
+        finally:
+            db.close()
+    return min(timings), body
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list-endpoint serialization (ORM + pydantic vs projection + orjson).")
+    parser.add_argument("--rows", type=int, default=10000, help="analyses in the benchmark database")
+    parser.add_argument("--estimates", type=float, default=0.0,
+                        help="fraction of analyses with a quick-look estimate (the ORM path does not load them, "
+                             "so outputs only match at 0)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path; the fastest is reported")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_database(f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}", args.rows, args.estimates)
+        session_factory = sessionmaker(bind=engine)
+        results = {}
+        paths = [("orm_jsonable_encoder", orm_jsonable_encoder), ("orm_dump_json", orm_dump_json),
+                 ("projection_orjson", projected_path)]
+        for name, function in paths:
+            seconds, body = measure(session_factory, function, args.repeat)
+            results[name] = {
+                "seconds": seconds,
+                "rows_per_second": args.rows / seconds if seconds > 0 else 0.0,
+                "bytes": len(body),
+                "gzip_bytes": len(gzip.compress(body, compresslevel=5)),
+                "body": body,
+            }
+        engine.dispose()
+
+    expected = json.loads(results["orm_dump_json"].pop("body"))
+    same = all(json.loads(result.pop("body")) == expected for result in results.values() if "body" in result)
+    print(f"{'path':<22} {'rows/s':>10} {'ms':>8} {'bytes':>10} {'gzip':>9}")
+    for name, result in results.items():
+        print(f"{name:<22} {result['rows_per_second']:>10.0f} {result['seconds'] * 1000:>8.1f} "
+              f"{result['bytes']:>10} {result['gzip_bytes']:>9}")
+    fastest = results["projection_orjson"]["seconds"]
+    speedup = {name: result["seconds"] / fastest for name, result in results.items() if fastest > 0}
+    print(", ".join(f"{speedup[name]:.1f}x vs {name}" for name, _ in paths[:-1]) + f"; identical output: {same}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": args.rows, "identical": same, "speedup": speedup, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    sys.exit(0 if same else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+# Synthetic glacial valley: a sinuous valley draining south, moraine-dammed lakes on
+# the valley floor and snow on the high ground. Everything is an analytic function of
+# (seed, size), so scenes are reproducible and can be written strip by strip
+# (a 20000 x 20000 scene never has to fit in memory).
+
+PIXEL_SIZE = 0.0003 # degrees, ~30 m
+ORIGIN = (85.0, 28.5) # lon, lat of the top-left corner
+STRIP_ROWS = 256
+NOISE_WAVES = 24
+
+# Band order of the synthetic scenes: Blue, Green, Red, NIR (Green=2, NIR=4, the pipeline defaults)
+WATER = (900, 1500, 700, 300)
+LAND = (600, 700, 900, 2200)
+SNOW = (3600, 3800, 3700, 3300)
+
+def _valley(seed: int, size: int) -> dict:
+    rng = np.random.default_rng(seed)
+    n_lakes = int(np.clip(3 + size // 2048, 3, 12))
+    lake_v = np.sort(rng.uniform(0.12, 0.88, n_lakes))
+    return {
+        "meander_amplitude": rng.uniform(0.08, 0.15),
+        "meander_phase": rng.uniform(0, 2 * np.pi),
+        "wave_freq": rng.uniform(2.0, 40.0, (NOISE_WAVES, 2)) * rng.choice([-1, 1], (NOISE_WAVES, 2)),
+        "wave_phase": rng.uniform(0, 2 * np.pi, NOISE_WAVES),
+        "wave_amp": 60.0 / (1.0 + np.arange(NOISE_WAVES)),
+        "lake_v": lake_v,
+        "lake_rx": rng.uniform(0.015, 0.04, n_lakes),
+        "lake_ry": rng.uniform(0.02, 0.05, n_lakes),
+        "lake_depth": rng.uniform(15.0, 60.0, n_lakes),
+        # Second epoch: lakes grow by this factor in radius
+        "lake_growth": rng.uniform(1.05, 1.25, n_lakes),
+    }
+
+def _thalweg(valley: dict, v):
+    return 0.5 + valley["meander_amplitude"] * np.sin(3 * np.pi * v + valley["meander_phase"])
+
+def _strip(valley: dict, size: int, row0: int, rows: int):
+    """
+    Elevation (float32) and per-epoch lake membership (0 = dry, 1 = lake in epoch 1,
+    2 = lake only in epoch 2) for rows [row0, row0 + rows).
+    """
+    v = ((np.arange(row0, row0 + rows) + 0.5) / size)[:, None]
+    u = ((np.arange(size) + 0.5) / size)[None, :]
+    centre = _thalweg(valley, v)
+
+    elevation = 5600.0 - 1800.0 * v + 2600.0 * np.abs(u - centre) ** 1.3
+    for (fu, fv), phase, amp in zip(valley["wave_freq"], valley["wave_phase"], valley["wave_amp"]):
+        elevation = elevation + amp * np.sin(2 * np.pi * (fu * u + fv * v) + phase)
+
+    lakes = np.zeros((rows, size), dtype=np.uint8)
+    for lv, rx, ry, depth, growth in zip(
+        valley["lake_v"], valley["lake_rx"], valley["lake_ry"], valley["lake_depth"], valley["lake_growth"]
+    ):
+        reach = ry * max(growth, 1.3) # lake, grown lake and moraine
+        if lv + reach < v[0, 0] or lv - reach > v[-1, 0]:
+            continue
+        level = 5600.0 - 1800.0 * lv
+        d = ((u - _thalweg(valley, lv)) / rx) ** 2 + ((v - lv) / ry) ** 2
+        basin = d < 1.0
+        elevation = np.where(basin, np.minimum(elevation, level - depth * (1.0 - d)), elevation)
+        # Terminal moraine just downstream of the lake
+        dam = (d >= 1.0) & (d < 1.6) & (v > lv)
+        elevation = np.where(dam, np.maximum(elevation, level + 20.0), elevation)
+        lakes[(d < growth ** 2) & (lakes == 0)] = 2
+        lakes[basin] = 1
+    return elevation.astype(np.float32), lakes
+
+def _profile(size: int, count: int, dtype, nodata=None) -> dict:
+    return {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": count,
+        "dtype": dtype,
+        "nodata": nodata,
+        "crs": "EPSG:4326",
+        "transform": from_origin(ORIGIN[0], ORIGIN[1], PIXEL_SIZE, PIXEL_SIZE),
+        "compress": "lzw",
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "BIGTIFF": "IF_SAFER",
+    }
+
+def _bands(lakes: np.ndarray, elevation: np.ndarray, epoch: int, rng) -> np.ndarray:
+    water = (lakes == 1) if epoch == 1 else (lakes > 0)
+    snow = elevation > 5900.0
+    out = np.empty((4,) + lakes.shape, dtype=np.uint16)
+    for band in range(4):
+        value = np.where(water, WATER[band], np.where(snow, SNOW[band], LAND[band])).astype(np.float32)
+        value += rng.normal(0.0, 60.0, lakes.shape).astype(np.float32)
+        out[band] = np.clip(value, 1, 10000).astype(np.uint16)
+    return out
+
+def make_scene(out_dir: str, size: int, seed: int = 0) -> dict:
+    """
+    Write a synthetic DEM and a two-epoch 4-band scene pair of `size` x `size` pixels
+    into `out_dir` (skipped when a scene with the same size and seed is already there).
+    Returns the paths plus a flow-path source point (lat/lon at the head of the valley).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "dem": os.path.join(out_dir, f"dem_{size}.tif"),
+        "image_1": os.path.join(out_dir, f"scene_{size}_1.tif"),
+        "image_2": os.path.join(out_dir, f"scene_{size}_2.tif"),
+    }
+    meta_path = os.path.join(out_dir, f"scene_{size}.json")
+    valley = _valley(seed, size)
+    source_v = 0.03
+    source_lon, source_lat = from_origin(ORIGIN[0], ORIGIN[1], PIXEL_SIZE, PIXEL_SIZE) * (
+        _thalweg(valley, source_v) * size, source_v * size
+    )
+    scene = {"size": size, "seed": seed, "paths": paths, "source": {"lat": float(source_lat), "lon": float(source_lon)}}
+
+    if os.path.exists(meta_path) and all(os.path.exists(p) for p in paths.values()):
+        with open(meta_path) as f:
+            if json.load(f) == scene:
+                return scene
+
+    with rasterio.open(paths["dem"], "w", **_profile(size, 1, "float32", nodata=-9999.0)) as dem, \
+            rasterio.open(paths["image_1"], "w", **_profile(size, 4, "uint16")) as img1, \
+            rasterio.open(paths["image_2"], "w", **_profile(size, 4, "uint16")) as img2:
+        for row0 in range(0, size, STRIP_ROWS):
+            rows = min(STRIP_ROWS, size - row0)
+            window = Window(0, row0, size, rows)
+            elevation, lakes = _strip(valley, size, row0, rows)
+            rng = np.random.default_rng([seed, row0])
+            dem.write(elevation, 1, window=window)
+            img1.write(_bands(lakes, elevation, 1, rng), window=window)
+            img2.write(_bands(lakes, elevation, 2, rng), window=window)
+
+    with open(meta_path, "w") as f:
+        json.dump(scene, f)
+    return scene
+
+def make_dem(out_dir: str, size: int, seed: int = 0, noise: float = 0.0) -> str:
+    """
+    Write only the synthetic DEM of make_scene, plus Gaussian noise of `noise` metres
+    (thousands of single-cell pits, like a real radar DEM), strip by strip.
+    Returns its path (skipped when it already exists).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"dem_{size}_{seed}_{noise:g}.tif")
+    if os.path.exists(path):
+        return path
+    valley = _valley(seed, size)
+    tmp_path = path + ".part"
+    with rasterio.open(tmp_path, "w", **_profile(size, 1, "float32", nodata=-9999.0)) as dem:
+        for row0 in range(0, size, STRIP_ROWS):
+            rows = min(STRIP_ROWS, size - row0)
+            elevation, _ = _strip(valley, size, row0, rows)
+            if noise > 0:
+                elevation += np.random.default_rng([seed, row0, 1]).normal(0.0, noise, elevation.shape).astype(np.float32)
+            dem.write(elevation, 1, window=Window(0, row0, size, rows))
+    os.replace(tmp_path, path)
+    return path
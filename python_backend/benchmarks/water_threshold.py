@@ -0,0 +1,75 @@
+# Water threshold check: NDWI histograms of synthetic scenes (snow, optionally dry land,
+# and a lake down to a few thousandths of the pixels) built with raster_stats.BandStats,
+# then the automatic threshold of raster_stats.otsu_threshold. A scene with a lake must
+# get a threshold between the snow and water modes (2 sigma off each mean); a scene with
+# a single mode within WATER_THRESHOLD_BOUNDS must get none (the fixed default is used).
+# Exits 1 when a case fails.
+#
+#   python -m benchmarks.water_threshold --pixels 2000000
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from app.core.config import settings
+from app.services import raster_stats
+
+SNOW = (0.05, 0.05)
+WATER = (0.5, 0.05)
+LAND = (-0.4, 0.1)
+WATER_FRACTIONS = [0.2, 0.05, 0.02, 0.01, 0.005, 0.002]
+
+def cases():
+    """
+    (name, [(mean, std, fraction), ...], expected (lo, hi) range of the threshold or None).
+    """
+    between = (SNOW[0] + 2 * SNOW[1], WATER[0] - 2 * WATER[1])
+    for fraction in WATER_FRACTIONS:
+        yield f"snow+water {fraction:g}", [SNOW + (1 - fraction,), WATER + (fraction,)], between
+        yield f"land+snow+water {fraction:g}", [LAND + (0.5,), SNOW + (0.5 - fraction,), WATER + (fraction,)], between
+    yield "snow+turbid lake 0.3", [SNOW + (0.7,), (0.22, 0.05, 0.3)], (0.1, 0.17)
+    yield "snow", [SNOW + (1.0,)], None
+    yield "water", [(0.5, 0.08, 1.0)], None
+    yield "land+snow", [LAND + (0.6,), SNOW + (0.4,)], None
+    yield "wide snow", [(0.1, 0.12, 1.0)], None
+
+def histogram(modes, pixels: int, rng) -> dict:
+    values = np.concatenate([rng.normal(mean, std, int(pixels * fraction)) for mean, std, fraction in modes])
+    stats = raster_stats.BandStats.for_dtype(np.float32, value_range=raster_stats.INDEX_RANGE)
+    stats.add(np.clip(values, -1, 1).astype(np.float32))
+    return stats.to_dict("ndwi")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check automatic NDWI water thresholds on synthetic histograms.")
+    parser.add_argument("--pixels", type=int, default=2000000, help="pixels per synthetic scene")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results, failed = [], 0
+    for name, modes, expected in cases():
+        band = histogram(modes, args.pixels, rng)
+        start = time.perf_counter()
+        threshold = raster_stats.otsu_threshold(band, settings.WATER_THRESHOLD_BOUNDS)
+        seconds = time.perf_counter() - start
+        ok = threshold is None if expected is None else threshold is not None and expected[0] <= threshold <= expected[1]
+        failed += not ok
+        results.append({"case": name, "threshold": threshold, "expected": expected, "ok": ok, "seconds": seconds})
+        shown = "none" if threshold is None else f"{threshold:.3f}"
+        wanted = "none" if expected is None else f"{expected[0]:.2f}..{expected[1]:.2f}"
+        print(f"{name:<26} {shown:>7}  expected {wanted:<11} {seconds * 1000:6.2f} ms  {'ok' if ok else 'FAIL'}")
+
+    print(f"{len(results) - failed}/{len(results)} cases passed")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"pixels": args.pixels, "seed": args.seed, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import itertools
+import json
+import math
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Closed-loop load generator: `concurrency` threads each send requests back to back
+# for `duration` seconds per endpoint. Seed users first with
+#   python seed_users.py --users 1000 --analyses 10000
+# then point this at a running server (python run.py).
+
+ENDPOINTS = ["login", "me", "analyses", "dashboard"]
+LOADTEST_EMAIL = "loadtest_{}@example.com"
+
+def _request(url: str, data: bytes = None, token: str = None, timeout: float = 30.0):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    if data is not None:
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+    request = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, response.read()
+
+def login(base_url: str, username: str, password: str) -> str:
+    data = urllib.parse.urlencode({"username": username, "password": password}).encode()
+    _, body = _request(f"{base_url}/auth/login/access-token", data=data)
+    return json.loads(body)["access_token"]
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def run_endpoint(name: str, base_url: str, users: list, tokens: list, password: str,
+                 concurrency: int, duration: float, analysis_limit: int) -> dict:
+    user_cycle = itertools.cycle(users)
+    token_cycle = itertools.cycle(tokens)
+    cycle_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def one_request():
+        with cycle_lock:
+            user, token = next(user_cycle), next(token_cycle)
+        if name == "login":
+            data = urllib.parse.urlencode({"username": user, "password": password}).encode()
+            return _request(f"{base_url}/auth/login/access-token", data=data)
+        if name == "me":
+            return _request(f"{base_url}/auth/me", token=token)
+        if name == "analyses":
+            return _request(f"{base_url}/analysis/?limit={analysis_limit}", token=token)
+        if name == "dashboard":
+            return _request(f"{base_url}/dashboard/stats", token=token)
+        raise ValueError(f"Unknown endpoint: {name}")
+
+    def worker():
+        latencies, errors, response_bytes = [], 0, 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                _, body = one_request()
+                response_bytes += len(body)
+            except (urllib.error.URLError, OSError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors, response_bytes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda _: worker(), range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(itertools.chain.from_iterable(o[0] for o in outcomes))
+    return {
+        "endpoint": name,
+        "concurrency": concurrency,
+        "duration_seconds": elapsed,
+        "requests": len(latencies),
+        "errors": sum(o[1] for o in outcomes),
+        "requests_per_second": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "mean_response_bytes": sum(o[2] for o in outcomes) / len(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the GlacierWatch API with seeded users.")
+    parser.add_argument("--base-url", default="http://localhost:8001/api/v1", help="API base URL")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help=f"comma-separated endpoints to drive ({', '.join(ENDPOINTS)})")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per endpoint")
+    parser.add_argument("--users", type=int, default=50, help="seeded load-test users to rotate through")
+    parser.add_argument("--password", default="loadtest", help="password of the seeded load-test users")
+    parser.add_argument("--analysis-limit", type=int, default=100, help="?limit= for /analysis/")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    users = [LOADTEST_EMAIL.format(i) for i in range(args.users)]
+    print(f"Logging in {len(users)} users...")
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        tokens = list(pool.map(lambda user: login(args.base_url, user, args.password), users))
+
+    results = []
+    print(f"{'endpoint':<10} {'req':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name in endpoints:
+        result = run_endpoint(
+            name, args.base_url, users, tokens, args.password,
+            args.concurrency, args.duration, args.analysis_limit
+        )
+        results.append(result)
+        print(
+            f"{name:<10} {result['requests']:>7} {result['errors']:>5} {result['requests_per_second']:>8.1f} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"base_url": args.base_url, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
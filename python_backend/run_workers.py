@@ -0,0 +1,70 @@
+import argparse
+import os
+import subprocess
+import sys
+
+def parse_pools(spec: str) -> dict:
+    """
+    "raster=4:1,alerts=2" -> {"raster": (4, 1), "alerts": (2, None)}: processes and prefetch per queue.
+    """
+    pools = {}
+    for item in filter(None, spec.split(",")):
+        queue, _, sizes = item.partition("=")
+        concurrency, _, prefetch = sizes.partition(":")
+        pools[queue.strip()] = (int(concurrency), int(prefetch) if prefetch else None)
+    return pools
+
+def main():
+    parser = argparse.ArgumentParser(description="Start local Celery worker pools (one per queue) sharing a broker.")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the raster queue (shorthand)")
+    parser.add_argument("--pools", default="",
+                        help="per-queue overrides, e.g. raster=4:1,flow=1:1,alerts=2:4 (processes:prefetch)")
+    parser.add_argument("--queues", default=None, help="only start pools for these comma-separated queues")
+    parser.add_argument("--pool-impl", choices=["prefork", "solo"], default=None,
+                        help="prefork: one Celery process per queue with N children; solo: N separate processes "
+                             "(default: solo on Windows or with the polling filesystem broker, else prefork)")
+    parser.add_argument("--broker", default=os.getenv("CELERY_BROKER_URL", "filesystem://"),
+                        help="broker URL (filesystem:// or redis://localhost:6379/0)")
+    args = parser.parse_args()
+    if args.pool_impl is None:
+        args.pool_impl = "solo" if os.name == "nt" or args.broker.startswith("filesystem://") else "prefork"
+
+    env = dict(os.environ, CELERY_BROKER_URL=args.broker, CELERY_TASK_ALWAYS_EAGER="false")
+    os.environ.update(env)
+    from app.core.celery_app import WORKER_POOLS
+
+    pools = dict(WORKER_POOLS)
+    if args.workers is not None:
+        pools["raster"] = (args.workers, pools["raster"][1])
+    for queue, (concurrency, prefetch) in parse_pools(args.pools).items():
+        pools[queue] = (concurrency, prefetch if prefetch is not None else pools.get(queue, (1, 1))[1])
+    if args.queues:
+        pools = {queue: pools[queue] for queue in args.queues.split(",")}
+
+    processes = []
+    for queue, (concurrency, prefetch) in pools.items():
+        if concurrency <= 0:
+            continue
+        if args.pool_impl == "prefork":
+            instances = [(f"{queue}@%h", ["--pool=prefork", f"--concurrency={concurrency}"])]
+        else:
+            instances = [(f"{queue}{i}@%h", ["--pool=solo"]) for i in range(concurrency)]
+        for hostname, pool_args in instances:
+            cmd = [
+                sys.executable, "-m", "celery", "-A", "app.core.celery_app", "worker",
+                "--loglevel=info", f"--queues={queue}", f"--prefetch-multiplier={prefetch}",
+                f"--hostname={hostname}"
+            ] + pool_args
+            print(f"Starting {hostname}: {' '.join(cmd)}")
+            processes.append(subprocess.Popen(cmd, env=env))
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        print("\nStopping workers...")
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
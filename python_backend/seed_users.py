@@ -1,18 +1,25 @@
+import argparse
+import random
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
 # Add the current directory to sys.path to make imports work
 sys.path.append(os.getcwd())
 
-from app.db.session import SessionLocal, engine
-from app.db.base import Base
+from sqlalchemy import insert
+from app.db.session import SessionLocal
+from app.db.init_db import create_schema
 from app.models.user import User
+from app.models.analysis import AnalysisResult, RiskZone
+from app.services.risk_assessment import RISK_LEVELS
 from app.core.config import settings
 from app.core import security
 
 def init_db():
     # Create tables
-    Base.metadata.create_all(bind=engine)
+    create_schema()
     
     db = SessionLocal()
     try:
@@ -42,15 +49,139 @@ def init_db():
 
         # List all users
         print("\nExisting Users:")
-        users = db.query(User).all()
+        users = db.query(User).order_by(User.id).limit(20).all()
         for u in users:
             print(f"- {u.email} (Role: {'Admin' if u.is_superuser else 'User'})")
+        total = db.query(User).count()
+        if total > len(users):
+            print(f"... and {total - len(users)} more")
             
     except Exception as e:
         print(f"Error: {e}")
     finally:
         db.close()
 
+# Settlements downstream of glacial lakes; synthetic users cluster around them
+SETTLEMENTS = [
+    (27.98, 86.83), (27.80, 86.71), (28.21, 83.99), (28.60, 83.93), (27.72, 85.32),
+    (30.73, 79.07), (30.40, 79.33), (32.24, 77.19), (34.15, 77.58), (27.33, 88.61),
+]
+LOADTEST_EMAIL = "loadtest_{}@example.com"
+BATCH_SIZE = 5000
+
+def _hash_passwords(password: str, count: int, workers: int, reuse_hash: bool) -> list:
+    """
+    bcrypt is deliberately slow (~0.2 s per hash), so hashes are computed in a process pool.
+    """
+    if reuse_hash:
+        return [security.get_password_hash(password)] * count
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(security.get_password_hash, [password] * count, chunksize=max(1, count // (workers * 8))))
+
+def seed_users(db, count: int, password: str, workers: int, reuse_hash: bool, rng: random.Random) -> int:
+    """
+    Bulk-insert `count` load-test users spread around SETTLEMENTS (80%) and across the
+    Himalaya (20%). Numbering continues after existing load-test users, so re-running adds more.
+    """
+    start = db.query(User).filter(User.email.like(LOADTEST_EMAIL.format("%"))).count()
+    hashes = _hash_passwords(password, count, workers, reuse_hash)
+    rows = []
+    for i, hashed in enumerate(hashes, start=start):
+        if rng.random() < 0.8:
+            lat, lon = rng.choice(SETTLEMENTS)
+            lat, lon = rng.gauss(lat, 0.15), rng.gauss(lon, 0.15)
+        else:
+            lat, lon = rng.uniform(27.0, 35.0), rng.uniform(74.0, 95.0)
+        rows.append({
+            "email": LOADTEST_EMAIL.format(i),
+            "full_name": f"Load Test {i}",
+            "phone": f"9{i:09d}",
+            "hashed_password": hashed,
+            "is_active": True,
+            "is_superuser": False,
+            "latitude": lat,
+            "longitude": lon,
+        })
+    for offset in range(0, len(rows), BATCH_SIZE):
+        db.execute(insert(User), rows[offset:offset + BATCH_SIZE])
+    db.commit()
+    return len(rows)
+
+def _zone_polygon(rng: random.Random) -> dict:
+    lat, lon = rng.choice(SETTLEMENTS)
+    lat, lon = lat + rng.uniform(-0.5, 0.5), lon + rng.uniform(-0.5, 0.5)
+    size = rng.uniform(0.002, 0.02)
+    return {
+        "type": "Polygon",
+        "coordinates": [[
+            (lon, lat), (lon + size, lat), (lon + size, lat + size), (lon, lat + size), (lon, lat)
+        ]],
+    }
+
+def seed_analyses(db, count: int, zones_per_analysis: int, rng: random.Random) -> int:
+    """
+    Bulk-insert `count` analysis results with `zones_per_analysis` risk zones each.
+    """
+    now = datetime.utcnow()
+    created = 0
+    for offset in range(0, count, BATCH_SIZE):
+        rows = []
+        for _ in range(min(BATCH_SIZE, count - offset)):
+            date_2 = now - timedelta(days=rng.uniform(0, 3650))
+            area_1 = rng.uniform(1e4, 5e6)
+            area_2 = area_1 * rng.uniform(0.95, 1.4)
+            rows.append({
+                "date_1": date_2 - timedelta(days=rng.choice([30, 90, 365])),
+                "date_2": date_2,
+                "lake_area_1": area_1,
+                "lake_area_2": area_2,
+                "volume_change": max(area_2 - area_1, 0.0) * 5.0,
+                "risk_level": rng.choice(RISK_LEVELS),
+                "created_at": date_2,
+            })
+        ids = db.scalars(
+            insert(AnalysisResult).returning(AnalysisResult.id, sort_by_parameter_order=True), rows
+        ).all()
+        zones = [
+            {
+                "analysis_id": analysis_id,
+                "risk_level": row["risk_level"],
+                "description": "Synthetic load-test zone",
+                "geometry_geojson": _zone_polygon(rng),
+            }
+            for analysis_id, row in zip(ids, rows)
+            for _ in range(zones_per_analysis)
+        ]
+        for zone_offset in range(0, len(zones), BATCH_SIZE):
+            db.execute(insert(RiskZone), zones[zone_offset:zone_offset + BATCH_SIZE])
+        db.commit()
+        created += len(rows)
+    return created
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the admin user and, optionally, synthetic load-test data.")
+    parser.add_argument("--users", type=int, default=0, help="number of load-test users to add")
+    parser.add_argument("--analyses", type=int, default=0, help="number of synthetic analysis results to add")
+    parser.add_argument("--zones-per-analysis", type=int, default=5, help="risk zones per synthetic analysis")
+    parser.add_argument("--password", default="loadtest", help="password of every load-test user")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes used for password hashing")
+    parser.add_argument("--reuse-hash", action="store_true",
+                        help="hash the password once and share it (fast, but not a realistic hashing workload)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for locations and analysis values")
+    args = parser.parse_args()
+
     print("Seeding database...")
     init_db()
+
+    rng = random.Random(args.seed)
+    if args.users or args.analyses:
+        db = SessionLocal()
+        try:
+            if args.users:
+                print(f"Creating {args.users} load-test users...")
+                print(f"{seed_users(db, args.users, args.password, args.workers, args.reuse_hash, rng)} users created.")
+            if args.analyses:
+                print(f"Creating {args.analyses} analyses with {args.zones_per_analysis} risk zones each...")
+                print(f"{seed_analyses(db, args.analyses, args.zones_per_analysis, rng)} analyses created.")
+        finally:
+            db.close()